@@ -0,0 +1,375 @@
+"""TTLマクロ生成のベンチマーク
+
+合成した台帳（既定では 1,000 / 10,000 / 100,000 行）に対して生成処理の各段階を個別に計測し、
+結果を JSON で出力する。バージョン間で JSON を比較すれば性能の劣化を確認できる。
+
+計測する段階:
+  load                  台帳の読み込み（load_inventory: openpyxl / pandas、xlsx / csv / jsonl）
+  load_cache_miss       台帳の読み込み（キャッシュなし。解析してキャッシュを保存）
+  load_cache_hit        台帳の読み込み（キャッシュから）
+  validate              台帳全体の検証（validate_inventory）
+  extract_row_data      行データの抽出
+  get_target_directory  出力ディレクトリの決定・作成
+  generate_ttl_content  TTLの描画
+  write                 TTLファイルの書き込み
+  write_bundle          同じ内容の zip バンドルへの書き込み（--bundle。索引の追加と確定を含む）
+  launcher_scan         ランチャーのマクロフォルダ走査（索引なしの初回。検索索引の作成を含む）
+  launcher_scan_cached  ランチャーのマクロフォルダ走査（索引あり・変更なし）
+  launcher_search_index ランチャーの検索索引の作成
+  launcher_bundle_scan  ランチャーのバンドル（zip）の索引読み込み
+
+--check-engines を指定した場合は計測の代わりに、同じ CSV・JSON Lines の台帳を openpyxl / pandas の両エンジンで
+読み込んで生成したTTLの内容を比較する（先頭の0・数字だけの文字列・空欄などの扱いが同じであることの確認）。
+
+使い方:
+  python bin/benchmark_generate.py
+  python bin/benchmark_generate.py --sizes 1000,10000 --engine pandas --output bench.json
+  python bin/benchmark_generate.py --format csv
+  python bin/benchmark_generate.py --baseline logs/benchmark_20250101_120000.json
+  python bin/benchmark_generate.py --check-engines --sizes 1000
+"""
+from __future__ import annotations
+
+import sys
+import argparse
+import csv
+import json
+import platform
+import queue
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+BIN_DIR = Path(__file__).resolve().parent
+BASE_DIR = BIN_DIR.parent
+TEMPLATE_PATH = BASE_DIR / "macros" / "template.ttl"
+LOGS_DIR = BASE_DIR / "logs"
+DEFAULT_SIZES = (1000, 10000, 100000)
+INPUT_FORMATS = ("xlsx", "csv", "jsonl")
+
+sys.path.insert(0, str(BIN_DIR))
+import generate_ttl_macros as gen
+
+# 合成データの材料
+COLUMNS = ["No.", "group1", "group2", "group3", "name", "host", "port", "user",
+           "password", "keyfile", "post_cmd", "generate", "memo"]
+SITES = ["東京DC", "大阪DC", "AWS", "Azure", "検証環境"]
+TIERS = ["prod", "stg", "dev"]
+ROLES = ["web", "app", "db", "batch", "proxy", "nas"]
+USERS = ["root", "admin", "ec2-user", "rocky", "ubuntu"]
+KEYFILES = ["id_rsa.ppk", "prod/web.ppk", "prod/db.ppk", "stg.pem"]
+POST_CMDS = ["", "", "sudo -i", "cd /var/log\ntail -n 50 messages", "df -h\nfree -m\nuptime"]
+MEMOS = ["", "本番系。作業前に申請が必要", "保守契約 2026/03 まで\n担当: インフラチーム", "検証用（いつ消してもよい）"]
+# --check-engines で使う台帳（エンジンによって値が変わりやすいもの）
+# 数字だけの文字列の列（列全体が数値に見えると pandas が型を推測して "007" を 7 にする）
+NUMERIC_TEXT_ROWS = [
+    [1, "2024", "01", None, "1001", "10.0.0.1", "022", "0", "007", None, "1.50", "yes", "42"],
+    [2, "2025", None, None, "1e3", "10.0.0.2", None, "1", "0012", None, None, "yes", "3.0"],
+]
+# 欠損値に見える文字列（合成データの先頭に加える）
+NA_LIKE_ROWS = [
+    [1, "NA", "null", None, "nan", "10.0.0.3", 22, "None", "true", None, "  indented", "yes", " "],
+]
+
+
+def synthesize_rows(rows: int, seed: int = 1) -> Iterator[list]:
+    """実運用に近い台帳の行を合成する（グループ階層は0〜3段、キーファイル・post_cmd・メモあり）"""
+    rnd = random.Random(seed)
+    for no in range(1, rows + 1):
+        depth = rnd.choices((0, 1, 2, 3), weights=(1, 2, 4, 3))[0]
+        groups = [rnd.choice(SITES), rnd.choice(TIERS), rnd.choice(ROLES)][:depth] + [None] * (3 - depth)
+        role = rnd.choice(ROLES)
+        keyfile = rnd.choice(KEYFILES) if rnd.random() < 0.3 else None
+        yield [
+            no, *groups,
+            f"{role}{no:06d}",
+            f"10.{no >> 16 & 255}.{no >> 8 & 255}.{no & 255}" if rnd.random() < 0.8 else f"{role}{no}.example.local",
+            rnd.choice((22, 22, 22, 2222, None)),
+            rnd.choice(USERS),
+            None if keyfile else f"pw{no}",
+            keyfile,
+            rnd.choice(POST_CMDS) or None,
+            "yes" if rnd.random() < 0.95 else "no",
+            rnd.choice(MEMOS) or None,
+        ]
+
+
+def synthesize_inventory(path: Path, rows: int, seed: int = 1) -> None:
+    """合成した台帳を拡張子に応じた形式（xlsx / csv / jsonl）で保存する"""
+    write_inventory(path, synthesize_rows(rows, seed))
+
+
+def write_inventory(path: Path, rows: Iterable[list]) -> None:
+    """台帳の行を拡張子に応じた形式（xlsx / csv / jsonl）で保存する"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == ".csv":
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            writer.writerows(["" if value is None else value for value in row] for row in rows)
+    elif path.suffix == ".jsonl":
+        with open(path, "w", encoding="utf-8") as f:
+            for row in rows:
+                obj = {name: value for name, value in zip(COLUMNS, row) if value is not None}
+                f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    else:
+        from openpyxl import Workbook
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(COLUMNS)
+        for row in rows:
+            ws.append(row)
+        wb.save(path)
+
+
+def point_generator_at(work_dir: Path, input_format: str) -> gen.PathConfig:
+    """作業ディレクトリを入出力先とするパスの設定を返す（テンプレートはリポジトリのものを使う）"""
+    paths = gen.PathConfig.under(
+        work_dir, input_path=work_dir / "data" / f"servers.{input_format}", template_path=TEMPLATE_PATH
+    )
+    for keyfile in KEYFILES:
+        key_path = paths.keys_dir / keyfile
+        key_path.parent.mkdir(parents=True, exist_ok=True)
+        key_path.write_text("dummy", encoding="utf-8")
+    return paths
+
+
+def timed(stages: Dict[str, float], name: str, func, *args):
+    """func を実行し、経過時間を stages[name] に加算する"""
+    started = time.perf_counter()
+    result = func(*args)
+    stages[name] = stages.get(name, 0.0) + time.perf_counter() - started
+    return result
+
+
+def write_file(ttl_file: Path, content: str) -> None:
+    ttl_file.write_text(content, encoding="utf-8")
+
+
+def bench_generate(paths: gen.PathConfig, engine: str, stages: Dict[str, float]) -> Dict[str, int]:
+    """読み込みから書き込みまでを段階ごとに計測する（生成対象の全行を1スレッドで処理）"""
+    template = gen.load_compiled_template(paths)
+    inventory = timed(stages, "load", gen.load_inventory, engine, paths.input_path)
+    # 台帳キャッシュ: 初回（解析＋保存）と2回目（キャッシュから読み込み）
+    timed(stages, "load_cache_miss", gen.load_inventory, engine, paths.input_path, None, paths.cache_dir)
+    timed(stages, "load_cache_hit", gen.load_inventory, engine, paths.input_path, None, paths.cache_dir)
+    validation = timed(stages, "validate", gen.validate_inventory, inventory, paths)
+
+    registry = gen.DirectoryRegistry()
+    bundle = gen.ArchiveSink(paths.base_dir / "macros.zip", template.hash, paths.output_dir)
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    written = errors = 0
+    for pos, is_target in enumerate(validation.targets):
+        if not is_target:
+            continue
+        if validation.errors.get(pos):
+            errors += 1
+            continue
+        _, row = inventory.records[pos]
+        data = timed(stages, "extract_row_data", gen.extract_row_data, row)
+        target_dir = timed(stages, "get_target_directory", gen.get_target_directory, data, paths.output_dir, registry)
+        content = timed(stages, "generate_ttl_content", gen.generate_ttl_content, data, template, timestamp,
+                        target_dir, paths.base_dir)
+        ttl_file = target_dir / f"{data['name']}_{data['host']}_{data['user']}.ttl"
+        timed(stages, "write", write_file, ttl_file, content)
+        entry = bundle.make_entry(data, str(pos + 1), "")
+        timed(stages, "write_bundle", bundle.write, ttl_file, content, entry)
+        written += 1
+    timed(stages, "write_bundle", bundle.close)
+    return {
+        "rows": len(inventory.records),
+        "written": written,
+        "errors": errors,
+        "directories": registry.prepared_count,
+    }
+
+
+def bench_launcher_scan(work_dir: Path, stages: Dict[str, float]) -> Optional[Dict[str, int]]:
+    """ランチャーのマクロフォルダ走査を計測する（tkinter が使えない環境では省略）"""
+    try:
+        import run_launcher as launcher
+    except ImportError as e:
+        print(f"⚠️ ランチャーの走査は計測しません（{e}）", file=sys.stderr)
+        return None
+    # 索引はリポジトリの bin/ ではなく作業ディレクトリに保存する
+    launcher.INDEX_FILE = work_dir / "macro_index.json"
+    macro_root = work_dir / "macros"
+
+    def scan(cached_dirs=None):
+        out_queue = queue.Queue()
+        launcher.scan_macro_tree(macro_root, out_queue, threading.Event(), cached_dirs)
+        return [message for message in iter(out_queue.get_nowait, ("done",))]
+
+    messages = timed(stages, "launcher_scan", scan)
+    dirs = launcher.load_macro_index(macro_root)
+    timed(stages, "launcher_scan_cached", scan, dirs)
+    index = next(message[1] for message in messages if message[0] == "index")
+    timed(stages, "launcher_search_index", launcher.MacroSearchIndex, dirs)
+    timed(stages, "launcher_bundle_scan", launcher.read_bundle_dirs, work_dir / "macros.zip")
+    return {"directories": len(dirs), "macros": len(index)}
+
+
+def render_all(paths: gen.PathConfig, engine: str) -> Dict[str, str]:
+    """台帳を読み込み、生成対象の行のTTLの内容を返す（出力先の相対パス → 内容。検証エラーの行は内容の代わりにエラー）"""
+    template = gen.load_compiled_template(paths)
+    inventory = gen.load_inventory(engine, paths.input_path)
+    validation = gen.validate_inventory(inventory, paths)
+    rendered = {}
+    for pos, is_target in enumerate(validation.targets):
+        if not is_target:
+            continue
+        _, row = inventory.records[pos]
+        if validation.errors.get(pos):
+            rendered[f"No.{pos + 1}"] = "; ".join(validation.errors[pos])
+            continue
+        data = gen.extract_row_data(row)
+        target_dir = gen.get_target_directory(data, paths.output_dir)
+        ttl_file = target_dir / f"{data['name']}_{data['host']}_{data['user']}.ttl"
+        rendered[gen.manifest_key(ttl_file, paths.output_dir)] = gen.generate_ttl_content(
+            data, template, "2000/01/01 00:00:00", target_dir, paths.base_dir
+        )
+    return rendered
+
+
+def check_engines(rows: int, seed: int) -> List[str]:
+    """CSV・JSON Lines の台帳を両エンジンで読み込み、生成内容の違いを返す（違いがなければ空）"""
+    differences = []
+    offset = len(NA_LIKE_ROWS)
+    ledgers = [NUMERIC_TEXT_ROWS, NA_LIKE_ROWS + [[row[0] + offset, *row[1:]] for row in synthesize_rows(rows, seed)]]
+    for input_format in ("csv", "jsonl"):
+        for inventory_rows in ledgers:
+            work_dir = Path(tempfile.mkdtemp(prefix=f"ttl_check_{input_format}_"))
+            try:
+                paths = point_generator_at(work_dir, input_format)
+                write_inventory(paths.input_path, inventory_rows)
+                print(f"🔍 {len(inventory_rows)} 行の台帳（{input_format}）を両エンジンで比較しています...",
+                      file=sys.stderr, flush=True)
+                results = {engine: render_all(paths, engine) for engine in gen.ENGINES}
+                base, other = (results[engine] for engine in gen.ENGINES)
+                for key in sorted(set(base) | set(other)):
+                    if base.get(key) != other.get(key):
+                        differences.append(f"{input_format}: {key}")
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    return differences
+
+
+def run_size(rows: int, engine: str, input_format: str, keep: bool, seed: int) -> Dict:
+    work_dir = Path(tempfile.mkdtemp(prefix=f"ttl_bench_{rows}_"))
+    try:
+        paths = point_generator_at(work_dir, input_format)
+        print(f"📝 {rows} 行の台帳（{input_format}）を合成しています...", file=sys.stderr, flush=True)
+        synthesize_inventory(paths.input_path, rows, seed)
+        paths.output_dir.mkdir(parents=True, exist_ok=True)
+
+        stages: Dict[str, float] = {}
+        started = time.perf_counter()
+        counts = bench_generate(paths, engine, stages)
+        stages["total"] = time.perf_counter() - started
+        scan_counts = bench_launcher_scan(work_dir, stages)
+
+        result = {
+            "rows": rows,
+            "counts": counts,
+            "stages": {name: round(seconds, 6) for name, seconds in stages.items()},
+            "per_row_us": {
+                name: round(seconds / rows * 1e6, 3) for name, seconds in stages.items() if rows
+            },
+        }
+        if scan_counts is not None:
+            result["launcher"] = scan_counts
+        if keep:
+            result["work_dir"] = str(work_dir)
+        return result
+    finally:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_table(results: List[Dict], baseline: Optional[Dict]) -> None:
+    """結果を表形式で表示する（baseline があれば比率も表示）"""
+    base_by_rows = {r["rows"]: r for r in (baseline or {}).get("results", [])}
+    for result in results:
+        print(f"\n=== {result['rows']} 行 ===", file=sys.stderr)
+        base = base_by_rows.get(result["rows"], {}).get("stages", {})
+        for name, seconds in result["stages"].items():
+            line = f"  {name:<24}{seconds:>10.3f} s"
+            if base.get(name):
+                line += f"  （基準比 {seconds / base[name]:.2f}x）"
+            print(line, file=sys.stderr)
+
+
+def parse_sizes(value: str) -> List[int]:
+    try:
+        sizes = [int(v) for v in value.split(",") if v.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"行数はカンマ区切りの整数で指定してください: {value}")
+    if not sizes or min(sizes) < 1:
+        raise argparse.ArgumentTypeError(f"行数は1以上で指定してください: {value}")
+    return sizes
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="TTLマクロ生成のベンチマーク（合成した台帳で各段階を計測）")
+    parser.add_argument("--sizes", type=parse_sizes, default=list(DEFAULT_SIZES),
+                        help="台帳の行数（カンマ区切り、既定: 1000,10000,100000）")
+    parser.add_argument("--engine", choices=gen.ENGINES, default=gen.DEFAULT_ENGINE,
+                        help=f"台帳の読み込みエンジン（既定: {gen.DEFAULT_ENGINE}）")
+    parser.add_argument("--format", dest="input_format", choices=INPUT_FORMATS, default="xlsx",
+                        help="合成する台帳の形式（既定: xlsx）")
+    parser.add_argument("--check-engines", action="store_true",
+                        help="計測の代わりに、CSV・JSON Lines の台帳を両エンジンで読み込んだ生成結果が同じかを確認する")
+    parser.add_argument("--output", help="結果JSONの出力先（既定: logs/benchmark_日時.json、- で標準出力）")
+    parser.add_argument("--baseline", help="比較する過去の結果JSON")
+    parser.add_argument("--seed", type=int, default=1, help="合成データの乱数シード（既定: 1）")
+    parser.add_argument("--keep", action="store_true", help="作業ディレクトリ（合成した台帳・生成したTTL）を残す")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.engine == "pandas" or args.check_engines:
+        gen.import_pandas()
+    if args.check_engines:
+        differences = check_engines(min(args.sizes), args.seed)
+        for difference in differences[:20]:
+            print(f"❌ エンジンによって内容が異なります: {difference}", file=sys.stderr)
+        if differences:
+            sys.exit(1)
+        print("✅ 両エンジンの生成結果は一致しました", file=sys.stderr)
+        return
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = [run_size(rows, args.engine, args.input_format, args.keep, args.seed) for rows in args.sizes]
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "engine": args.engine,
+        "format": args.input_format,
+        "seed": args.seed,
+        "results": results,
+    }
+    print_table(results, baseline)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output == "-":
+        print(text)
+        return
+    output = Path(args.output) if args.output else LOGS_DIR / f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(text + "\n", encoding="utf-8")
+    print(f"\n✅ 結果を保存しました: {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,74 +3,453 @@ from __future__ import annotations
 
 # 最初に使用中の Python を表示（pandas は後でインポートするのでここでは落ちない）
 import sys
-print("使用中の Python:", sys.executable, file=sys.stderr, flush=True)
-# Python 3.14 では pandas/numpy のネイティブ拡張が未対応で import 時に落ちるためチェック
-print("TTLマクロ生成を開始しています...", file=sys.stderr, flush=True)
+import time
+# --profile の「imports」フェーズの起点
+STARTED_AT = time.perf_counter()
+# 台帳を並列に読み込むワーカープロセス（spawn）はこのファイルを再インポートするため、表示はスクリプト実行時のみ
+if __name__ == "__main__":
+    print("使用中の Python:", sys.executable, file=sys.stderr, flush=True)
+    # Python 3.14 では pandas/numpy のネイティブ拡張が未対応で import 時に落ちるためチェック
+    print("TTLマクロ生成を開始しています...", file=sys.stderr, flush=True)
 
-# pandas は generate_ttl_macros() 内で遅延インポート（import で落ちる環境でもスクリプトは起動する）
+# pandas は import_pandas() で遅延インポート（import で落ちる環境でもスクリプトは起動する）
+# 既定の openpyxl エンジンでは pandas をインポートしない
 pd = None
+# 一部のオプションでしか使わないモジュール（asyncio・multiprocessing・zipfile・tarfile・pickle・csv・difflib など）も
+# 使う関数の中でインポートする（起動時間を増やさない）
 
 from pathlib import Path
 from datetime import datetime
 import re
 import math
 import logging
+import logging.handlers
 import argparse
 import traceback
 import ipaddress
-from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+import os
+import bisect
+import fnmatch
+import threading
+import queue
+import atexit
+import io
+from collections import deque
+from collections.abc import Mapping
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-# 各種パスの定義
+# このスクリプトのあるプロジェクトのルート（各種パスの既定値の基準）
 BASE_DIR = Path(__file__).resolve().parent.parent
-EXCEL_PATH = BASE_DIR / "data" / "servers.xlsx"
-TEMPLATE_PATH = BASE_DIR / "macros" / "template.ttl"
-OUTPUT_DIR = BASE_DIR / "macros"
-LOGS_DIR = BASE_DIR / "logs"
-KEYS_DIR = BASE_DIR / "keys"
+MANIFEST_VERSION = 1
+# 読み込み済み台帳のキャッシュ（台帳のサイズ・更新日時・SHA-256 が一致すれば再解析しない）
+CACHE_VERSION = 1
+
+@dataclass(frozen=True)
+class PathConfig:
+    """生成に使う各種パス（モジュール変数ではなく、使う関数に引数で渡す）
+
+    input_path は台帳を指定しなかった場合に読み込む台帳（複数指定した場合は計測結果などに記録する代表のパス）。
+    """
+    base_dir: Path
+    input_path: Path
+    template_path: Path
+    output_dir: Path
+    logs_dir: Path
+    keys_dir: Path
+    cache_dir: Path
+
+    @classmethod
+    def under(cls, base_dir: Path, **overrides: Optional[Path]) -> PathConfig:
+        """base_dir の下の既定の構成（data/servers.xlsx・macros/・logs/・keys/・.cache/）。None 以外の overrides で個別に指定する"""
+        base_dir = Path(base_dir).resolve()
+        paths = {
+            "input_path": base_dir / "data" / "servers.xlsx",
+            "template_path": base_dir / "macros" / "template.ttl",
+            "output_dir": base_dir / "macros",
+            "logs_dir": base_dir / "logs",
+            "keys_dir": base_dir / "keys",
+            "cache_dir": base_dir / ".cache",
+        }
+        paths.update({name: Path(path).resolve() for name, path in overrides.items() if path is not None})
+        return cls(base_dir=base_dir, **paths)
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.output_dir / ".manifest"
+
+    @property
+    def probe_report_path(self) -> Path:
+        return self.logs_dir / "probe_report.json"
+
+    @property
+    def probe_cache_path(self) -> Path:
+        return self.cache_dir / "probe_cache.json"
+
+# テンプレートで使用できるプレースホルダー（{name} 形式）
+PLACEHOLDERS = (
+    "hostname", "port", "username", "password", "keyfile",
+    "name", "rel_path", "created_at", "memo", "post_commands",
+)
+PLACEHOLDER_PATTERN = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)\}")
+
+# 共通ライブラリ（--include-common）: テンプレートの目印で囲んだ区間を macros/ 直下に1回だけ出力する
+COMMON_BEGIN_PATTERN = re.compile(r"^;;\s*@common-begin\b.*\n?", re.MULTILINE)
+COMMON_END_PATTERN = re.compile(r"^;;\s*@common-end\b.*\n?", re.MULTILINE)
+COMMON_LIBRARY_NAME = "ttmacro_common.ttl"
+# 各マクロで共通区間の代わりに置く行（ライブラリの位置は {rel_path} の変数 rel_path から求める）
+# rel_path はプロジェクトのルートを指すため、先頭の '../' を除いてマクロのルート（macros/）からの相対パスにする。
+# macros/ の名前を含めないので、ランチャーがバンドルから展開した場合も同じ階層のライブラリを読み込む
+COMMON_INCLUDE_LINES = (
+    ";; 共通処理（マクロのルートの {library}）を読み込む\n"
+    "strlen rel_path\n"
+    "strcopy rel_path {start} result-{skip} common_path\n"
+    "getdir library_path\n"
+    "strconcat library_path '/'\n"
+    "strconcat library_path common_path\n"
+    "strconcat library_path '{library}'\n"
+    "include library_path\n"
+)
+COMMON_LIBRARY_HEADER = (
+    ";=================================================\n"
+    "; TTLマクロ共通ライブラリ（generate_ttl_macros.py --include-common で生成。直接編集しないこと）\n"
+    ";=================================================\n"
+    "\n"
+)
+
+# 台帳の読み込みエンジン（openpyxl: ストリーミング読み込み / pandas: DataFrame 経由）
+ENGINES = ("openpyxl", "pandas")
+DEFAULT_ENGINE = "openpyxl"
 
 # ログ設定
-def setup_logging():
-    """ログ設定を行う"""
-    log_file = LOGS_DIR / "generate.log"
-    LOGS_DIR.mkdir(exist_ok=True)
+# ログの種類（logger の extra に指定する）
+ROW_DETAIL = {"row_detail": True}      # 行ごとの詳細（通常はログファイルのみ。--verbose でコンソールにも出す）
+SUMMARY = {"summary": True}            # サマリー（--quiet でもコンソールに出す）
+CONSOLE_ONLY = {"console_only": True}  # 進捗表示（ログファイルには書かない）
+STEP = {"console_only": True, "summary": True}  # 処理の段階（--quiet でもコンソールに出し、ログファイルには書かない）
+PROGRESS_INTERVAL = 2.0  # 進捗を表示する間隔（秒）
+LOG_MAX_BYTES = 10 * 1024 * 1024  # generate.log がこのサイズを超えたら generate.log.1 〜 に切り替える
+LOG_BACKUP_COUNT = 5              # 残す世代数
+# MacroGenerator（ランチャーの再生成など）のログ。generate.log とは別のファイルで、切り替えは行わない
+INPROCESS_LOG_NAME = "generate_inprocess.log"
+
+class ConsoleFilter(logging.Filter):
+    """出力レベルに応じてコンソールに出すログを選ぶ"""
+
+    def __init__(self, verbosity: str):
+        super().__init__()
+        self.verbosity = verbosity
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "summary", False):
+            return True
+        if self.verbosity == "quiet":
+            return record.levelno >= logging.WARNING
+        if self.verbosity == "normal" and getattr(record, "row_detail", False):
+            return False
+        return True
+
+class FileFilter(logging.Filter):
+    """進捗表示はログファイルに書かない"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not getattr(record, "console_only", False)
+
+# ファイル・コンソールへの書き込みを行うリスナー（setup_logging で開始し、終了時に停止）
+_log_listener: Optional[logging.handlers.QueueListener] = None
+_log_handlers: List[logging.Handler] = []
+
+def stop_logging() -> None:
+    """キューに残ったログを書き出してリスナーを停止する"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+        for handler in _log_handlers:
+            handler.close()
+
+def setup_logging(logs_dir: Path, verbosity: str = "normal"):
+    """ログ設定を行う（logs_dir/generate.log とコンソールに出力する）
+
+    行の処理がファイル・コンソールへの書き込みで待たされないよう、ロガーには QueueHandler だけを付け、
+    実際の書き込みは QueueListener のスレッドで行う。generate.log はサイズで切り替える（切り替えもリスナーのスレッドで行う）。
+    """
+    global _log_listener
+    log_file = logs_dir / "generate.log"
+    logs_dir.mkdir(exist_ok=True)
+    stop_logging()
     
     # ログフォーマットの設定
     formatter = logging.Formatter('[%(asctime)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
     
     # ファイルハンドラの設定
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+    )
     file_handler.setFormatter(formatter)
+    file_handler.addFilter(FileFilter())
     
     # コンソールハンドラ（stderr に明示）
     console_handler = logging.StreamHandler(sys.stderr)
     console_handler.setFormatter(formatter)
+    console_handler.addFilter(ConsoleFilter(verbosity))
+    
+    _log_handlers[:] = [file_handler, console_handler]
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler)
+    _log_listener.start()
     
     # ロガーの設定（既存ハンドラをクリアしてから追加）
     logger = logging.getLogger('generate')
     logger.handlers.clear()
     logger.setLevel(logging.INFO)
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
     logger.propagate = False
     
     return logger
 
+# sys.exit() で終了した場合もキューに残ったログを書き出す
+atexit.register(stop_logging)
+
+class ProgressReporter:
+    """行ごとのログの代わりに、一定間隔で進捗をコンソールに出す"""
+
+    def __init__(self, logger: logging.Logger, total: int, enabled: bool, interval: float = PROGRESS_INTERVAL):
+        self.logger = logger
+        self.total = total
+        self.enabled = enabled and total > 0
+        self.interval = interval
+        self.next_at = time.monotonic() + interval
+
+    def update(self, done: int) -> None:
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now >= self.next_at:
+            self.next_at = now + self.interval
+            self.logger.info(f"⏳ 処理中: {done}/{self.total} 行（{done * 100 // self.total}%）", extra=CONSOLE_ONLY)
+
+def get_verbosity(args: GenerateOptions) -> str:
+    """--quiet / --verbose から出力レベルを決める"""
+    if args.quiet:
+        return "quiet"
+    if args.verbose:
+        return "verbose"
+    return "normal"
+
+class Profiler:
+    """--profile 指定時の計測（フェーズごとの経過時間・行ごとの処理時間・ファイル操作の回数）
+
+    無効な場合は何も記録しない。描画・書き込みはワーカースレッドからも記録されるためロックで保護する。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.phases: Dict[str, float] = {}
+        self.cumulative: Dict[str, float] = {}
+        self.row_times: List[float] = []
+        self.fs_ops: Dict[str, int] = {}
+        self.inputs: List[str] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        """with ブロックの経過時間をフェーズとして記録する"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def add_time(self, name: str, seconds: float) -> None:
+        """行ごとに繰り返す処理（描画・書き込み）の累計時間を加算する"""
+        if self.enabled:
+            with self._lock:
+                self.cumulative[name] = self.cumulative.get(name, 0.0) + seconds
+
+    def add_row(self, seconds: float) -> None:
+        if self.enabled:
+            self.row_times.append(seconds)
+
+    def count(self, op: str, n: int = 1) -> None:
+        """ファイル操作の回数を数える"""
+        if self.enabled:
+            with self._lock:
+                self.fs_ops[op] = self.fs_ops.get(op, 0) + n
+
+    def row_stats(self) -> Dict[str, float]:
+        """行ごとの処理時間の統計（ミリ秒）"""
+        times = sorted(self.row_times)
+        if not times:
+            return {"count": 0}
+
+        def percentile(p: float) -> float:
+            return times[min(len(times) - 1, max(0, math.ceil(p / 100 * len(times)) - 1))] * 1000
+
+        return {
+            "count": len(times),
+            "mean_ms": round(sum(times) / len(times) * 1000, 3),
+            "p50_ms": round(percentile(50), 3),
+            "p90_ms": round(percentile(90), 3),
+            "p99_ms": round(percentile(99), 3),
+            "max_ms": round(times[-1] * 1000, 3),
+        }
+
+    def report(self, args, paths: PathConfig) -> Dict:
+        return {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "engine": args.engine,
+            "jobs": args.jobs,
+            "incremental": args.incremental,
+            "excel_path": str(paths.input_path),
+            "inputs": self.inputs,
+            "output_dir": str(paths.output_dir),
+            "phases_sec": {name: round(sec, 6) for name, sec in self.phases.items()},
+            "cumulative_sec": {name: round(sec, 6) for name, sec in self.cumulative.items()},
+            "rows": self.row_stats(),
+            "fs_ops": dict(sorted(self.fs_ops.items())),
+        }
+
+    def write_report(self, args, paths: PathConfig, logger: logging.Logger) -> None:
+        """計測結果をログに要約し、JSON を logs/ に書き出す"""
+        phases = ", ".join(f"{name} {sec:.3f}s" for name, sec in self.phases.items())
+        logger.info(f"⏱️ フェーズ別の経過時間: {phases}", extra=SUMMARY)
+        stats = self.row_stats()
+        if stats["count"]:
+            logger.info(
+                f"⏱️ 行ごとの処理時間: p50 {stats['p50_ms']}ms, p90 {stats['p90_ms']}ms, "
+                f"p99 {stats['p99_ms']}ms, 最大 {stats['max_ms']}ms（{stats['count']} 行）",
+                extra=SUMMARY
+            )
+        ops = ", ".join(f"{op} {n}" for op, n in sorted(self.fs_ops.items()))
+        logger.info(f"⏱️ ファイル操作: {ops or 'なし'}", extra=SUMMARY)
+        report_path = paths.logs_dir / f"profile_{datetime.now():%Y%m%d_%H%M%S}.json"
+        try:
+            report_path.write_text(json.dumps(self.report(args, paths), ensure_ascii=False, indent=2), encoding="utf-8")
+            logger.info(f"⏱️ 計測結果を保存しました: {report_path}", extra=SUMMARY)
+        except OSError as e:
+            logger.warning(f"⚠️ 計測結果の保存に失敗しました: {report_path} - {str(e)}")
+
+# --profile 指定時のみ有効にする
+profiler = Profiler()
+
 # TTLテンプレート読み込み
-def load_template() -> str:
+def load_template(template_path: Path) -> str:
     """TTLテンプレートを読み込む"""
-    if not TEMPLATE_PATH.exists():
-        raise FileNotFoundError(f"テンプレートファイルが見つかりません: {TEMPLATE_PATH}")
+    if not template_path.exists():
+        raise FileNotFoundError(f"テンプレートファイルが見つかりません: {template_path}")
     
     try:
-        content = TEMPLATE_PATH.read_text(encoding="utf-8")
+        profiler.count("read_template")
+        content = template_path.read_text(encoding="utf-8")
         if not content.strip():
             raise ValueError("テンプレートファイルが空です")
         return content
     except UnicodeDecodeError:
-        raise ValueError(f"テンプレートファイルの文字エンコーディングが不正です: {TEMPLATE_PATH}")
+        raise ValueError(f"テンプレートファイルの文字エンコーディングが不正です: {template_path}")
     except Exception as e:
         raise RuntimeError(f"テンプレートファイル読み込みエラー: {str(e)}")
 
+def split_common_section(source: str) -> Tuple[str, Optional[str], str]:
+    """テンプレートを共通区間の目印で (前, 共通区間, 後) に分ける（目印がなければ共通区間は None）"""
+    begins = list(COMMON_BEGIN_PATTERN.finditer(source))
+    ends = list(COMMON_END_PATTERN.finditer(source))
+    if not begins and not ends:
+        return source, None, ""
+    if len(begins) != 1 or len(ends) != 1 or ends[0].start() < begins[0].end():
+        raise ValueError("テンプレートの共通区間の目印（;; @common-begin / ;; @common-end）は1組だけ、この順で記述してください")
+    begin, end = begins[0], ends[0]
+    return source[:begin.start()], source[begin.end():end.start()], source[end.end():]
+
+def build_template_sources(source: str, include_common: bool, paths: PathConfig) -> Tuple[str, Optional[str]]:
+    """マクロ1件分のテンプレートと共通ライブラリの内容を返す
+
+    通常は目印の行だけを取り除いたテンプレートを返す（共通ライブラリは None）。
+    include_common=True の場合は共通区間をライブラリとして切り出し、マクロ側には include の行を置く。
+    """
+    head, common, tail = split_common_section(source)
+    if common is None:
+        if include_common:
+            raise ValueError("テンプレートに共通区間の目印（;; @common-begin / ;; @common-end）がありません")
+        return source, None
+    if not include_common:
+        return head + common + tail, None
+    used = sorted({m.group(1) for m in PLACEHOLDER_PATTERN.finditer(common)} & set(PLACEHOLDERS))
+    if used:
+        raise ValueError(f"共通区間ではプレースホルダーを使用できません: {', '.join('{' + key + '}' for key in used)}")
+    skip = len("../") * len(paths.output_dir.relative_to(paths.base_dir).parts)
+    include_lines = COMMON_INCLUDE_LINES.format(library=COMMON_LIBRARY_NAME, start=skip + 1, skip=skip)
+    return head + include_lines + tail, COMMON_LIBRARY_HEADER + common
+
+class CompiledTemplate:
+    """リテラルとプレースホルダーの区間に分解済みのテンプレート（1回の join で描画する）
+
+    library は --include-common 時の共通ライブラリの内容（通常は None）。
+    hash はマクロ1件分のテンプレートのハッシュで、共通ライブラリだけの変更では変わらない。
+    """
+    __slots__ = ("source", "hash", "segments", "placeholders", "unknown", "library")
+
+    def __init__(self, source: str, library: Optional[str] = None):
+        self.source = source
+        self.hash = hash_text(source)
+        self.library = library
+        # (プレースホルダーか, 文字列) のリスト。未知のプレースホルダーはリテラルのまま残す
+        self.segments: List[Tuple[bool, str]] = []
+        self.placeholders: List[str] = []
+        self.unknown: List[str] = []
+        pos = 0
+        literal = []
+        for m in PLACEHOLDER_PATTERN.finditer(source):
+            key = m.group(1)
+            literal.append(source[pos:m.start()])
+            pos = m.end()
+            if key not in PLACEHOLDERS:
+                literal.append(m.group(0))
+                if key not in self.unknown:
+                    self.unknown.append(key)
+                continue
+            self.segments.append((False, "".join(literal)))
+            self.segments.append((True, key))
+            literal = []
+            if key not in self.placeholders:
+                self.placeholders.append(key)
+        literal.append(source[pos:])
+        self.segments.append((False, "".join(literal)))
+
+    def render(self, values: Dict[str, str]) -> str:
+        """プレースホルダーを値で置き換えた文字列を返す（値の中の {...} は再置換しない）"""
+        return "".join(values[text] if is_field else text for is_field, text in self.segments)
+
+# コンパイル済みテンプレートのキャッシュ（同一プロセス内の再実行で使い回す）
+# (テンプレート, base_dir, 出力先, include_common) → ((更新日時, サイズ), コンパイル結果)
+_template_cache: Dict[Tuple[str, str, str, bool], Tuple[Tuple[int, int], CompiledTemplate]] = {}
+
+def load_compiled_template(paths: PathConfig, include_common: bool = False) -> CompiledTemplate:
+    """テンプレートを読み込んでコンパイルする（ファイルが変わっていなければキャッシュを返す）
+
+    include_common=True の場合は共通区間を共通ライブラリ（library）として切り出す。
+    """
+    template_path = paths.template_path
+    try:
+        profiler.count("stat")
+        st = template_path.stat()
+    except FileNotFoundError:
+        raise FileNotFoundError(f"テンプレートファイルが見つかりません: {template_path}")
+    # 共通ライブラリの include の行は出力先の階層で変わるため、出力先もキーに含める
+    cache_key = (str(template_path), str(paths.base_dir), str(paths.output_dir), include_common)
+    signature = (st.st_mtime_ns, st.st_size)
+    cached = _template_cache.get(cache_key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    compiled = CompiledTemplate(*build_template_sources(load_template(template_path), include_common, paths))
+    _template_cache[cache_key] = (signature, compiled)
+    return compiled
+
 def sanitize_name(name: str) -> str:
     """Windows禁止文字を _ に置換"""
     return re.sub(r'[\\/:*?"<>|]', '_', name)
@@ -81,67 +460,969 @@ def safe_str(val) -> str:
         return ""
     return str(val).strip()
 
-def safe_get(row: pd.Series, key: str, default: str = "") -> str:
+def is_na(val) -> bool:
+    """None / NaN（pandas の欠損値を含む）を欠損値として判定"""
+    if val is None:
+        return True
+    if isinstance(val, float):
+        return math.isnan(val)
+    if pd is not None:
+        try:
+            return bool(pd.isna(val))
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def safe_get(row: Mapping, key: str, default: str = "") -> str:
     """行データから安全に値を取得し、NaNの場合はデフォルト値を返す"""
     value = row.get(key, default)
-    return str(value if pd.notna(value) else default).strip()
+    return str(value if not is_na(value) else default).strip()
+
+def is_blank_row(row: Mapping) -> bool:
+    """すべての列が空の行かどうか"""
+    return all(is_na(value) for value in row.values())
+
+class RowRecord(Mapping):
+    """台帳の1行（列名 → 値）。列名のインデックスは全行で共有する軽量レコード"""
+    __slots__ = ("_index", "_values")
+
+    def __init__(self, index: Dict[str, int], values: tuple):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key: str):
+        pos = self._index[key]
+        return self._values[pos] if pos < len(self._values) else None
 
-def load_excel_data() -> pd.DataFrame:
-    """Excelファイルを読み込む"""
-    if not EXCEL_PATH.exists():
-        raise FileNotFoundError(f"Excelファイルが見つかりません: {EXCEL_PATH}")
+    def get(self, key: str, default=None):
+        pos = self._index.get(key)
+        if pos is None:
+            return default
+        return self._values[pos] if pos < len(self._values) else None
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __repr__(self) -> str:
+        return f"RowRecord({dict(self)!r})"
+
+def build_column_index(header) -> Tuple[List[str], Dict[str, int]]:
+    """ヘッダー行から列名リストと列名→位置の辞書を作る（pandas と同じく空欄・重複を補正）"""
+    columns = []
+    seen: Dict[str, int] = {}
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if is_na(name) or str(name).strip() == "" else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns, {name: i for i, name in enumerate(columns)}
+
+def import_pandas():
+    """pandas を遅延インポートする（失敗時は案内を付けた ImportError）"""
+    global pd
+    if pd is None:
+        try:
+            import pandas as _pd
+            pd = _pd
+        except Exception as e:
+            raise ImportError(
+                f"pandas のインポートに失敗しました: {e}\n"
+                "仮想環境を有効にして、pip install pandas openpyxl を実行してください。"
+            ) from e
+    return pd
+
+def load_excel_data(path: Path, sheet: Optional[str] = None) -> pd.DataFrame:
+    """Excelファイルを読み込む（pandas エンジン。sheet を省略した場合は先頭シート）"""
+    if not path.exists():
+        raise FileNotFoundError(f"Excelファイルが見つかりません: {path}")
     
     try:
-        with open(EXCEL_PATH, 'rb') as f:
-            df = pd.read_excel(f, engine="openpyxl")
+        profiler.count("read_excel")
+        with open(path, 'rb') as f:
+            df = pd.read_excel(f, engine="openpyxl", sheet_name=sheet if sheet is not None else 0)
             if df.empty:
                 raise ValueError("Excelファイルが空です")
             return df
     except PermissionError:
-        raise PermissionError(f"Excelファイルが他で開かれています: {EXCEL_PATH}")
+        raise PermissionError(f"Excelファイルが他で開かれています: {path}")
     except Exception as e:
         raise RuntimeError(f"Excelファイル読み込みエラー: {str(e)}")
 
-def validate_row_data(row: pd.Series, row_num: int) -> Tuple[bool, List[str]]:
+def open_workbook(source):
+    """openpyxl の読み取り専用モードでブックを開く（source はパスまたはファイルオブジェクト）"""
+    try:
+        from openpyxl import load_workbook
+    except Exception as e:
+        raise RuntimeError(f"openpyxl のインポートに失敗しました: {str(e)}（pip install openpyxl を実行してください）")
+    # data_only=True で数式（No. 列の =ROW() など）は計算済みの値を読む
+    return load_workbook(source, read_only=True, data_only=True)
+
+def iter_excel_rows(path: Path, sheet: Optional[str] = None) -> Iterator[tuple]:
+    """openpyxl の読み取り専用モードでシート（省略時は先頭シート）の行（値のタプル）を順に返す"""
+    profiler.count("read_excel")
+    with open(path, 'rb') as f:
+        wb = open_workbook(f)
+        try:
+            if sheet is None:
+                worksheet = wb.worksheets[0]
+            elif sheet in wb.sheetnames:
+                worksheet = wb[sheet]
+            else:
+                raise ValueError(f"シート '{sheet}' が見つかりません")
+            yield from worksheet.iter_rows(values_only=True)
+        finally:
+            wb.close()
+
+def list_sheet_names(path: Path) -> List[str]:
+    """Excel ブックのシート名の一覧"""
+    if not path.exists():
+        raise FileNotFoundError(f"台帳ファイルが見つかりません: {path}")
+    with open(path, 'rb') as f:
+        wb = open_workbook(f)
+        try:
+            return list(wb.sheetnames)
+        finally:
+            wb.close()
+
+# Excel では数値として読まれる列（CSV・JSON Lines の文字列も数値に変換する）
+NUMERIC_COLUMNS = ("No.", "port")
+
+def to_number(value):
+    """数値に変換できる文字列は int / float にする（変換できなければそのまま返し、検証でエラーにする）"""
+    if not isinstance(value, str):
+        return value
+    text = value.strip()
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return value
+
+def normalize_text_rows(rows: Iterator[tuple]) -> Iterator[tuple]:
+    """CSV・JSON Lines の行を Excel（openpyxl）で読んだ値と同じ形にそろえる
+
+    空文字列は空セル（None）とし、No. と port は数値に変換する。
+    これにより safe_get / safe_str / is_na による空欄の扱いが Excel と同じになる。
+    """
+    header = next(rows, None)
+    if header is None:
+        return
+    yield header
+    numeric = [pos for pos, name in enumerate(header) if name in NUMERIC_COLUMNS]
+    for values in rows:
+        values = [None if value == "" else value for value in values]
+        for pos in numeric:
+            if pos < len(values):
+                values[pos] = to_number(values[pos])
+        yield tuple(values)
+
+def iter_csv_rows(path: Path, sheet: Optional[str] = None) -> Iterator[tuple]:
+    """CSV（UTF-8、BOM 付きも可）の行を順に返す（1行目は列名。シートはないため sheet は使わない）"""
+    import csv
+    profiler.count("read_input")
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        yield from normalize_text_rows(tuple(row) for row in csv.reader(f))
+
+def iter_jsonl_rows(path: Path, sheet: Optional[str] = None) -> Iterator[tuple]:
+    """JSON Lines（1行に1オブジェクト）の行を列名・値のタプルに変換して返す
+
+    列はオブジェクトのキーに最初に現れた順で並べ、キーがない行の値は空欄とする。
+    """
+    profiler.count("read_input")
+    objects = []
+    columns: Dict[str, None] = {}
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{line_no}行目の JSON が不正です: {str(e)}")
+            if not isinstance(obj, dict):
+                raise ValueError(f"{line_no}行目がオブジェクトではありません")
+            objects.append(obj)
+            columns.update(dict.fromkeys(obj))
+    header = tuple(columns)
+    rows = (tuple(obj.get(name) for name in header) for obj in objects)
+    yield from normalize_text_rows(iter([header, *rows]))
+
+# 台帳の形式（拡張子） → 行を読み込む関数（引数は台帳のパスとシート名）
+INPUT_READERS: Dict[str, Callable[[Path, Optional[str]], Iterator[tuple]]] = {
+    ".xlsx": iter_excel_rows,
+    ".xlsm": iter_excel_rows,
+    ".csv": iter_csv_rows,
+    ".jsonl": iter_jsonl_rows,
+    ".ndjson": iter_jsonl_rows,
+}
+
+def get_input_reader(path: Path) -> Callable[[Path, Optional[str]], Iterator[tuple]]:
+    """拡張子から台帳の読み込み関数を選ぶ"""
+    reader = INPUT_READERS.get(path.suffix.lower())
+    if reader is None:
+        supported = ", ".join(INPUT_READERS)
+        raise ValueError(f"対応していない台帳の形式です: {path.name}（対応: {supported}）")
+    return reader
+
+def load_input_rows(path: Path, sheet: Optional[str] = None) -> Tuple[List[str], List[Tuple[int, RowRecord]]]:
+    """台帳を pandas を使わずにストリーミングで読み込む（openpyxl エンジン。CSV・JSON Lines も可）"""
+    if not path.exists():
+        raise FileNotFoundError(f"台帳ファイルが見つかりません: {path}")
+    reader = get_input_reader(path)
+    
+    try:
+        rows = reader(path, sheet)
+        header = next(rows, None)
+        if header is None:
+            raise ValueError("台帳ファイルが空です")
+        columns, index = build_column_index(header)
+        records = [(idx, RowRecord(index, values)) for idx, values in enumerate(rows)]
+        # pandas と同様、末尾の空白行は読み込まない
+        while records and is_blank_row(records[-1][1]):
+            records.pop()
+        if not records:
+            raise ValueError("台帳ファイルが空です")
+        return columns, records
+    except PermissionError:
+        raise PermissionError(f"台帳ファイルが他で開かれています: {path}")
+    except Exception as e:
+        raise RuntimeError(f"台帳ファイル読み込みエラー: {str(e)}")
+
+def load_input_frame(path: Path, sheet: Optional[str] = None) -> pd.DataFrame:
+    """台帳を DataFrame として読み込む（pandas エンジン）"""
+    suffix = path.suffix.lower()
+    if get_input_reader(path) is iter_excel_rows:
+        return load_excel_data(path, sheet)
+    if not path.exists():
+        raise FileNotFoundError(f"台帳ファイルが見つかりません: {path}")
+    try:
+        profiler.count("read_input")
+        if suffix == ".csv":
+            # 型を推測させない（"007" が 7 に、"2024" が 2024.0 になるのを防ぐ）。数値にするのは No. と port だけ
+            df = pd.read_csv(path, encoding="utf-8-sig", dtype=str, keep_default_na=False)
+        else:
+            df = pd.read_json(path, lines=True, dtype=False, convert_dates=False)
+        # 空文字列は空セルとして扱う（openpyxl エンジンの normalize_text_rows と同じ）
+        df = df.mask(df.eq(""))
+        # No. と port は Excel と同様に値ごとに数値にし、すべて数値なら数値列にする
+        for column in NUMERIC_COLUMNS:
+            if column in df.columns and not pd.api.types.is_numeric_dtype(df[column]):
+                values = df[column].map(to_number)
+                numbers = pd.to_numeric(values, errors="coerce")
+                df[column] = numbers if numbers.isna().sum() == values.isna().sum() else values
+        if df.empty:
+            raise ValueError("台帳ファイルが空です")
+        return df
+    except PermissionError:
+        raise PermissionError(f"台帳ファイルが他で開かれています: {path}")
+    except Exception as e:
+        raise RuntimeError(f"台帳ファイル読み込みエラー: {str(e)}")
+
+class Inventory:
+    """読み込んだ台帳（列名・行レコード。pandas エンジンの場合は DataFrame も保持する）
+
+    複数の台帳・シートをまとめた場合、shard_ids は行位置ごとの読み込み元（shard_labels のインデックス）。
+    1つだけの場合は None。
+    """
+    __slots__ = ("columns", "records", "frame", "from_cache", "shard_ids", "shard_labels")
+
+    def __init__(self, columns: List[str], records: List[Tuple[int, RowRecord]], frame=None,
+                 from_cache: bool = False):
+        self.columns = columns
+        self.records = records
+        self.frame = frame
+        self.from_cache = from_cache
+        self.shard_ids: Optional[List[int]] = None
+        self.shard_labels: List[str] = []
+
+def inventory_payload(inventory: Inventory) -> Dict:
+    """台帳をキャッシュ・プロセス間で受け渡す形にする（行レコードは列名の索引と値のタプルに分解）"""
+    if inventory.frame is not None:
+        return {"frame": inventory.frame}
+    return {
+        "columns": inventory.columns,
+        "index": inventory.records[0][1]._index if inventory.records else {},
+        "rows": [row._values for _, row in inventory.records],
+    }
+
+def inventory_from_payload(payload: Dict, from_cache: bool = False) -> Inventory:
+    """inventory_payload() の結果から台帳を復元する"""
+    if "frame" in payload:
+        df = payload["frame"]
+        columns, index = build_column_index(list(df.columns))
+        records = [
+            (idx, RowRecord(index, values))
+            for idx, values in enumerate(df.itertuples(index=False, name=None))
+        ]
+        return Inventory(columns, records, df, from_cache=from_cache)
+    index = payload["index"]
+    records = [(idx, RowRecord(index, values)) for idx, values in enumerate(payload["rows"])]
+    return Inventory(payload["columns"], records, from_cache=from_cache)
+
+def file_sha256(path: Path) -> str:
+    """ファイル内容の SHA-256 ハッシュ（16進）を返す"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def inventory_cache_path(engine: str, path: Path, sheet: Optional[str], cache_dir: Path) -> Path:
+    """台帳ファイル（・シート）・エンジンごとのキャッシュファイルのパス"""
+    source = str(path.resolve())
+    if sheet is not None:
+        source += f"\n{sheet}"
+    key = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+    return cache_dir / f"inventory_{engine}_{key}.pickle"
+
+def input_fingerprint(path: Path) -> Dict:
+    """台帳ファイルの指紋（サイズ・更新日時・SHA-256）。解析前に取得し、解析中の変更を取り違えないようにする"""
+    st = path.stat()
+    profiler.count("hash_input")
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": file_sha256(path)}
+
+def save_inventory_cache(engine: str, fingerprint: Dict, inventory: Inventory,
+                         path: Path, sheet: Optional[str], cache_dir: Path) -> None:
+    """読み込んだ台帳をキャッシュに保存する（失敗しても生成は続ける）"""
+    cache = {"version": CACHE_VERSION, "source": str(path), "sheet": sheet, "engine": engine, **fingerprint}
+    cache.update(inventory_payload(inventory))
+    write_inventory_cache(inventory_cache_path(engine, path, sheet, cache_dir), cache)
+
+def write_inventory_cache(cache_path: Path, cache: Dict) -> None:
+    """キャッシュファイルを書き出す（失敗しても生成は続ける）"""
+    import pickle
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.count("write_cache")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        print(f"⚠️ 台帳キャッシュの保存に失敗しました: {cache_path} - {str(e)}", file=sys.stderr, flush=True)
+
+def load_cached_inventory(engine: str, path: Path, sheet: Optional[str], cache_dir: Path) -> Optional[Inventory]:
+    """キャッシュが台帳ファイルと一致すれば、解析せずに台帳を返す（一致しなければ None）
+
+    サイズと更新日時が一致すればそのまま使い、更新日時だけが違う場合（コピー・上書き保存など）は
+    内容の SHA-256 を比較する。内容が同じならキャッシュの更新日時を書き換え、次回からはハッシュを計算しない。
+    """
+    import pickle
+    cache_path = inventory_cache_path(engine, path, sheet, cache_dir)
+    if not cache_path.exists() or not path.exists():
+        return None
+    try:
+        profiler.count("read_cache")
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)
+        if cache.get("version") != CACHE_VERSION or cache.get("source") != str(path):
+            return None
+        if cache.get("sheet") != sheet:
+            return None
+        st = path.stat()
+        if cache["size"] != st.st_size:
+            return None
+        if cache["mtime_ns"] != st.st_mtime_ns:
+            profiler.count("hash_input")
+            if cache["sha256"] != file_sha256(path):
+                return None
+            cache["mtime_ns"] = st.st_mtime_ns
+            write_inventory_cache(cache_path, cache)
+        return inventory_from_payload(cache, from_cache=True)
+    except Exception:
+        # 壊れた・古い形式のキャッシュは使わない（台帳を読み直して上書きする）
+        return None
+
+def load_inventory(engine: str, path: Path, sheet: Optional[str] = None,
+                   cache_dir: Optional[Path] = None) -> Inventory:
+    """指定エンジンで台帳を読み込む（cache_dir を渡した場合はキャッシュを使い、読み込んだ結果を保存する）"""
+    if cache_dir is not None:
+        if engine == "pandas":
+            # キャッシュの DataFrame を復元するためにも pandas が必要
+            import_pandas()
+        inventory = load_cached_inventory(engine, path, sheet, cache_dir)
+        if inventory is not None:
+            return inventory
+    return parse_inventory(engine, path, sheet, cache_dir)
+
+def parse_inventory(engine: str, path: Path, sheet: Optional[str] = None,
+                    cache_dir: Optional[Path] = None) -> Inventory:
+    """指定エンジンで台帳ファイルを解析する（cache_dir を渡した場合は結果をキャッシュに保存する）"""
+    fingerprint = input_fingerprint(path) if cache_dir is not None and path.exists() else None
+    if engine == "pandas":
+        import_pandas()
+        df = load_input_frame(path, sheet)
+        columns, index = build_column_index(list(df.columns))
+        # iterrows() のような行ごとの Series 生成を避け、タプルのまま取り出す
+        records = [
+            (idx, RowRecord(index, values))
+            for idx, values in enumerate(df.itertuples(index=False, name=None))
+        ]
+        inventory = Inventory(columns, records, df)
+    else:
+        columns, records = load_input_rows(path, sheet)
+        inventory = Inventory(columns, records)
+    if fingerprint is not None:
+        save_inventory_cache(engine, fingerprint, inventory, path, sheet, cache_dir)
+    return inventory
+
+class InputShard:
+    """読み込む台帳の単位（ファイルとシート。シートが None の場合は先頭シート、CSV・JSON Lines はファイル全体）"""
+    __slots__ = ("path", "sheet")
+
+    def __init__(self, path: Path, sheet: Optional[str] = None):
+        self.path = path
+        self.sheet = sheet
+
+    @property
+    def label(self) -> str:
+        return self.path.name if self.sheet is None else f"{self.path.name}:{self.sheet}"
+
+def list_shards(paths: List[Path], sheets: Optional[List[str]] = None, all_sheets: bool = False,
+                logger: Optional[logging.Logger] = None) -> List[InputShard]:
+    """台帳ファイルとシートの指定から、読み込む単位の一覧を作る
+
+    --sheet で指定したシートがないブックは読み飛ばし、どのブックにもないシートはエラーにする。
+    CSV・JSON Lines にはシートがないため、ファイル全体を1つの単位とする。
+    """
+    shards: List[InputShard] = []
+    found = set()
+    for path in dict.fromkeys(paths):
+        if get_input_reader(path) is not iter_excel_rows or not (sheets or all_sheets):
+            shards.append(InputShard(path))
+            continue
+        names = list_sheet_names(path)
+        selected = names if all_sheets else [name for name in dict.fromkeys(sheets) if name in names]
+        for name in dict.fromkeys(sheets or []):
+            if name not in names and logger is not None:
+                logger.warning(f"⚠️ {path.name} にシート '{name}' がないため読み飛ばします")
+        found.update(selected)
+        shards.extend(InputShard(path, name) for name in selected)
+    missing = [name for name in dict.fromkeys(sheets or []) if name not in found]
+    if missing:
+        raise ValueError(f"指定されたシートがどの台帳にも見つかりません: {', '.join(missing)}")
+    if not shards:
+        raise ValueError("読み込む台帳がありません")
+    return shards
+
+# 解析するファイルの合計がこれより小さい場合はプロセスを起動せず、順番に解析する
+PARALLEL_LOAD_MIN_BYTES = 1024 * 1024
+
+def parse_shard(engine: str, path: Path, sheet: Optional[str], cache_dir: Optional[Path]) -> Dict:
+    """ワーカープロセスで台帳を1つ解析する（結果はプロセス間で受け渡せる形で返す）"""
+    return inventory_payload(parse_inventory(engine, path, sheet, cache_dir))
+
+def load_shards(shards: List[InputShard], engine: str = DEFAULT_ENGINE,
+                cache_dir: Optional[Path] = None) -> List[Inventory]:
+    """複数の台帳・シートを読み込む（キャッシュにないものはプロセスプールで並列に解析する）
+
+    cache_dir を渡した場合はキャッシュを使い、解析した結果を保存する。
+
+    全体の時間が台帳ごとの解析時間の合計ではなく、最も大きい台帳の解析時間で決まるようにする。
+    """
+    inventories: List[Optional[Inventory]] = [None] * len(shards)
+    if engine == "pandas":
+        import_pandas()
+    if cache_dir is not None:
+        for i, shard in enumerate(shards):
+            inventories[i] = load_cached_inventory(engine, shard.path, shard.sheet, cache_dir)
+    pending = [i for i, inventory in enumerate(inventories) if inventory is None]
+    total_bytes = sum(shards[i].path.stat().st_size for i in pending if shards[i].path.exists())
+
+    def failed(shard: InputShard, error: Exception) -> Exception:
+        if len(shards) == 1:
+            return error
+        return RuntimeError(f"{shard.label} の読み込みに失敗しました: {str(error)}")
+
+    workers = min(len(pending), os.cpu_count() or 1)
+    if workers > 1 and total_bytes >= PARALLEL_LOAD_MIN_BYTES:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # Windows と同じ spawn で起動する（ログのスレッドを持つプロセスを fork しない）
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {
+                i: pool.submit(parse_shard, engine, shards[i].path, shards[i].sheet, cache_dir)
+                for i in pending
+            }
+            for i, future in futures.items():
+                try:
+                    inventories[i] = inventory_from_payload(future.result())
+                except Exception as e:
+                    raise failed(shards[i], e)
+    else:
+        for i in pending:
+            try:
+                inventories[i] = parse_inventory(engine, shards[i].path, shards[i].sheet, cache_dir)
+            except Exception as e:
+                raise failed(shards[i], e)
+    return inventories
+
+def merge_inventories(shards: List[InputShard], inventories: List[Inventory],
+                      logger: Optional[logging.Logger] = None) -> Inventory:
+    """台帳・シートごとに読み込んだ結果を1つの台帳にまとめる
+
+    'e' は台帳ごとの終了の合図として扱い、その台帳の 'e' より後の行だけを読み込まない
+    （他の台帳の行は処理する）。列は最初に現れた順にまとめ、ない列は空欄として扱う。
+    """
+    if len(inventories) == 1:
+        inventory = inventories[0]
+        inventory.shard_labels = [shards[0].label]
+        return inventory
+
+    columns: Dict[str, None] = {}
+    parts = []
+    for shard, inventory in zip(shards, inventories):
+        try:
+            check_required_columns(inventory)
+        except ValueError as e:
+            raise ValueError(f"{shard.label}: {str(e)}")
+        stop = next(
+            (pos for pos, (_, row) in enumerate(inventory.records)
+             if str(row.get("generate", "")).strip().lower() == "e" and not is_blank_row(row)),
+            None
+        )
+        records = inventory.records if stop is None else inventory.records[:stop]
+        if stop is not None and logger is not None:
+            idx, row = inventory.records[stop]
+            row_num = row.get('No.', idx + 1)
+            logger.info(f"⏹️ {shard.label} の No.{row_num} で 'e' を検出したため、それ以降の行は読み込みません。")
+        columns.update(dict.fromkeys(inventory.columns))
+        parts.append((inventory, records))
+
+    shard_ids = [shard_id for shard_id, (_, records) in enumerate(parts) for _ in records]
+    if all(inventory.frame is not None for inventory, _ in parts):
+        frame = pd.concat([inventory.frame.iloc[:len(records)] for inventory, records in parts],
+                          ignore_index=True, sort=False)
+        merged_columns, index = build_column_index(list(frame.columns))
+        local_indexes = [idx for _, records in parts for idx, _ in records]
+        records = [
+            (idx, RowRecord(index, values))
+            for idx, values in zip(local_indexes, frame.itertuples(index=False, name=None))
+        ]
+        merged = Inventory(merged_columns, records, frame)
+    else:
+        merged = Inventory(list(columns), [record for _, records in parts for record in records])
+    merged.from_cache = all(inventory.from_cache for inventory in inventories)
+    merged.shard_ids = shard_ids
+    merged.shard_labels = [shard.label for shard in shards]
+    return merged
+
+def row_label(inventory: Inventory, pos: int, row_num) -> str:
+    """ログ・マニフェスト用の行の表記（複数の台帳を読み込んだ場合は読み込み元を付ける）"""
+    if inventory.shard_ids is None:
+        return str(row_num)
+    return f"{row_num}（{inventory.shard_labels[inventory.shard_ids[pos]]}）"
+
+def load_merged_inventory(shards: List[InputShard], engine: str = DEFAULT_ENGINE, cache_dir: Optional[Path] = None,
+                          logger: Optional[logging.Logger] = None) -> Inventory:
+    """台帳・シートを（並列に）読み込み、1つの台帳にまとめる（cache_dir を渡した場合はキャッシュを使う）"""
+    return merge_inventories(shards, load_shards(shards, engine, cache_dir), logger)
+
+# 必須項目（空の場合は検証エラー）
+REQUIRED_FIELDS = ('name', 'host', 'user')
+HOSTNAME_PATTERN = r'[a-zA-Z0-9.-]+'
+
+def is_missing(value) -> bool:
+    """必須項目として空（欠損値または空白のみ）かどうか"""
+    return is_na(value) or str(value).strip() == ''
+
+def check_host(value) -> Optional[str]:
+    """IPアドレス/ホスト名をチェックし、不正な場合はエラーメッセージを返す"""
+    host = str(value).strip()
+    # IPv4 アドレスとホスト名は正規表現で判定し、一致しない場合のみ IPv6 などとして解析
+    if host and not re.fullmatch(HOSTNAME_PATTERN, host):
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            return f"ホスト名 '{host}' の形式が不正です"
+    return None
+
+def check_port(value) -> Optional[str]:
+    """ポート番号をチェックし、不正な場合はエラーメッセージを返す（空欄は既定の22）"""
+    if is_na(value):
+        return None
+    try:
+        port_num = int(value)
+    except (ValueError, TypeError, OverflowError):
+        return f"ポート番号 '{value}' が数値ではありません"
+    if not (1 <= port_num <= 65535):
+        return f"ポート番号 {port_num} は範囲外です (1-65535)"
+    return None
+
+class KeyIndex:
+    """keys/ ディレクトリの索引（os.scandir で1回だけ走査し、名前・サイズ・更新日時を保持する）"""
+
+    def __init__(self, keys_dir: Path):
+        self.keys_dir = keys_dir
+        # keys/ からの相対パス（区切りは '/'） → (サイズ, 更新日時)
+        self.entries: Dict[str, Tuple[int, float]] = {}
+        # Windows ではファイル名の大文字・小文字を区別しない
+        self.case_insensitive = os.name == "nt"
+        self._scan(self.keys_dir, "")
+        self._lookup = {self._fold(name): name for name in self.entries}
+
+    def _scan(self, directory: Path, prefix: str) -> None:
+        try:
+            profiler.count("scandir")
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    name = prefix + entry.name
+                    if entry.is_dir():
+                        self._scan(Path(entry.path), name + "/")
+                    elif entry.is_file():
+                        st = entry.stat()
+                        self.entries[name] = (st.st_size, st.st_mtime)
+        except FileNotFoundError:
+            pass
+
+    def _fold(self, name: str) -> str:
+        return name.casefold() if self.case_insensitive else name
+
+    @staticmethod
+    def normalize(keyfile: str) -> str:
+        """Excel に書かれたキーファイル名を索引のキー形式にする"""
+        return keyfile.strip().replace("\\", "/")
+
+    def find(self, keyfile: str) -> Optional[str]:
+        """キーファイル名に対応する索引上の名前を返す（見つからない場合は None）"""
+        return self._lookup.get(self._fold(self.normalize(keyfile)))
+
+    def exists(self, keyfile: str) -> bool:
+        name = self.normalize(keyfile)
+        if name.startswith("/") or ".." in name.split("/") or ":" in name:
+            # keys/ の外を指す指定は索引の対象外なので直接確認する
+            return (self.keys_dir / keyfile).exists()
+        return self.find(name) is not None
+
+    def suggest(self, keyfile: str, limit: int = 3) -> List[str]:
+        """綴りの近いキーファイル名の候補を返す"""
+        import difflib
+        folded = {self._fold(name): name for name in self.entries}
+        matches = difflib.get_close_matches(self._fold(self.normalize(keyfile)), list(folded), n=limit, cutoff=0.6)
+        return [folded[match] for match in matches]
+
+    def unreferenced(self, referenced: Iterable[str]) -> List[str]:
+        """どの行からも参照されていないキーファイル名の一覧"""
+        used = {self.find(name) for name in referenced if name}
+        return sorted(name for name in self.entries if name not in used)
+
+def check_keyfile(keyfile: str, key_index: KeyIndex) -> Optional[str]:
+    """キーファイルの存在をチェックし、見つからない場合はエラーメッセージを返す"""
+    if keyfile:
+        if not key_index.exists(keyfile):
+            keyfile_path = key_index.keys_dir / keyfile
+            message = f"キーファイル '{keyfile}' が見つかりません: {keyfile_path}"
+            suggestions = key_index.suggest(keyfile)
+            if suggestions:
+                message += f"（候補: {', '.join(suggestions)}）"
+            return message
+    return None
+
+def validate_row_data(row: Mapping, row_num: int, key_index: KeyIndex) -> Tuple[bool, List[str]]:
     """行データの妥当性を検証"""
     errors = []
     
     # 必須フィールドチェック
-    required_fields = ['name', 'host', 'user']
-    for field in required_fields:
-        if pd.isna(row.get(field)) or str(row.get(field, '')).strip() == '':
+    for field in REQUIRED_FIELDS:
+        if is_missing(row.get(field)):
             errors.append(f"必須項目 '{field}' が空です")
     
-    # IPアドレス/ホスト名チェック
-    host = str(row.get('host', '')).strip()
-    if host:
-        try:
-            ipaddress.ip_address(host)
-        except ValueError:
-            # IPアドレスでない場合はホスト名として扱う（簡易チェック）
-            if not re.match(r'^[a-zA-Z0-9.-]+$', host):
-                errors.append(f"ホスト名 '{host}' の形式が不正です")
+    # IPアドレス/ホスト名・ポート番号・キーファイル存在チェック
+    for error in (
+        check_host(row.get('host', '')),
+        check_port(row.get('port')),
+        check_keyfile(safe_get(row, 'keyfile'), key_index),
+    ):
+        if error:
+            errors.append(error)
+    
+    return len(errors) == 0, errors
+
+def report_keys(inventory: Inventory, key_index: KeyIndex, logger: logging.Logger) -> int:
+    """キーファイルの参照状況（見つからないキー・未参照のキー）を報告し、見つからない件数を返す"""
+    logger.info(f"🔑 keys/ のキーファイル: {len(key_index.entries)} 件（{key_index.keys_dir}）")
+    referenced = []
+    missing = 0
+    for idx, row in inventory.records:
+        keyfile = safe_get(row, 'keyfile')
+        if not keyfile:
+            continue
+        referenced.append(keyfile)
+        if not key_index.exists(keyfile):
+            missing += 1
+            suggestions = key_index.suggest(keyfile)
+            hint = f"（候補: {', '.join(suggestions)}）" if suggestions else ""
+            logger.error(f"❌ No.{row.get('No.', idx + 1)} キーファイル '{keyfile}' が見つかりません{hint}")
+    unreferenced = key_index.unreferenced(referenced)
+    for name in unreferenced:
+        size, mtime = key_index.entries[name]
+        updated = datetime.fromtimestamp(mtime).strftime("%Y/%m/%d %H:%M:%S")
+        logger.warning(f"⚠️ どの行からも参照されていないキーファイル: {name}（{size} bytes, 更新: {updated}）")
+    logger.info(
+        f"📊 キーファイル確認完了 - 参照: {len(set(referenced))}種類, "
+        f"見つからない: {missing}件, 未参照: {len(unreferenced)}件",
+        extra=SUMMARY
+    )
+    return missing
+
+def to_row_number(value) -> Optional[int]:
+    """No. 列の値を整数に変換する（5.0 や '5' も 5 として扱う。変換できない場合は None）"""
+    if is_na(value) or isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not number.is_integer():
+        return None
+    return int(number)
+
+class RowIndex:
+    """行選択用の索引（No. → 行位置、グループ階層 → 行位置のリスト）"""
+
+    def __init__(self, records: List[Tuple[int, RowRecord]], shard_ids: Optional[List[int]] = None):
+        self.records = records
+        self.by_no: Dict[int, List[int]] = {}
+        self.by_group: Dict[Tuple[str, str, str], List[int]] = {}
+        seen = set()
+        for pos, (_, row) in enumerate(records):
+            number = to_row_number(row.get('No.'))
+            # No. が重複している場合は最初の行を使う（複数の台帳を読み込んだ場合は台帳ごとに最初の行）
+            shard = shard_ids[pos] if shard_ids is not None else None
+            if number is not None and (shard, number) not in seen:
+                seen.add((shard, number))
+                self.by_no.setdefault(number, []).append(pos)
+            groups = (safe_get(row, "group1"), safe_get(row, "group2"), safe_get(row, "group3"))
+            self.by_group.setdefault(groups, []).append(pos)
+        self.sorted_nos = sorted(self.by_no)
+
+    def positions_for_rows(self, ranges: List[Tuple[int, int]]) -> Tuple[List[int], List[str]]:
+        """No. の範囲に一致する行位置と、一致しなかった指定の一覧を返す"""
+        positions = set()
+        not_found = []
+        for start, end in ranges:
+            lo = bisect.bisect_left(self.sorted_nos, start)
+            hi = bisect.bisect_right(self.sorted_nos, end)
+            if lo == hi:
+                not_found.append(str(start) if start == end else f"{start}-{end}")
+            positions.update(pos for number in self.sorted_nos[lo:hi] for pos in self.by_no[number])
+        return sorted(positions), not_found
+
+    def positions_for_groups(self, patterns: Tuple[Optional[str], Optional[str], Optional[str]]) -> List[int]:
+        """グループ列のパターン（glob、大文字・小文字を区別しない）に一致する行位置を返す"""
+        positions = []
+        for groups, group_positions in self.by_group.items():
+            if all(pattern is None or match_glob(value, pattern) for value, pattern in zip(groups, patterns)):
+                positions.extend(group_positions)
+        return sorted(positions)
+
+def match_glob(value: str, pattern: str) -> bool:
+    """glob パターンとの一致判定（大文字・小文字を区別しない）"""
+    return fnmatch.fnmatchcase(value.lower(), pattern.lower())
+
+# 絞り込み条件に指定できる列（--group1 などの glob パターン）
+FILTER_COLUMNS = ("group1", "group2", "group3", "host", "name")
+
+def has_row_selection(args: GenerateOptions) -> bool:
+    """行の選択（--row や絞り込み条件）が指定されているか"""
+    return any(
+        getattr(args, name, None) is not None
+        for name in ("row", *FILTER_COLUMNS)
+    )
+
+def select_positions(args, records: List[Tuple[int, RowRecord]], validation: ValidationResult,
+                     logger: logging.Logger, shard_ids: Optional[List[int]] = None) -> List[int]:
+    """--row と絞り込み条件から処理する行位置を求める
+
+    --row で指定した行は generate 列に関係なく処理し、絞り込み条件のみの場合は
+    通常どおり生成対象（'e' より前の generate=yes の行）の中から選ぶ。
+    複数の台帳を読み込んだ場合、--row の No. はすべての台帳の行に一致する。
+    """
+    index = RowIndex(records, shard_ids)
+    if args.row is not None:
+        candidates, not_found = index.positions_for_rows(args.row)
+        for spec in not_found:
+            logger.error(f"❌ 指定されたNo. {spec} は見つかりませんでした")
+    else:
+        candidates = [pos for pos, is_target in enumerate(validation.targets) if is_target]
     
-    # ポート番号チェック
-    port = row.get('port')
-    if pd.notna(port):
+    group_patterns = (args.group1, args.group2, args.group3)
+    if any(pattern is not None for pattern in group_patterns):
+        in_groups = set(index.positions_for_groups(group_patterns))
+        candidates = [pos for pos in candidates if pos in in_groups]
+    if args.host is not None:
+        candidates = [pos for pos in candidates if match_glob(safe_get(records[pos][1], "host"), args.host)]
+    if args.name is not None:
+        candidates = [pos for pos in candidates if match_glob(safe_get(records[pos][1], "name"), args.name)]
+    return candidates
+
+def is_generate_flag(flag: str) -> bool:
+    """生成フラグが有効か（yes/true/1。Excel の TRUE や 1 にも対応）"""
+    return flag in ("yes", "true", "1")
+
+class ValidationResult:
+    """台帳全体の検証結果（行位置は Inventory.records のインデックス）"""
+    __slots__ = ("errors", "blank", "targets", "stop_pos", "generate_count")
+
+    def __init__(self, errors: Dict[int, List[str]], blank: List[bool], flags: List[str]):
+        self.errors = errors
+        self.blank = blank
+        # generate=yes の行数（'e' 以降も含めた全体の件数）
+        self.generate_count = sum(1 for flag in flags if is_generate_flag(flag))
+        # 'e' の行位置（空白行以外で最初に現れたもの）
+        self.stop_pos = next(
+            (pos for pos, flag in enumerate(flags) if flag == "e" and not blank[pos]), None
+        )
+        end = len(flags) if self.stop_pos is None else self.stop_pos
+        # 生成対象の行（'e' より前の、空白行でない generate=yes の行）
+        self.targets = [
+            pos < end and not blank[pos] and is_generate_flag(flag) for pos, flag in enumerate(flags)
+        ]
+
+def _map_cached(func: Callable, values) -> List:
+    """同じ値の計算を1回にして func を列全体に適用する"""
+    cache = {}
+    result = []
+    for value in values:
         try:
-            port_num = int(port)
-            if not (1 <= port_num <= 65535):
-                errors.append(f"ポート番号 {port_num} は範囲外です (1-65535)")
-        except (ValueError, TypeError):
-            errors.append(f"ポート番号 '{port}' が数値ではありません")
-    
-    # キーファイル存在チェック
-    keyfile = safe_get(row, 'keyfile')
-    if keyfile:
-        keyfile_path = KEYS_DIR / keyfile
-        if not keyfile_path.exists():
-            errors.append(f"キーファイル '{keyfile}' が見つかりません: {keyfile_path}")
+            out = cache[value]
+        except KeyError:
+            out = cache[value] = func(value)
+        except TypeError:
+            out = func(value)
+        result.append(out)
+    return result
+
+def _validate_records(records: List[Tuple[int, RowRecord]],
+                      key_index: KeyIndex) -> Tuple[List[bool], List[str], List[Dict[int, str]]]:
+    """行レコードの列ごとに検証規則を適用する（openpyxl エンジン）"""
+    rows = [row for _, row in records]
+    blank = [is_blank_row(row) for row in rows]
+    flags = [str(row.get("generate", "")).strip().lower() for row in rows]
+    rules = []
+    for field in REQUIRED_FIELDS:
+        message = f"必須項目 '{field}' が空です"
+        rules.append({pos: message for pos, row in enumerate(rows) if is_missing(row.get(field))})
+    for func, values in (
+        (check_host, [row.get('host', '') for row in rows]),
+        (check_port, [row.get('port') for row in rows]),
+        (lambda name: check_keyfile(name, key_index), [safe_get(row, 'keyfile') for row in rows]),
+    ):
+        rules.append({pos: error for pos, error in enumerate(_map_cached(func, values)) if error})
+    return blank, flags, rules
+
+def _validate_frame(df, key_index: KeyIndex) -> Tuple[List[bool], List[str], List[Dict[int, str]]]:
+    """DataFrame の列単位で検証規則を適用する（pandas エンジン）"""
+    n = len(df)
+    empty = pd.Series([None] * n, index=df.index, dtype=object)
+    column = lambda name: df[name] if name in df.columns else empty
     
-    return len(errors) == 0, errors
+    def positions(mask) -> List[int]:
+        return [int(pos) for pos in mask.to_numpy().nonzero()[0]]
+    
+    def sparse(mask, message) -> Dict[int, str]:
+        return {pos: message(pos) for pos in positions(mask)}
+    
+    blank = df.isna().all(axis=1).tolist()
+    flags = column("generate").astype(str).str.strip().str.lower().tolist()
+    rules = []
+    
+    # 必須フィールド
+    for field in REQUIRED_FIELDS:
+        values = column(field)
+        missing = values.isna() | values.astype(str).str.strip().eq('')
+        rules.append(sparse(missing, lambda pos, field=field: f"必須項目 '{field}' が空です"))
+    
+    # ホスト名: 正規表現に一致しない値（IPv6 など）のみ個別に判定
+    hosts = column("host").astype(str).str.strip()
+    suspect = hosts.ne('') & ~hosts.str.fullmatch(HOSTNAME_PATTERN).fillna(False).astype(bool)
+    host_errors = {pos: check_host(hosts.iat[pos]) for pos in positions(suspect)}
+    rules.append({pos: error for pos, error in host_errors.items() if error})
+    
+    # ポート番号: 数値列はまとめて範囲チェック、それ以外は値ごとに判定
+    ports = column("port")
+    if pd.api.types.is_numeric_dtype(ports) and not pd.api.types.is_bool_dtype(ports):
+        numbers = ports.astype(float)
+        present = numbers.notna()
+        finite = present & numbers.abs().ne(float("inf"))
+        truncated = numbers.where(finite, 0).astype("int64")
+        invalid = (present & ~finite) | (finite & ((truncated < 1) | (truncated > 65535)))
+        rules.append(sparse(invalid, lambda pos: check_port(ports.iat[pos])))
+    else:
+        rules.append({pos: error for pos, error in enumerate(_map_cached(check_port, ports.tolist())) if error})
+    
+    # キーファイル: 異なるファイル名ごとに1回だけ存在確認
+    keyfiles = column("keyfile")
+    names = keyfiles.where(keyfiles.notna(), '').astype(str).str.strip()
+    key_errors = {name: check_keyfile(name, key_index) for name in names.unique() if name}
+    key_errors = {name: error for name, error in key_errors.items() if error}
+    rules.append(sparse(names.isin(list(key_errors)), lambda pos: key_errors[names.iat[pos]]))
+    
+    return blank, flags, rules
+
+def validate_inventory(inventory: Inventory, paths: PathConfig, key_index: Optional[KeyIndex] = None) -> ValidationResult:
+    """台帳全体を1パスで検証し、行ごとのエラー・生成対象・件数をまとめて返す
+
+    キーファイルの存在確認は keys/ の索引で行う（key_index を省略した場合はここで1回走査する）。
+    """
+    if key_index is None:
+        key_index = KeyIndex(paths.keys_dir)
+    if inventory.frame is not None:
+        blank, flags, rules = _validate_frame(inventory.frame, key_index)
+    else:
+        blank, flags, rules = _validate_records(inventory.records, key_index)
+    errors: Dict[int, List[str]] = {}
+    for rule in rules:
+        for pos in sorted(rule):
+            errors.setdefault(pos, []).append(rule[pos])
+    validation = ValidationResult(errors, blank, flags)
+    if inventory.shard_ids is not None:
+        for pos, message in find_shard_collisions(inventory, validation, paths.output_dir).items():
+            errors.setdefault(pos, []).append(message)
+    return validation
 
-def extract_row_data(row: pd.Series) -> Dict[str, str]:
+def find_shard_collisions(inventory: Inventory, validation: ValidationResult, output_dir: Path) -> Dict[int, str]:
+    """複数の台帳・シートの間で出力先（グループ階層/ttl_name.ttl）が重なる生成対象の行を求める
+
+    後から読み込んだ台帳の行をエラーにし、先に現れた行のマクロが上書きされないようにする。
+    同じ台帳の中での重複は従来どおり扱う（後の行で上書き）。
+    """
+    first: Dict[str, int] = {}
+    collisions: Dict[int, str] = {}
+    # 出力ディレクトリ（マニフェストのキーの形）はグループ階層ごとに1回だけ求める
+    directories: Dict[Tuple[str, str, str], str] = {}
+    for pos, is_target in enumerate(validation.targets):
+        if not is_target or pos in validation.errors:
+            continue
+        row = inventory.records[pos][1]
+        groups = (safe_get(row, "group1"), safe_get(row, "group2"), safe_get(row, "group3"))
+        directory = directories.get(groups)
+        if directory is None:
+            target_dir = resolve_target_directory(dict(zip(("group1", "group2", "group3"), groups)), output_dir)
+            relative = target_dir.relative_to(output_dir).as_posix()
+            directory = directories[groups] = "" if relative == "." else f"{relative}/"
+        # ttl_name は extract_row_data() と同じ規則（name_host_user）
+        ttl_name = f"{sanitize_name(str(row['name']).strip())}_{str(row['host']).strip()}_{str(row['user']).strip()}"
+        key = f"{directory}{ttl_name}.ttl"
+        other = first.setdefault(key, pos)
+        if inventory.shard_ids[other] != inventory.shard_ids[pos]:
+            other_idx, other_row = inventory.records[other]
+            other_label = row_label(inventory, other, other_row.get('No.', other_idx + 1))
+            collisions[pos] = f"出力先 {key} が No.{other_label} と重複しています"
+    return collisions
+
+def extract_row_data(row: Mapping) -> Dict[str, str]:
     """行データから必要な情報を抽出"""
     # 特殊処理が必要なフィールド
     memo = safe_get(row, "memo").replace('\r', ' ').replace('\n', ' ').replace('\t', ' ')
@@ -149,7 +1430,7 @@ def extract_row_data(row: pd.Series) -> Dict[str, str]:
     return {
         "name": sanitize_name(str(row["name"]).strip()),
         "host": str(row["host"]).strip(),
-        "port": str(int(row["port"])) if pd.notna(row["port"]) else "22",
+        "port": str(int(row["port"])) if not is_na(row["port"]) else "22",
         "user": str(row["user"]).strip(),
         "password": safe_get(row, "password"),
         "keyfile_name": safe_get(row, "keyfile"),
@@ -160,34 +1441,77 @@ def extract_row_data(row: pd.Series) -> Dict[str, str]:
         "group3": safe_get(row, "group3")
     }
 
-def get_target_directory(data: Dict[str, str]) -> Path:
-    """グループ階層に基づいて出力ディレクトリを決定"""
+def resolve_target_directory(data: Dict[str, str], output_dir: Path) -> Path:
+    """グループ階層に基づく出力ディレクトリのパスを返す（ディレクトリは作成しない）"""
     if not data["group1"]:
-        return OUTPUT_DIR
+        return output_dir
     
-    target_dir = OUTPUT_DIR / data["group1"]
+    target_dir = output_dir / data["group1"]
     if data["group2"]:
         target_dir = target_dir / data["group2"]
         if data["group3"]:
             target_dir = target_dir / data["group3"]
-    
+    return target_dir
+
+def prepare_directory(target_dir: Path) -> None:
+    """ディレクトリを作成し、書き込み権限を確認する"""
     try:
+        profiler.count("mkdir")
         target_dir.mkdir(parents=True, exist_ok=True)
         # 書き込み権限チェック
         test_file = target_dir / ".write_test"
+        profiler.count("write_test")
         test_file.touch()
         test_file.unlink()
     except PermissionError:
         raise PermissionError(f"ディレクトリへの書き込み権限がありません: {target_dir}")
     except Exception as e:
         raise RuntimeError(f"ディレクトリ作成エラー: {target_dir} - {str(e)}")
-    
+
+class DirectoryRegistry:
+    """1回の実行中に準備したディレクトリを記録する
+
+    同じグループのディレクトリは作成・書き込み確認を1回だけ行い、
+    2行目以降はその結果（失敗した場合は同じエラー）を使い回す。
+    """
+
+    def __init__(self):
+        self._results: Dict[Path, Optional[Exception]] = {}
+
+    @property
+    def prepared_count(self) -> int:
+        """準備に成功したディレクトリ数"""
+        return sum(1 for error in self._results.values() if error is None)
+
+    def prepare(self, target_dir: Path) -> Path:
+        if target_dir in self._results:
+            error = self._results[target_dir]
+            if error is not None:
+                raise error.with_traceback(None)
+            return target_dir
+        try:
+            prepare_directory(target_dir)
+        except Exception as e:
+            self._results[target_dir] = e
+            raise
+        self._results[target_dir] = None
+        return target_dir
+
+def get_target_directory(data: Dict[str, str], output_dir: Path,
+                         registry: Optional[DirectoryRegistry] = None) -> Path:
+    """グループ階層に基づいて出力ディレクトリを決定（registry を渡すと準備結果を使い回す）"""
+    target_dir = resolve_target_directory(data, output_dir)
+    if target_dir == output_dir:
+        return output_dir
+    if registry is not None:
+        return registry.prepare(target_dir)
+    prepare_directory(target_dir)
     return target_dir
 
-def calculate_relative_path(target_dir: Path) -> str:
+def calculate_relative_path(target_dir: Path, base_dir: Path) -> str:
     """TTLファイルの配置場所からプロジェクトルートへの相対パスを計算"""
     # プロジェクトルートからの相対パスを計算
-    rel_path = target_dir.relative_to(BASE_DIR)
+    rel_path = target_dir.relative_to(base_dir)
     
     # 相対パスを文字列に変換し、必要に応じて'../'を追加
     if rel_path == Path('.'):
@@ -197,15 +1521,15 @@ def calculate_relative_path(target_dir: Path) -> str:
     depth = len(rel_path.parts)
     return '../' * depth
 
-def get_log_dir(target_dir: Path) -> Path:
+def get_log_dir(target_dir: Path, paths: PathConfig) -> Path:
     """TTL と同じ階層になるよう logs 以下のディレクトリを返す（macros/home/prod → logs/home/prod）"""
-    rel = target_dir.relative_to(OUTPUT_DIR)
+    rel = target_dir.relative_to(paths.output_dir)
     if rel == Path("."):
-        return LOGS_DIR
-    return LOGS_DIR / rel
+        return paths.logs_dir
+    return paths.logs_dir / rel
 
 
-def calculate_paths(data: Dict[str, str], target_dir: Path) -> Dict[str, str]:
+def calculate_paths(data: Dict[str, str], target_dir: Path, paths: PathConfig) -> Dict[str, str]:
     """各種パスを計算"""
     # TTLファイル名の生成
     ttl_name = f"{data['name']}_{data['host']}_{data['user']}"
@@ -213,24 +1537,28 @@ def calculate_paths(data: Dict[str, str], target_dir: Path) -> Dict[str, str]:
     # ログファイル名の生成
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     log_filename = f"{ttl_name}_{timestamp}.log"
-    log_file = LOGS_DIR / log_filename
+    log_file = paths.logs_dir / log_filename
     
     # キーファイルパスの計算
     keyfile_path = ""
     if data["keyfile_name"]:
-        keyfile_path = str(KEYS_DIR / data["keyfile_name"])
+        keyfile_path = str(paths.keys_dir / data["keyfile_name"])
     
     return {
         "ttl_name": ttl_name,
         "log_file": str(log_file),
-        "log_path": str(LOGS_DIR),
+        "log_path": str(paths.logs_dir),
         "keyfile": keyfile_path
     }
 
-def generate_ttl_content(data: Dict[str, str], template: str, timestamp: str, target_dir: Path) -> str:
+def generate_ttl_content(data: Dict[str, str], template: CompiledTemplate, timestamp: str,
+                         target_dir: Path, base_dir: Path) -> str:
     """TTLマクロの内容を生成"""
+    if isinstance(template, str):
+        template = CompiledTemplate(template)
+    
     # 相対パスの計算
-    rel_path = calculate_relative_path(target_dir)
+    rel_path = calculate_relative_path(target_dir, base_dir)
     
     # ポストコマンドの処理
     post_cmd_lines = [line.strip() for line in data["post_cmd"].splitlines() if line.strip()]
@@ -238,28 +1566,355 @@ def generate_ttl_content(data: Dict[str, str], template: str, timestamp: str, ta
         f"wait '$' '#'\nsendln '{cmd}'\n" for cmd in post_cmd_lines
     ]) if post_cmd_lines else ""
     
-    # テンプレートの置換
+    # テンプレートの置換（1パスで描画）
     replacements = {
-        "{hostname}": data["host"],
-        "{port}": data["port"],
-        "{username}": data["user"],
-        "{password}": data["password"],
-        "{keyfile}": data["keyfile_name"],  # キーファイル名のみを渡す
-        "{name}": data["name"],
-        "{rel_path}": rel_path,  # 相対パスを渡す
-        "{created_at}": timestamp,
-        "{memo}": data["memo"],
-        "{post_commands}": post_commands
+        "hostname": data["host"],
+        "port": data["port"],
+        "username": data["user"],
+        "password": data["password"],
+        "keyfile": data["keyfile_name"],  # キーファイル名のみを渡す
+        "name": data["name"],
+        "rel_path": rel_path,  # 相対パスを渡す
+        "created_at": timestamp,
+        "memo": data["memo"],
+        "post_commands": post_commands
     }
     
-    content = template
-    for key, value in replacements.items():
-        content = content.replace(key, value)
-    
-    return content
+    return template.render(replacements)
+
+class DirectorySink:
+    """生成したマクロを macros/ 以下にファイルとして書き出す（既定の出力先）"""
+    uses_manifest = True
+
+    def __init__(self, output_dir: Path):
+        self.output_dir = output_dir
+        self.registry = DirectoryRegistry()
+
+    @property
+    def prepared_count(self) -> int:
+        return self.registry.prepared_count
+
+    def prepare(self, data: Dict[str, str]) -> Path:
+        """出力ディレクトリを準備して返す"""
+        return get_target_directory(data, self.output_dir, self.registry)
+
+    def make_entry(self, data: Dict[str, str], label: str, row_hash: str) -> Optional[Dict]:
+        return None
+
+    def write(self, ttl_file: Path, content: str, entry: Optional[Dict]) -> None:
+        profiler.count("write")
+        ttl_file.write_text(content, encoding="utf-8")
+
+    def write_library(self, content: str) -> bool:
+        """共通ライブラリを macros/ 直下に書き出す（内容が同じなら書き換えず False を返す）"""
+        library_file = self.output_dir / COMMON_LIBRARY_NAME
+        try:
+            if library_file.read_text(encoding="utf-8") == content:
+                return False
+        except (FileNotFoundError, UnicodeDecodeError):
+            pass
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.write(library_file, content, None)
+        return True
+
+    def close(self, completed: bool = True) -> None:
+        pass
+
+# --bundle で作成できるアーカイブ（拡張子 → 形式）
+BUNDLE_FORMATS = {".zip": "zip", ".tar": "tar", ".tar.gz": "tar.gz", ".tgz": "tar.gz"}
+BUNDLE_INDEX_NAME = "index.json"
+BUNDLE_VERSION = 1
+# 索引に記録する行データの項目（ランチャーの表示・検索に使う）
+BUNDLE_INDEX_FIELDS = ("name", "host", "port", "user", "memo", "group1", "group2", "group3")
+
+def get_bundle_format(path: Path) -> str:
+    """ファイル名からアーカイブの形式を判定する"""
+    name = path.name.lower()
+    for suffix, fmt in BUNDLE_FORMATS.items():
+        if name.endswith(suffix):
+            return fmt
+    raise ValueError(f"対応していないアーカイブの形式です: {path.name}（対応: {', '.join(BUNDLE_FORMATS)}）")
+
+class ArchiveSink:
+    """生成したマクロを1つのアーカイブ（zip / tar）に書き出す（--bundle）
+
+    メンバーのパスは macros/ からの相対パス（group1/group2/group3/名前.ttl）で、macros/ に展開すると
+    通常の出力と同じ構成・同じ {rel_path} になる。マクロごとのディレクトリ作成・ファイル書き込みは行わず、
+    最後に索引（index.json）を追加してから一時ファイルと置き換える。
+    zipfile・tarfile はスレッドセーフではないため、描画は並列に行い、アーカイブへの追加だけを直列にする。
+    """
+    uses_manifest = False
+
+    def __init__(self, path: Path, template_hash: str, output_dir: Path):
+        import tarfile
+        import zipfile
+        self.path = path
+        self.output_dir = output_dir
+        self.format = get_bundle_format(path)
+        self.template_hash = template_hash
+        self.tmp_path = path.with_name(path.name + ".tmp")
+        self.created_at = datetime.now()
+        self.entries: Dict[str, Dict] = {}
+        self.prepared_count = 0
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if self.format == "zip":
+            self.archive = zipfile.ZipFile(self.tmp_path, "w", compression=zipfile.ZIP_DEFLATED)
+        else:
+            self.archive = tarfile.open(self.tmp_path, "w:gz" if self.format == "tar.gz" else "w")
 
-def parse_args():
-    """コマンドライン引数を解析"""
+    def prepare(self, data: Dict[str, str]) -> Path:
+        """出力ディレクトリのパスを返す（ディレクトリは作成しない）"""
+        return resolve_target_directory(data, self.output_dir)
+
+    def make_entry(self, data: Dict[str, str], label: str, row_hash: str) -> Dict:
+        """索引に記録する内容（行番号・入力のハッシュと、表示・検索に使う行データ）"""
+        return {"no": label, "hash": row_hash, **{field: data[field] for field in BUNDLE_INDEX_FIELDS}}
+
+    def _add(self, member: str, payload: bytes) -> None:
+        import tarfile
+        import zipfile
+        if self.format == "zip":
+            info = zipfile.ZipInfo(member, date_time=self.created_at.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            self.archive.writestr(info, payload)
+        else:
+            info = tarfile.TarInfo(member)
+            info.size = len(payload)
+            info.mtime = int(self.created_at.timestamp())
+            info.mode = 0o644
+            self.archive.addfile(info, io.BytesIO(payload))
+
+    def write(self, ttl_file: Path, content: str, entry: Dict) -> None:
+        member = manifest_key(ttl_file, self.output_dir)
+        # ファイルに書き出す場合（write_text）と同じく、改行は実行環境の形式にする
+        payload = content.replace("\n", os.linesep).encode("utf-8")
+        with self._lock:
+            if member in self.entries:
+                raise ValueError(f"バンドル内で出力先が重複しています: {member}（No.{self.entries[member]['no']}）")
+            profiler.count("bundle_add")
+            self._add(member, payload)
+            self.entries[member] = entry
+
+    def write_library(self, content: str) -> bool:
+        """共通ライブラリをアーカイブの直下に追加する（索引には記録しない）"""
+        with self._lock:
+            profiler.count("bundle_add")
+            self._add(COMMON_LIBRARY_NAME, content.replace("\n", os.linesep).encode("utf-8"))
+        return True
+
+    def close(self, completed: bool = True) -> None:
+        """索引を追加してアーカイブを確定する（completed=False の場合は作成途中のファイルを消す）"""
+        try:
+            if completed:
+                index = {
+                    "version": BUNDLE_VERSION,
+                    "created_at": self.created_at.isoformat(timespec="seconds"),
+                    "template_hash": self.template_hash,
+                    "count": len(self.entries),
+                    "entries": {member: self.entries[member] for member in sorted(self.entries)},
+                }
+                self._add(BUNDLE_INDEX_NAME, json.dumps(index, ensure_ascii=False, indent=1).encode("utf-8"))
+            self.archive.close()
+            if completed:
+                profiler.count("write_bundle")
+                os.replace(self.tmp_path, self.path)
+        finally:
+            if self.tmp_path.exists():
+                self.tmp_path.unlink()
+
+def render_and_write(data: Dict[str, str], template: CompiledTemplate, timestamp: str, target_dir: Path,
+                     base_dir: Path, ttl_file: Path, sink, entry: Optional[Dict]) -> None:
+    """TTLマクロを描画して出力先（DirectorySink / ArchiveSink）に書き込む（ワーカースレッドからも呼ばれる）"""
+    if not profiler.enabled:
+        sink.write(ttl_file, generate_ttl_content(data, template, timestamp, target_dir, base_dir), entry)
+        return
+    started = time.perf_counter()
+    content = generate_ttl_content(data, template, timestamp, target_dir, base_dir)
+    rendered = time.perf_counter()
+    sink.write(ttl_file, content, entry)
+    profiler.add_time("render", rendered - started)
+    profiler.add_time("write", time.perf_counter() - rendered)
+
+class WritePipeline:
+    """描画・書き込みを実行するパイプライン（jobs > 1 の場合はスレッドプールで並列実行）
+
+    完了通知 on_done(context, error) は投入順にメインスレッドで呼ばれるため、
+    ログの順序や件数の集計は直列実行時と同じになる。書き込みのない行（スキップ・エラー）の処理も
+    defer() で同じ順番に並べる。
+    """
+
+    def __init__(self, jobs: int, on_done: Callable[[Tuple, Optional[BaseException]], None]):
+        self.on_done = on_done
+        self.executor = None
+        if jobs > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="ttl-writer")
+        # 未完了ジョブの上限（メモリ上に描画済みの内容を溜め込みすぎないため）
+        self.max_pending = jobs * 4
+        # 投入順の未完了の処理: ("job", context, future) または defer() で並べた ("defer", func, func_args)
+        self.pending: deque = deque()
+
+    def submit(self, context: Tuple, func: Callable, *func_args) -> None:
+        """ジョブを投入する（直列モードではその場で実行する）"""
+        if self.executor is None:
+            try:
+                func(*func_args)
+            except Exception as e:
+                self.on_done(context, e)
+            else:
+                self.on_done(context, None)
+            return
+        self.pending.append(("job", context, self.executor.submit(func, *func_args)))
+        while len(self.pending) > self.max_pending:
+            self._complete_oldest()
+
+    def defer(self, func: Callable, *func_args) -> None:
+        """書き込みのない行の処理（ログ・集計）を、先に投入したジョブの完了通知の後に呼ぶ（未完了がなければすぐ呼ぶ）"""
+        if not self.pending:
+            func(*func_args)
+            return
+        self.pending.append(("defer", func, func_args))
+
+    def _complete_oldest(self) -> None:
+        entry = self.pending.popleft()
+        if entry[0] == "defer":
+            _, func, func_args = entry
+            func(*func_args)
+        else:
+            _, context, future = entry
+            self.on_done(context, future.exception())
+
+    def close(self) -> None:
+        """未完了のジョブをすべて待ち合わせてスレッドプールを終了する"""
+        try:
+            while self.pending:
+                self._complete_oldest()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+
+def hash_text(text: str) -> str:
+    """文字列の SHA-256 ハッシュ（16進）を返す"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def compute_row_hash(data: Dict[str, str], template_hash: str) -> str:
+    """抽出済みの行データとテンプレートのハッシュから行の入力ハッシュを計算"""
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hash_text(f"{template_hash}\n{payload}")
+
+def file_exists(path: Path) -> bool:
+    """ファイルの存在確認（--profile 時はファイル操作として数える）"""
+    profiler.count("stat")
+    return path.exists()
+
+def manifest_key(ttl_file: Path, output_dir: Path) -> str:
+    """マニフェストのキー（出力ディレクトリからの相対パス、区切りは '/'）"""
+    return ttl_file.relative_to(output_dir).as_posix()
+
+def row_manifest_key(row: Mapping, output_dir: Path) -> Optional[str]:
+    """行の出力先のマニフェストのキー（検証エラーの行の前回の記録を探すために使う。求められない場合は None）"""
+    if any(is_missing(row.get(field)) for field in REQUIRED_FIELDS):
+        return None
+    try:
+        name = sanitize_name(str(row["name"]).strip())
+        groups = {column: safe_get(row, column) for column in ("group1", "group2", "group3")}
+        ttl_file = resolve_target_directory(groups, output_dir) / f"{name}_{str(row['host']).strip()}_{str(row['user']).strip()}.ttl"
+        return manifest_key(ttl_file, output_dir)
+    except Exception:
+        return None
+
+def load_manifest(manifest_path: Path) -> Dict:
+    """マニフェストを読み込む（存在しない・壊れている場合は空のマニフェストを返す）"""
+    empty = {"version": MANIFEST_VERSION, "template_hash": "", "entries": {}}
+    if not manifest_path.exists():
+        return empty
+    try:
+        profiler.count("read_manifest")
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return empty
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return empty
+    if not isinstance(manifest.get("entries"), dict):
+        return empty
+    return manifest
+
+def save_manifest(manifest: Dict, manifest_path: Path) -> None:
+    """マニフェストを書き込む（一時ファイル経由で置き換え）"""
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    profiler.count("write_manifest")
+    tmp_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=1, sort_keys=True), encoding="utf-8")
+    os.replace(tmp_path, manifest_path)
+
+def positive_int(value: str) -> int:
+    """1以上の整数を受け付ける argparse 用の型"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"整数を指定してください: {value}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"1以上を指定してください: {value}")
+    return number
+
+def parse_row_spec(value: str) -> List[Tuple[int, int]]:
+    """--row の指定（例: 5,9,120-180）を (開始, 終了) の範囲リストに変換する"""
+    ranges = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        m = re.fullmatch(r'(\d+)(?:\s*-\s*(\d+))?', part)
+        if not m:
+            raise argparse.ArgumentTypeError(f"行番号の指定が不正です: {part}")
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else start
+        if start > end:
+            raise argparse.ArgumentTypeError(f"行番号の範囲が不正です: {part}")
+        ranges.append((start, end))
+    if not ranges:
+        raise argparse.ArgumentTypeError("行番号を指定してください")
+    return ranges
+
+@dataclass
+class GenerateOptions:
+    """生成のオプション（コマンドライン引数と同じ項目。parse_args() が作り、MacroGenerator は直接作る）"""
+    # 行の選択（--row と、FILTER_COLUMNS の各列の glob パターン）
+    row: Optional[List[Tuple[int, int]]] = None
+    group1: Optional[str] = None
+    group2: Optional[str] = None
+    group3: Optional[str] = None
+    host: Optional[str] = None
+    name: Optional[str] = None
+    # 読み込み
+    input: Optional[List[str]] = None
+    sheet: Optional[List[str]] = None
+    all_sheets: bool = False
+    engine: str = DEFAULT_ENGINE
+    no_cache: bool = False
+    # 出力
+    incremental: bool = False
+    bundle: Optional[str] = None
+    include_common: bool = False
+    jobs: int = 1
+    # マクロを生成しない動作（--check-keys / --probe）
+    check_keys: bool = False
+    probe: bool = False
+    probe_concurrency: int = 100
+    probe_timeout: float = 3.0
+    probe_banner: bool = False
+    probe_ttl: float = 300.0
+    # 監視・出力レベル・計測
+    watch: bool = False
+    interval: float = 2.0
+    quiet: bool = False
+    verbose: bool = False
+    profile: bool = False
+    pstats: Optional[str] = None
+
+def parse_args(argv: Optional[List[str]] = None) -> GenerateOptions:
+    """コマンドライン引数を解析して GenerateOptions を返す（argv を省略した場合は sys.argv）"""
     parser = argparse.ArgumentParser(
         description=r'''
 TTLマクロを生成するツール
@@ -284,140 +1939,1029 @@ generate列が'yes'の行のみが処理対象となります。
   # 特定の行のみ生成（5行目）
   python .\generate_ttl_macros.py --row 5
 
+  # 複数の行・範囲を生成
+  python .\generate_ttl_macros.py --row 5,9,120-180
+
+  # グループ・ホスト・名前で絞り込んで生成（glob パターン）
+  python .\generate_ttl_macros.py --group1 LocationA --group2 "NAS*"
+  python .\generate_ttl_macros.py --host "192.168.0.*" --name "infra*"
+
+  # CMDB から出力した CSV・JSON Lines を台帳として使う（列は servers.xlsx と同じ）
+  python .\generate_ttl_macros.py --input data\servers.csv
+  python .\generate_ttl_macros.py --input data\servers.jsonl
+
+  # 地域ごとの台帳・シートをまとめて生成（台帳ごとに並列に読み込む）
+  python .\generate_ttl_macros.py --input data\east.xlsx data\west.xlsx --all-sheets
+  python .\generate_ttl_macros.py --input data\servers.xlsx --sheet Tokyo --sheet Osaka
+
+  # pandas 経由で読み込む（既定は openpyxl によるストリーミング読み込み）
+  python .\generate_ttl_macros.py --engine pandas
+
+  # 入力が変わった行だけ生成（変更のないマクロは書き換えない）
+  python .\generate_ttl_macros.py --incremental
+
+  # 生成後も台帳・テンプレートを監視し、変更のあった行だけ再生成
+  python .\generate_ttl_macros.py --watch
+
+  # キーファイルの参照状況を確認（マクロは生成しない）
+  python .\generate_ttl_macros.py --check-keys
+
+  # 配布用に1つの zip にまとめて生成（macros/ には書き出さない）
+  python .\generate_ttl_macros.py --bundle dist\macros.zip
+
+  # 接続・ログ・鍵認証の処理を macros\ttmacro_common.ttl にまとめ、各マクロは変数と include だけにする
+  python .\generate_ttl_macros.py --include-common
+
+  # 描画・書き込みを8スレッドで並列実行（ネットワークドライブ向け）
+  python .\generate_ttl_macros.py --jobs 8
+
+  # コンソールにはサマリーだけを表示（行ごとの詳細は logs/generate.log）
+  python .\generate_ttl_macros.py --quiet
+
+  # 処理時間を計測（logs/profile_日時.json に保存）。cProfile の統計も保存する場合は --pstats
+  python .\generate_ttl_macros.py --profile --pstats logs\generate.pstats
+
   # ヘルプを表示
   python .\generate_ttl_macros.py --help
 
 注意:
   - 行番号はExcelのA列のNo.を指定します
   - generate列が'yes'の行のみが処理されます
-  - 生成フラグに'e'を指定すると処理を終了します
+  - 生成フラグに'e'を指定すると処理を終了します（複数の台帳・シートを指定した場合は、その台帳の残りの行のみ）
+  - 複数の台帳・シートで出力先のマクロが重なる行は、後から読み込んだ方をエラーにします
   - PowerShellで実行する場合は 'python .\generate_ttl_macros.py' を使用してください
         '''
     )
     parser.add_argument(
         '--row', 
-        type=int, 
-        help='生成する行番号（1から始まる）。指定がない場合は全行を処理します。'
+        type=parse_row_spec, 
+        help='生成する行番号（1から始まる）。カンマ区切り・範囲指定（例: 5,9,120-180）も可。指定がない場合は全行を処理します。'
     )
-    return parser.parse_args()
-
-def generate_ttl_macros(args):
-    """TTLマクロを生成するメイン関数"""
-    global pd
-    # ここで pandas をインポート（import で落ちる環境でもスクリプトはここまで起動する）
-    if pd is None:
+    for column in FILTER_COLUMNS:
+        parser.add_argument(
+            f'--{column}',
+            metavar='PATTERN',
+            help=f'{column} 列が glob パターンに一致する行のみ処理します（大文字・小文字を区別しない）。'
+        )
+    parser.add_argument(
+        '--input',
+        metavar='PATH',
+        nargs='+',
+        action='extend',
+        help=f'台帳ファイル（既定: data/servers.xlsx）。形式は拡張子で判定します（{", ".join(INPUT_READERS)}）。'
+             '複数指定すると並列に読み込み、1つの台帳として生成します。'
+    )
+    parser.add_argument(
+        '--sheet',
+        metavar='NAME',
+        action='append',
+        help='読み込む Excel のシート名（既定: 先頭シート）。複数回指定できます。指定したシートがないブックは読み飛ばします。'
+    )
+    parser.add_argument(
+        '--all-sheets',
+        action='store_true',
+        help='Excel ブックのすべてのシートを読み込みます。'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='読み込み済み台帳のキャッシュ（.cache/）を使わず、毎回台帳ファイルを解析します。'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='マニフェスト（macros/.manifest）と比較し、入力が変わった行のみ生成します。'
+    )
+    parser.add_argument(
+        '--bundle',
+        metavar='FILE',
+        help='macros/ にファイルを書き出す代わりに、1つのアーカイブ（.zip / .tar / .tar.gz）に生成します。'
+             'macros/ に展開すると通常の出力と同じ構成になり、ランチャーで直接開くこともできます。'
+    )
+    parser.add_argument(
+        '--include-common',
+        action='store_true',
+        help=f'テンプレートの ;; @common-begin 〜 ;; @common-end の区間を macros/{COMMON_LIBRARY_NAME} に1回だけ出力し、'
+             '各マクロは変数の定義と include だけにします。共通区間だけの修正では各マクロを再生成する必要がありません。'
+    )
+    parser.add_argument(
+        '--engine',
+        choices=ENGINES,
+        default=GenerateOptions.engine,
+        help=f'台帳の読み込みエンジン（既定: {DEFAULT_ENGINE}）。pandas は起動が遅く、メモリも多く使います。'
+    )
+    parser.add_argument(
+        '--jobs',
+        type=positive_int,
+        default=GenerateOptions.jobs,
+        metavar='N',
+        help='描画・ファイル書き込みの並列数（既定: 1）。行の読み込みと検証は順番に行います。'
+    )
+    parser.add_argument(
+        '--check-keys',
+        action='store_true',
+        help='keys/ のキーファイルと台帳の参照を照合して報告します（マクロは生成しません）。'
+    )
+    parser.add_argument(
+        '--probe',
+        action='store_true',
+        help='生成対象の行の接続先（host:port）に TCP 接続できるかを並行に確認し、logs/probe_report.json に保存します'
+             '（マクロは生成しません）。結果はランチャーのツリーに表示されます。'
+    )
+    parser.add_argument(
+        '--probe-concurrency',
+        type=positive_int,
+        default=GenerateOptions.probe_concurrency,
+        metavar='N',
+        help='--probe の同時接続数の上限（既定: 100）'
+    )
+    parser.add_argument(
+        '--probe-timeout',
+        type=float,
+        default=GenerateOptions.probe_timeout,
+        metavar='SEC',
+        help='--probe の接続（とバナー受信）のタイムアウト（秒、既定: 3）'
+    )
+    parser.add_argument(
+        '--probe-banner',
+        action='store_true',
+        help='--probe で接続後に SSH のバナー（例: SSH-2.0-OpenSSH_9.6）を受信して記録します。'
+    )
+    parser.add_argument(
+        '--probe-ttl',
+        type=float,
+        default=GenerateOptions.probe_ttl,
+        metavar='SEC',
+        help='--probe で、この秒数以内に確認した接続先は前回の結果（.cache/probe_cache.json）を使います（既定: 300、0 で無効）。'
+    )
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='生成後も servers.xlsx と template.ttl を監視し、変更のあった行だけ再生成し続けます（Ctrl+C で終了）。'
+    )
+    parser.add_argument(
+        '--interval',
+        type=float,
+        default=GenerateOptions.interval,
+        metavar='SEC',
+        help='--watch の監視間隔（秒、既定: 2）'
+    )
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument(
+        '--quiet', '-q',
+        action='store_true',
+        help='コンソールには警告・エラーとサマリーだけを表示します（行ごとの詳細はログファイルのみ）。'
+    )
+    verbosity.add_argument(
+        '--verbose', '-v',
+        action='store_true',
+        help='行ごとの詳細（生成・スキップ）もコンソールに表示します（既定では進捗のみ表示し、詳細はログファイルに記録します）。'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='フェーズごとの経過時間・行ごとの処理時間・ファイル操作の回数を計測し、logs/profile_日時.json に保存します。'
+    )
+    parser.add_argument(
+        '--pstats',
+        metavar='FILE',
+        help='cProfile で実行し、統計を FILE に保存します（python -m pstats FILE で確認できます）。'
+    )
+    args = parser.parse_args(argv)
+    if args.probe and (args.bundle or args.watch or args.check_keys):
+        parser.error("--probe は --bundle・--watch・--check-keys と同時に指定できません")
+    if args.probe_timeout <= 0:
+        parser.error("--probe-timeout には正の数を指定してください")
+    if args.bundle:
+        if args.incremental or args.watch:
+            parser.error("--bundle は --incremental・--watch と同時に指定できません（アーカイブは毎回すべての行から作成します）")
         try:
-            import pandas as _pd
-            pd = _pd
-        except Exception as e:
-            print("pandas のインポートに失敗しました:", e, file=sys.stderr, flush=True)
-            print("仮想環境を有効にして、pip install pandas openpyxl を実行してください。", file=sys.stderr, flush=True)
-            sys.exit(1)
-    print("[1/4] ログ設定...", file=sys.stderr, flush=True)
-    logger = setup_logging()
+            get_bundle_format(Path(args.bundle))
+        except ValueError as e:
+            parser.error(str(e))
+    return GenerateOptions(**vars(args))
+
+def check_required_columns(inventory: Inventory) -> None:
+    """必要な列の存在チェック"""
+    required_columns = ['No.', 'name', 'host', 'user', 'generate']
+    missing_columns = [col for col in required_columns if col not in inventory.columns]
+    if missing_columns:
+        raise ValueError(f"必要な列が見つかりません: {', '.join(missing_columns)}")
+
+def target_positions(validation: ValidationResult) -> List[int]:
+    """全行処理時に処理する行位置（'e' の行は終了の合図として含める）"""
+    end = len(validation.targets) if validation.stop_pos is None else validation.stop_pos + 1
+    return [pos for pos in range(end) if validation.targets[pos] or pos == validation.stop_pos]
+
+def process_positions(args: GenerateOptions, paths: PathConfig, logger: logging.Logger, template: CompiledTemplate, inventory: Inventory,
+                      validation: ValidationResult, positions: List[int], selecting: bool,
+                      row_results: Optional[List[RowResult]] = None,
+                      on_progress: Optional[Callable[[int, int], None]] = None,
+                      superseded: Iterable[str] = ()) -> Dict[str, int]:
+    """指定された行位置のマクロを生成し、マニフェストを更新して件数を返す
+
+    selecting=True（一部の行のみ処理）の場合はマニフェストの既存の記録を残し、孤立マクロの判定は
+    superseded（監視モードで、行の変更・削除により使われなくなった出力先のキー）に対してだけ行う。
+    --bundle の場合はアーカイブに書き出し、macros/ とマニフェストには触れない。
+    row_results を渡した場合は行ごとの結果（RowResult）を追加し、on_progress があれば (処理済み, 全体) の行数で呼ぶ。
+    """
+    records = inventory.records
+    template_hash = template.hash
+    timestamp = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+    output_dir = paths.output_dir
+    if args.bundle:
+        sink = ArchiveSink(Path(args.bundle).resolve(), template_hash, output_dir)
+    else:
+        sink = DirectorySink(output_dir)
+    manifest = load_manifest(paths.manifest_path) if sink.uses_manifest else {"entries": {}}
+    old_entries = manifest["entries"]
+    new_entries = dict(old_entries) if selecting else {}
+    counts = {"success": 0, "skip": 0, "error": 0}
+    # 複数の台帳を読み込んだ場合は台帳・シートごとの件数も数える
+    shard_ids = inventory.shard_ids
+    shard_counts = None
+    if shard_ids is not None:
+        shard_counts = [{"rows": 0, "success": 0, "skip": 0, "error": 0} for _ in inventory.shard_labels]
+        for shard in shard_ids:
+            shard_counts[shard]["rows"] += 1
     
-    try:
-        # 初期化処理
-        print("[2/4] テンプレート・Excel 読み込み...", file=sys.stderr, flush=True)
-        template = load_template()
-        df = load_excel_data()
-        timestamp = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-        
-        logger.info(f"読み込み元: {EXCEL_PATH}")
-        logger.info("生成開始")
-        
-        # 必要な列の存在チェック
-        required_columns = ['No.', 'name', 'host', 'user', 'generate']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            raise ValueError(f"必要な列が見つかりません: {', '.join(missing_columns)}")
-        
-        # 行番号が指定されている場合
-        if args.row is not None:
-            matching_rows = df[df['No.'] == args.row]
-            if matching_rows.empty:
-                logger.error(f"❌ 指定されたNo. {args.row} は見つかりませんでした")
-                return
-            rows_to_process = [(args.row, matching_rows.iloc[0])]
-            logger.info(f"📝 No.{args.row} のサーバーを処理します")
+    def tally(pos: int, outcome: str, label: str, ttl_file: Optional[Path] = None, message: str = "") -> None:
+        counts[outcome] += 1
+        if shard_counts is not None:
+            shard_counts[shard_ids[pos]][outcome] += 1
+        if row_results is not None:
+            row_results.append(RowResult(pos, label, outcome, ttl_file, message))
+    
+    def keep_previous(key: Optional[str]) -> None:
+        """エラーになった行の前回の記録を残す（台帳に残っている行を孤立扱いにせず、ハッシュも失わない）"""
+        if key is not None and key in old_entries:
+            new_entries[key] = old_entries[key]
+    
+    def report_skip(pos: int, label: str, ttl_name: str, ttl_file: Path) -> None:
+        logger.info(f"⏭️ {ttl_name}.ttl は変更がないためスキップしました。（No.{label}）", extra=ROW_DETAIL)
+        tally(pos, "skip", label, ttl_file)
+    
+    def report_error(pos: int, label: str, log_message: str, message: str, key: Optional[str]) -> None:
+        logger.error(f"❌ {log_message}")
+        tally(pos, "error", label, None, message)
+        keep_previous(key)
+    
+    def on_written(context: Tuple, error: Optional[BaseException]) -> None:
+        """描画・書き込み完了時の処理（投入順に呼ばれる）"""
+        pos, label, ttl_name, ttl_file, key, row_hash, row_started = context
+        if row_started is not None:
+            profiler.add_row(time.perf_counter() - row_started)
+        if error is not None:
+            keep_previous(key)
+        if error is None:
+            new_entries[key] = {"hash": row_hash, "no": label}
+            logger.info(f"✅ {ttl_name}.ttl を生成しました。（No.{label}）", extra=ROW_DETAIL)
+            tally(pos, "success", label, ttl_file)
+        elif isinstance(error, OSError):
+            logger.error(f"❌ ファイル書き込みエラー {ttl_name}.ttl: {str(error)}")
+            tally(pos, "error", label, ttl_file, f"ファイル書き込みエラー: {str(error)}")
         else:
-            rows_to_process = df.iterrows()
-            # 対象行数を事前に表示（generate=yes の行数）
-            generate_count = sum(
-                1 for _, r in df.iterrows()
-                if str(r.get("generate", "")).strip().lower() in ("yes", "true", "1")
-            )
-            logger.info(f"generate=yes の行: {generate_count} 件（全 {len(df)} 行中）")
-            if generate_count == 0:
-                logger.warning("⚠️ 対象行が0件です。Excelの generate 列に yes を指定した行がありますか？")
-        
-        print("[3/4] 行を処理しています...", file=sys.stderr, flush=True)
-        success_count = 0
-        error_count = 0
-        
-        for idx, row in rows_to_process:
+            logger.error(f"❌ No.{label} 処理エラー: {str(error)}")
+            tally(pos, "error", label, ttl_file, f"処理エラー: {str(error)}")
+    
+    pipeline = WritePipeline(args.jobs, on_written)
+    progress = ProgressReporter(logger, len(positions), enabled=get_verbosity(args) == "normal")
+    completed = False
+    try:
+        if template.library is not None and sink.write_library(template.library):
+            logger.info(f"📚 共通ライブラリ {COMMON_LIBRARY_NAME} を出力しました。")
+        for done, pos in enumerate(positions):
+            progress.update(done)
+            if on_progress is not None:
+                on_progress(done, len(positions))
+            idx, row = records[pos]
+            row_started = time.perf_counter() if profiler.enabled else None
+            key = None
             try:
                 # 空白行スキップ
-                if row.isnull().all():
+                if validation.blank[pos]:
                     continue
                 
-                # 生成フラグを確認（--row 指定時は対象行を無条件で処理）
-                generate_flag = str(row.get("generate", "")).strip().lower()
-                if args.row is None and generate_flag == "e":
-                    logger.info("⏹️ 'e' を検出したため、処理を終了します。")
+                # 'e' の行で終了（--row 指定時は対象行を無条件で処理）
+                if not selecting and pos == validation.stop_pos:
+                    pipeline.defer(logger.info, "⏹️ 'e' を検出したため、処理を終了します。")
                     break
-                # yes/true/1 を有効とする（Excel の TRUE や 1 にも対応）
-                if args.row is None and generate_flag not in ("yes", "true", "1"):
-                    continue
                 
-                # 行データの検証
+                # 行データの検証結果（一括検証で計算済み）
                 row_num = row.get('No.', idx + 1)
-                is_valid, validation_errors = validate_row_data(row, row_num)
-                if not is_valid:
-                    error_msg = f"No.{row_num} データ検証エラー: {'; '.join(validation_errors)}"
-                    logger.error(f"❌ {error_msg}")
-                    error_count += 1
+                label = row_label(inventory, pos, row_num)
+                validation_errors = validation.errors.get(pos)
+                if validation_errors:
+                    message = f"データ検証エラー: {'; '.join(validation_errors)}"
+                    pipeline.defer(report_error, pos, label, f"No.{label} {message}", message, row_manifest_key(row, output_dir))
                     continue
                 
                 # データの抽出と処理
                 data = extract_row_data(row)
-                target_dir = get_target_directory(data)
-                content = generate_ttl_content(data, template, timestamp, target_dir)
-                
-                # マクロファイルを生成
                 ttl_name = f"{data['name']}_{data['host']}_{data['user']}"
-                ttl_file = target_dir / f"{ttl_name}.ttl"
+                ttl_file = resolve_target_directory(data, output_dir) / f"{ttl_name}.ttl"
+                key = manifest_key(ttl_file, output_dir)
+                row_hash = compute_row_hash(data, template_hash)
                 
-                try:
-                    ttl_file.write_text(content, encoding="utf-8")
-                    logger.info(f"✅ {ttl_name}.ttl を生成しました。（No.{row_num}）")
-                    success_count += 1
-                except Exception as e:
-                    logger.error(f"❌ ファイル書き込みエラー {ttl_name}.ttl: {str(e)}")
-                    error_count += 1
+                # 差分生成: 入力が変わっておらずファイルも残っていればスキップ
+                old_entry = old_entries.get(key)
+                if args.incremental and old_entry and old_entry.get("hash") == row_hash and file_exists(ttl_file):
+                    new_entries[key] = old_entry
+                    pipeline.defer(report_skip, pos, label, ttl_name, ttl_file)
+                    continue
+                
+                # ディレクトリ準備までは順番に行い、描画と書き込みをパイプラインに渡す
+                target_dir = sink.prepare(data)
+                pipeline.submit(
+                    (pos, label, ttl_name, ttl_file, key, row_hash, row_started),
+                    render_and_write, data, template, timestamp, target_dir, paths.base_dir, ttl_file,
+                    sink, sink.make_entry(data, label, row_hash)
+                )
                     
             except Exception as e:
-                row_num = row.get('No.', idx + 1) if not row.isnull().all() else idx + 1
-                logger.error(f"❌ No.{row_num} 処理エラー: {str(e)}")
-                error_count += 1
+                row_num = row.get('No.', idx + 1) if not is_blank_row(row) else idx + 1
+                label = row_label(inventory, pos, row_num)
+                message = f"処理エラー: {str(e)}"
+                pipeline.defer(report_error, pos, label, f"No.{label} {message}", message,
+                               key if key is not None else row_manifest_key(row, output_dir))
+        completed = True
+    finally:
+        try:
+            pipeline.close()
+        finally:
+            # 中断した場合、作成途中のアーカイブは残さない
+            sink.close(completed)
+    if on_progress is not None:
+        on_progress(len(positions), len(positions))
+    if isinstance(sink, ArchiveSink):
+        logger.info(f"📦 バンドルを作成しました: {sink.path}（マクロ {len(sink.entries)} 件）", extra=SUMMARY)
+    
+    # 孤立マクロ（前回生成されたが今回の台帳に存在しない）の一覧
+    if selecting:
+        orphaned = sorted(key for key in superseded if key in new_entries)
+        for key in orphaned:
+            del new_entries[key]
+    else:
+        orphaned = sorted(set(old_entries) - set(new_entries))
+    for key in orphaned:
+        logger.warning(f"🗑️ 台帳に存在しないマクロ: {key}（No.{old_entries[key].get('no', '?')}）")
+    counts["orphaned"] = len(orphaned)
+    counts["directories"] = sink.prepared_count
+    if shard_counts is not None:
+        counts["shards"] = list(zip(inventory.shard_labels, shard_counts))
+    if not sink.uses_manifest:
+        return counts
+    
+    # マニフェストの更新
+    manifest["template_hash"] = template_hash
+    manifest["entries"] = new_entries
+    try:
+        save_manifest(manifest, paths.manifest_path)
+    except Exception as e:
+        logger.warning(f"⚠️ マニフェストの保存に失敗しました: {paths.manifest_path} - {str(e)}")
+    return counts
+
+def log_summary(logger: logging.Logger, counts: Dict[str, int]) -> None:
+    """処理結果サマリーを出力する"""
+    logger.info(
+        f"📊 処理完了 - 成功: {counts['success']}件, スキップ: {counts['skip']}件, "
+        f"エラー: {counts['error']}件, 孤立: {counts['orphaned']}件, "
+        f"準備したディレクトリ: {counts['directories']}件",
+        extra=SUMMARY
+    )
+    for label, shard in counts.get("shards", []):
+        logger.info(
+            f"  📄 {label} - 行: {shard['rows']}件, 成功: {shard['success']}件, "
+            f"スキップ: {shard['skip']}件, エラー: {shard['error']}件",
+            extra=SUMMARY
+        )
+
+def file_signature(path: Path) -> Optional[Tuple[int, int]]:
+    """変更検知用のシグネチャ（更新日時, サイズ）。ファイルがない場合は None"""
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def snapshot_rows(inventory: Inventory, validation: ValidationResult) -> Dict[object, Tuple[int, tuple, bool]]:
+    """No. をキーにした行のスナップショット（行位置, 内容, 生成対象か）
+
+    複数の台帳を読み込んだ場合は No. に読み込み元を付けてキーにする。
+    """
+    snapshot = {}
+    for pos, (_, row) in enumerate(inventory.records):
+        if validation.blank[pos]:
+            continue
+        number = to_row_number(row.get('No.'))
+        if number is not None and inventory.shard_ids is not None:
+            number = row_label(inventory, pos, number)
+        key = number if number is not None and number not in snapshot else ("pos", pos)
+        content = tuple((column, None if is_na(value) else value) for column, value in row.items())
+        snapshot[key] = (pos, content, validation.targets[pos])
+    return snapshot
+
+def diff_snapshots(old: Dict[object, Tuple[int, tuple, bool]],
+                   new: Dict[object, Tuple[int, tuple, bool]]) -> Tuple[List[int], List[object]]:
+    """スナップショットを比較し、追加・変更された行位置と、削除または生成対象外になった行の No. を返す"""
+    changed = []
+    for key, (pos, content, is_target) in new.items():
+        previous = old.get(key)
+        if previous is None or previous[1] != content or previous[2] != is_target:
+            changed.append(pos)
+    removed = [key for key, (_, _, was_target) in old.items() if was_target and not new.get(key, (0, (), False))[2]]
+    return sorted(changed), removed
+
+def superseded_keys(old: Dict[object, Tuple[int, tuple, bool]], new: Dict[object, Tuple[int, tuple, bool]],
+                    inventory: Inventory, validation: ValidationResult, output_dir: Path) -> List[str]:
+    """変更・削除された行の前回の出力先のうち、今回どの行の出力先でもなくなったもの（name・host・user・グループの変更など）"""
+    old_keys = set()
+    for key, (_, content, was_target) in old.items():
+        current = new.get(key)
+        if was_target and (current is None or current[1] != content):
+            old_keys.add(row_manifest_key(dict(content), output_dir))
+    old_keys.discard(None)
+    if not old_keys:
+        return []
+    current_keys = {
+        row_manifest_key(row, output_dir) for pos, (_, row) in enumerate(inventory.records) if validation.targets[pos]
+    }
+    return sorted(old_keys - current_keys)
+
+def watch_inventory(args: GenerateOptions, paths: PathConfig, logger: logging.Logger, template: CompiledTemplate, inventory: Inventory,
+                    validation: ValidationResult, shards: List[InputShard]) -> None:
+    """台帳とテンプレートを監視し、変更のあった行だけ再生成する（テンプレート変更時は全行）
+
+    Excel の保存中はファイルが一時的に消えたり読み込めなかったりするため、
+    更新日時・サイズが1回分の監視間隔のあいだ変わらなくなってから読み込み、失敗した場合は次の確認で再試行する。
+    """
+    selecting = has_row_selection(args)
+    template_path = paths.template_path
+    snapshot = snapshot_rows(inventory, validation)
+    input_paths = list(dict.fromkeys(shard.path for shard in shards))
+    signatures = {path: file_signature(path) for path in (*input_paths, template_path)}
+    pending: Dict[Path, Tuple[int, int]] = {}
+    watched = "、".join(path.name for path in signatures)
+    logger.info(f"👀 {watched} の変更を監視しています（{args.interval}秒間隔、Ctrl+C で終了）")
+    try:
+        while True:
+            time.sleep(args.interval)
+            changed = []
+            for path in signatures:
+                signature = file_signature(path)
+                if signature is None or signature == signatures[path]:
+                    pending.pop(path, None)
+                    continue
+                if pending.get(path) != signature:
+                    # 保存中の可能性があるため、次の確認で変わっていなければ読み込む
+                    pending[path] = signature
+                    continue
+                changed.append(path)
+            if not changed:
+                continue
+            
+            try:
+                new_template = load_compiled_template(paths, args.include_common) if template_path in changed else template
+                new_inventory = (
+                    load_merged_inventory(shards, args.engine, None if args.no_cache else paths.cache_dir)
+                    if any(path in changed for path in input_paths) else inventory
+                )
+                check_required_columns(new_inventory)
+            except Exception as e:
+                logger.warning(f"⚠️ 読み込みに失敗しました。次の確認で再試行します: {str(e)}")
+                continue
+            for path in changed:
+                signatures[path] = pending.pop(path)
+            
+            new_validation = validate_inventory(new_inventory, paths)
+            new_snapshot = snapshot_rows(new_inventory, new_validation)
+            if selecting:
+                eligible = set(select_positions(args, new_inventory.records, new_validation, logger,
+                                                new_inventory.shard_ids))
+            else:
+                eligible = {pos for pos, is_target in enumerate(new_validation.targets) if is_target}
+            
+            if template_path in changed and new_template.hash == template.hash and new_template.library is not None:
+                # 共通区間だけの変更: 各マクロは変わらないため共通ライブラリだけを書き直す
+                if DirectorySink(paths.output_dir).write_library(new_template.library):
+                    logger.info(f"📚 テンプレートの共通区間が変更されたため、{COMMON_LIBRARY_NAME} だけを更新しました")
+                changed_positions, removed = diff_snapshots(snapshot, new_snapshot)
+                for key in removed:
+                    label = key[1] if isinstance(key, tuple) else key
+                    logger.warning(f"🗑️ 台帳から削除された、または生成対象外になった行: No.{label}")
+                positions = [pos for pos in changed_positions if pos in eligible]
+                full = False
+            elif template_path in changed:
+                logger.info("📝 テンプレートが変更されたため、すべての対象行を再生成します")
+                if new_template.unknown:
+                    unknown = ", ".join(f"{{{key}}}" for key in new_template.unknown)
+                    logger.warning(f"⚠️ テンプレートに未知のプレースホルダーがあります（置換されません）: {unknown}")
+                positions = sorted(eligible) if selecting else target_positions(new_validation)
+                full = not selecting
+            else:
+                changed_positions, removed = diff_snapshots(snapshot, new_snapshot)
+                for key in removed:
+                    label = key[1] if isinstance(key, tuple) else key
+                    logger.warning(f"🗑️ 台帳から削除された、または生成対象外になった行: No.{label}")
+                positions = [pos for pos in changed_positions if pos in eligible]
+                full = False
+            
+            # 出力先が変わった・削除された行の前回のマクロ（全行の再生成では通常の孤立マクロの判定で扱う）
+            superseded = [] if full else superseded_keys(snapshot, new_snapshot, new_inventory, new_validation,
+                                                             paths.output_dir)
+            template, inventory, snapshot = new_template, new_inventory, new_snapshot
+            if not positions and not superseded:
+                logger.info("変更された生成対象の行はありません")
+                continue
+            if positions:
+                logger.info(f"📝 変更を検出しました。{len(positions)} 行を再生成します")
+            counts = process_positions(args, paths, logger, template, inventory, new_validation, positions,
+                                       not full, superseded=superseded)
+            log_summary(logger, counts)
+    except KeyboardInterrupt:
+        logger.info("⏹️ 監視を終了します。")
+
+# --- 疎通確認（--probe） ---
+PROBE_VERSION = 1
+PROBE_BANNER_BYTES = 255  # SSH のバナー（識別文字列）は改行を含めて最大 255 バイト
+# 結果の種類（open: 接続可 / refused: 拒否 / timeout: タイムアウト / error: 名前解決の失敗など）
+PROBE_STATUSES = ("open", "refused", "timeout", "error")
+
+class ProbeTarget:
+    """疎通確認の対象（同じ接続先を参照する行はまとめて1回だけ確認する）"""
+    __slots__ = ("host", "port", "rows")
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.rows: List[Tuple[str, str]] = []  # (マクロのキー, 行番号)
+
+    @property
+    def key(self) -> str:
+        return f"{self.host}:{self.port}"
+
+def collect_probe_targets(inventory: Inventory, validation: ValidationResult, positions: List[int],
+                          output_dir: Path, logger: logging.Logger) -> Dict[str, ProbeTarget]:
+    """検証を通った行から接続先（ホスト:ポート）の一覧を作る（検証エラーの行は対象外）"""
+    targets: Dict[str, ProbeTarget] = {}
+    for pos in positions:
+        if validation.blank[pos] or pos == validation.stop_pos:
+            continue
+        idx, row = inventory.records[pos]
+        label = row_label(inventory, pos, row.get('No.', idx + 1))
+        if validation.errors.get(pos):
+            logger.warning(f"⚠️ No.{label} はデータ検証エラーのため疎通確認の対象外です")
+            continue
+        data = extract_row_data(row)
+        ttl_file = resolve_target_directory(data, output_dir) / f"{data['name']}_{data['host']}_{data['user']}.ttl"
+        target = ProbeTarget(data["host"], int(data["port"]))
+        targets.setdefault(target.key, target).rows.append((manifest_key(ttl_file, output_dir), label))
+    return targets
+
+async def probe_endpoint(host: str, port: int, timeout: float, read_banner: bool) -> Dict:
+    """1件の接続先に TCP 接続し、結果（状態・所要時間・バナー）を返す"""
+    import asyncio
+    started = time.perf_counter()
+    result = {"status": "open", "latency_ms": None, "banner": "", "error": ""}
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        if read_banner:
+            try:
+                line = await asyncio.wait_for(reader.readline(), timeout)
+                result["banner"] = line[:PROBE_BANNER_BYTES].decode("utf-8", errors="replace").strip()
+            except asyncio.TimeoutError:
+                result["error"] = "バナーを受信できませんでした"
+    except asyncio.TimeoutError:
+        result["status"] = "timeout"
+    except ConnectionRefusedError as e:
+        result.update(status="refused", error=str(e))
+    except OSError as e:
+        result.update(status="error", error=str(e))
+    finally:
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+    return result
+
+async def probe_targets(targets: List[ProbeTarget], concurrency: int, timeout: float, read_banner: bool,
+                        on_done: Callable[[ProbeTarget, Dict], None]) -> None:
+    """接続先を同時接続数 concurrency までで並行に確認し、完了順に on_done を呼ぶ"""
+    import asyncio
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(target: ProbeTarget) -> Tuple[ProbeTarget, Dict]:
+        async with semaphore:
+            return target, await probe_endpoint(target.host, target.port, timeout, read_banner)
+
+    for future in asyncio.as_completed([run(target) for target in targets]):
+        target, result = await future
+        on_done(target, result)
+
+def load_probe_cache(cache_path: Path) -> Dict[str, Dict]:
+    """接続先ごとの前回の確認結果を読み込む（存在しない・壊れている場合は空）"""
+    try:
+        cache = json.loads(cache_path.read_text(encoding="utf-8"))
+        if cache.get("version") == PROBE_VERSION and isinstance(cache.get("entries"), dict):
+            return cache["entries"]
+    except (OSError, ValueError):
+        pass
+    return {}
+
+def save_probe_cache(entries: Dict[str, Dict], cache_path: Path) -> None:
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps({"version": PROBE_VERSION, "entries": entries}, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp_path, cache_path)
+
+def run_probe(args: GenerateOptions, paths: PathConfig, logger: logging.Logger, inventory: Inventory, validation: ValidationResult,
+              positions: List[int]) -> Dict[str, int]:
+    """対象行の接続先に TCP 接続できるかを確認し、logs/probe_report.json に保存して件数を返す
+
+    同じ接続先は1回だけ確認し、--probe-ttl 秒以内に確認した接続先は前回の結果を使う。
+    """
+    targets = collect_probe_targets(inventory, validation, positions, paths.output_dir, logger)
+    cache = load_probe_cache(paths.probe_cache_path) if args.probe_ttl > 0 else {}
+    now = time.time()
+    results: Dict[str, Dict] = {}
+    pending = []
+    for key, target in targets.items():
+        cached = cache.get(key)
+        if (cached and now - cached.get("checked_at", 0) < args.probe_ttl
+                and (cached.get("banner_read") or not args.probe_banner)):
+            results[key] = dict(cached, cached=True)
+        else:
+            pending.append(target)
+    logger.info(
+        f"📡 疎通確認: 接続先 {len(targets)} 件（確認 {len(pending)} 件, キャッシュ {len(targets) - len(pending)} 件）"
+        f" 同時接続 {args.probe_concurrency}, タイムアウト {args.probe_timeout}秒"
+    )
+    
+    progress = ProgressReporter(logger, len(pending), enabled=get_verbosity(args) == "normal")
+    done = [0]
+    
+    def on_probed(target: ProbeTarget, result: Dict) -> None:
+        result.update(checked_at=time.time(), banner_read=args.probe_banner)
+        results[target.key] = dict(result, cached=False)
+        cache[target.key] = result
+        done[0] += 1
+        progress.update(done[0])
+    
+    if pending:
+        import asyncio
+        asyncio.run(probe_targets(pending, args.probe_concurrency, args.probe_timeout, args.probe_banner, on_probed))
+    
+    counts = {status: 0 for status in PROBE_STATUSES}
+    entries = {}
+    for key, target in targets.items():
+        result = results[key]
+        counts[result["status"]] += 1
+        checked_at = datetime.fromtimestamp(result["checked_at"]).isoformat(timespec="seconds")
+        for macro, label in target.rows:
+            entries[macro] = {
+                "no": label, "host": target.host, "port": target.port, "status": result["status"],
+                "latency_ms": result["latency_ms"], "banner": result["banner"], "error": result["error"],
+                "checked_at": checked_at, "cached": result["cached"],
+            }
+        if result["status"] == "open":
+            banner = f" {result['banner']}" if result["banner"] else ""
+            logger.info(f"✅ {key} 接続可（{result['latency_ms']}ms）{banner}", extra=ROW_DETAIL)
+        else:
+            rows = ", ".join(f"No.{label}" for _, label in target.rows)
+            reason = {"refused": "接続拒否", "timeout": "タイムアウト", "error": "エラー"}[result["status"]]
+            detail = f": {result['error']}" if result["error"] else ""
+            logger.warning(f"⚠️ {key} {reason}{detail}（{rows}）")
+    
+    report = {
+        "version": PROBE_VERSION,
+        "checked_at": datetime.now().isoformat(timespec="seconds"),
+        "timeout": args.probe_timeout,
+        "banner": args.probe_banner,
+        "counts": counts,
+        "entries": {macro: entries[macro] for macro in sorted(entries)},
+    }
+    try:
+        paths.logs_dir.mkdir(parents=True, exist_ok=True)
+        paths.probe_report_path.write_text(json.dumps(report, ensure_ascii=False, indent=1), encoding="utf-8")
+        logger.info(f"📄 疎通確認の結果を保存しました: {paths.probe_report_path}")
+    except OSError as e:
+        logger.warning(f"⚠️ 疎通確認の結果の保存に失敗しました: {paths.probe_report_path} - {str(e)}")
+    if args.probe_ttl > 0:
+        try:
+            save_probe_cache(cache, paths.probe_cache_path)
+        except OSError as e:
+            logger.warning(f"⚠️ 疎通確認のキャッシュの保存に失敗しました: {paths.probe_cache_path} - {str(e)}")
+    logger.info(
+        f"📊 疎通確認完了 - 接続可: {counts['open']}件, 接続拒否: {counts['refused']}件, "
+        f"タイムアウト: {counts['timeout']}件, エラー: {counts['error']}件（マクロ {len(entries)} 件）",
+        extra=SUMMARY
+    )
+    return counts
+
+# --- 呼び出し元のプロセス内での生成（ランチャーなどから使う） ---
+class RowResult:
+    """1行分の処理結果（status は success / skip / error。path は出力先のTTLで、検証エラーの行などでは None）"""
+    __slots__ = ("pos", "label", "status", "path", "message")
+
+    def __init__(self, pos: int, label: str, status: str, path: Optional[Path] = None, message: str = ""):
+        self.pos = pos
+        self.label = label
+        self.status = status
+        self.path = path
+        self.message = message
+
+class GenerationResult:
+    """MacroGenerator.generate() の結果（行ごとの結果・件数・フェーズごとの経過時間（秒）・読み直したもの）"""
+    __slots__ = ("rows", "counts", "timings", "reloaded")
+
+    def __init__(self, rows: List[RowResult], counts: Dict, timings: Dict[str, float], reloaded: List[str]):
+        self.rows = rows
+        self.counts = counts
+        self.timings = timings
+        self.reloaded = reloaded
+
+    @property
+    def written(self) -> List[Path]:
+        """今回書き出したTTL"""
+        return [row.path for row in self.rows if row.status == "success"]
+
+    @property
+    def errors(self) -> List[RowResult]:
+        return [row for row in self.rows if row.status == "error"]
+
+class MacroGenerator:
+    """TTLマクロを呼び出し元のプロセス内で生成する（再生成のたびに Python の起動や台帳の解析を行わない）
+
+    テンプレート・読み込んだ台帳・検証結果を保持し、ファイル（keys/ は直下の追加・削除）が変わったときだけ読み直す。
+    エラーは sys.exit ではなく例外で返し、行ごとの結果・書き出したパス・経過時間を GenerationResult で返す。
+    パスはインスタンスごとの PathConfig で持つため、出力先の異なる複数のインスタンスを同時に使える
+    （同じインスタンスの load() / generate() は順番に実行する）。
+    ログは logger を渡した場合はそのロガーに、省略した場合は log_handler（省略時は logs/generate_inprocess.log）に書く。
+    generate.log はコマンドラインの生成が切り替えながら書くため使わない（Windows では別の
+    プロセスが開いているファイルを切り替えられない）。
+    """
+
+    def __init__(self, base_dir: Optional[Path] = None, input_paths: Optional[List[Path]] = None,
+                 template_path: Optional[Path] = None, output_dir: Optional[Path] = None,
+                 logs_dir: Optional[Path] = None, keys_dir: Optional[Path] = None, cache_dir: Optional[Path] = None,
+                 engine: str = DEFAULT_ENGINE, include_common: bool = False, jobs: int = 1,
+                 use_cache: bool = True, logger: Optional[logging.Logger] = None,
+                 log_handler: Optional[logging.Handler] = None):
+        if engine not in ENGINES:
+            raise ValueError(f"読み込みエンジンは {', '.join(ENGINES)} のいずれかを指定してください: {engine}")
+        if jobs < 1:
+            raise ValueError(f"並列数には1以上を指定してください: {jobs}")
+        self.paths = PathConfig.under(
+            base_dir or BASE_DIR, input_path=input_paths[0] if input_paths else None, template_path=template_path,
+            output_dir=output_dir, logs_dir=logs_dir, keys_dir=keys_dir, cache_dir=cache_dir,
+        )
+        try:
+            self.paths.output_dir.relative_to(self.paths.base_dir)
+        except ValueError:
+            # マクロはログ・キーファイルを自身からの相対パスで参照する
+            raise ValueError(f"出力先は {self.paths.base_dir} の下にある必要があります: {self.paths.output_dir}")
+        self.input_paths = [Path(path).resolve() for path in input_paths] if input_paths else [self.paths.input_path]
+        # process_positions などに渡すオプション（行の選択・差分生成は generate() ごとに指定する）
+        self.options = GenerateOptions(engine=engine, include_common=include_common, jobs=jobs,
+                                       no_cache=not use_cache, quiet=True)
+        self.logger = logger
+        self.log_handler = log_handler
+        self._log_file_handler: Optional[logging.FileHandler] = None
+        self.template: Optional[CompiledTemplate] = None
+        self.inventory: Optional[Inventory] = None
+        self.validation: Optional[ValidationResult] = None
+        self.key_index: Optional[KeyIndex] = None
+        self._input_signatures: Optional[Dict[Path, Optional[Tuple[int, int]]]] = None
+        self._keys_signature: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def output_dir(self) -> Path:
+        return self.paths.output_dir
+
+    def load(self, force: bool = False) -> List[str]:
+        """テンプレートと台帳を読み込み、読み直したもの（template / inventory / validation）を返す
+
+        force=True の場合は変更がなくても台帳を読み直す。
+        """
+        with self._lock:
+            try:
+                return self._load(force)
+            finally:
+                self._release_log_file()
+
+    def _get_logger(self) -> logging.Logger:
+        if self.logger is None:
+            handler = self.log_handler
+            if handler is None:
+                self.paths.logs_dir.mkdir(parents=True, exist_ok=True)
+                handler = self._log_file_handler = logging.FileHandler(
+                    self.paths.logs_dir / INPROCESS_LOG_NAME, encoding='utf-8', delay=True
+                )
+                handler.setFormatter(logging.Formatter('[%(asctime)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+                handler.addFilter(FileFilter())
+            # コマンドラインのロガー（'generate'）とは別に、インスタンスごとのロガーを使う
+            logger = logging.getLogger(f"generate.inprocess.{id(self):x}")
+            logger.handlers.clear()
+            logger.setLevel(logging.INFO)
+            logger.addHandler(handler)
+            logger.propagate = False
+            self.logger = logger
+        return self.logger
+
+    def _release_log_file(self) -> None:
+        """呼び出しの合間はログファイルを閉じておく（次の書き込みで開き直す）"""
+        if self._log_file_handler is not None:
+            self._log_file_handler.close()
+
+    def _load(self, force: bool) -> List[str]:
+        logger = self._get_logger()
+        reloaded = []
+        template = load_compiled_template(self.paths, self.options.include_common)
+        if template is not self.template:
+            if template.unknown:
+                unknown = ", ".join(f"{{{key}}}" for key in template.unknown)
+                logger.warning(f"⚠️ テンプレートに未知のプレースホルダーがあります（置換されません）: {unknown}")
+            self.template = template
+            reloaded.append("template")
+        # 読み込み中に保存された場合も次回に読み直すよう、シグネチャは読み込む前に取る
+        signatures = {path: file_signature(path) for path in self.input_paths}
+        if force or self.inventory is None or signatures != self._input_signatures:
+            shards = list_shards(self.input_paths, self.options.sheet, self.options.all_sheets, logger)
+            cache_dir = None if self.options.no_cache else self.paths.cache_dir
+            inventory = load_merged_inventory(shards, self.options.engine, cache_dir, logger=logger)
+            check_required_columns(inventory)
+            self.inventory, self.validation, self._input_signatures = inventory, None, signatures
+            reloaded.append("inventory")
+        keys_signature = file_signature(self.paths.keys_dir)
+        if self.validation is None or keys_signature != self._keys_signature:
+            if self.key_index is None or keys_signature != self._keys_signature:
+                self.key_index = KeyIndex(self.paths.keys_dir)
+            self.validation = validate_inventory(self.inventory, self.paths, self.key_index)
+            self._keys_signature = keys_signature
+            reloaded.append("validation")
+        return reloaded
+
+    def generate(self, rows: Optional[str] = None, incremental: bool = True,
+                 progress: Optional[Callable[[int, int], None]] = None, **patterns: str) -> GenerationResult:
+        """マクロを生成して結果を返す
+
+        rows（例: "5,9,120-180"）と patterns（group1 / group2 / group3 / host / name の glob パターン）は
+        --row・--group1 などと同じ。incremental=True の場合は入力が変わった行だけを書き出す。
+        progress は (処理済み, 全体) の行数で、生成を行うスレッドから呼ばれる。
+        """
+        unknown = set(patterns) - set(FILTER_COLUMNS)
+        if unknown:
+            raise ValueError(f"不明な絞り込み条件です: {', '.join(sorted(unknown))}")
+        try:
+            row = parse_row_spec(rows) if rows is not None else None
+        except argparse.ArgumentTypeError as e:
+            raise ValueError(str(e))
+        args = replace(self.options, row=row, incremental=incremental,
+                       **{column: patterns.get(column) for column in FILTER_COLUMNS})
+
+        started = time.perf_counter()
+        timings: Dict[str, float] = {}
+        with self._lock:
+            try:
+                logger = self._get_logger()
+                reloaded = self._load(False)
+                timings["load"] = time.perf_counter() - started
+                logger.info("生成開始")
+                selecting = has_row_selection(args)
+                if selecting:
+                    positions = select_positions(args, self.inventory.records, self.validation, logger,
+                                                 self.inventory.shard_ids)
+                else:
+                    positions = target_positions(self.validation)
+                row_results: List[RowResult] = []
+                process_started = time.perf_counter()
+                counts = process_positions(args, self.paths, logger, self.template, self.inventory, self.validation,
+                                           positions, selecting, row_results, progress)
+                timings["process"] = time.perf_counter() - process_started
+                log_summary(logger, counts)
+            finally:
+                self._release_log_file()
+        timings["total"] = time.perf_counter() - started
+        return GenerationResult(row_results, counts, timings, reloaded)
+
+def generate_ttl_macros(args: GenerateOptions):
+    """TTLマクロを生成するメイン関数"""
+    # 複数指定した場合、input_path（計測結果などに記録する代表のパス）は最初の台帳とする
+    paths = PathConfig.under(BASE_DIR, input_path=args.input[0] if args.input else None)
+    input_paths = [Path(path).resolve() for path in args.input] if args.input else [paths.input_path]
+    profiler.enabled = args.profile
+    if profiler.enabled:
+        profiler.phases["imports"] = time.perf_counter() - STARTED_AT
+    # pandas エンジンの場合のみここで pandas をインポート（import で落ちる環境でもスクリプトはここまで起動する）
+    if args.engine == "pandas":
+        with profiler.phase("import_pandas"):
+            try:
+                import_pandas()
+            except ImportError as e:
+                print(e, file=sys.stderr, flush=True)
+                sys.exit(1)
+    print("[1/4] ログ設定...", file=sys.stderr, flush=True)
+    with profiler.phase("logging"):
+        logger = setup_logging(paths.logs_dir, get_verbosity(args))
+    
+    try:
+        # 初期化処理
+        logger.info("[2/4] テンプレート・Excel 読み込み...", extra=STEP)
+        with profiler.phase("template"):
+            template = load_compiled_template(paths, args.include_common)
+        selecting = has_row_selection(args)
+        with profiler.phase("load"):
+            shards = list_shards(input_paths, args.sheet, args.all_sheets, logger)
+            profiler.inputs = [shard.label for shard in shards]
+            cache_dir = None if args.no_cache else paths.cache_dir
+            inventory = load_merged_inventory(shards, args.engine, cache_dir, logger=logger)
+        records = inventory.records
+        
+        if len(shards) == 1:
+            logger.info(f"読み込み元: {shards[0].path}" + (f"（シート: {shards[0].sheet}）" if shards[0].sheet else ""))
+        else:
+            logger.info(f"読み込み元: {len(shards)} 件の台帳・シート（{', '.join(shard.label for shard in shards)}）")
+        if inventory.from_cache:
+            logger.info("📦 台帳に変更がないため、キャッシュから読み込みました（--no-cache で再解析）")
+        if template.unknown:
+            unknown = ", ".join(f"{{{key}}}" for key in template.unknown)
+            logger.warning(f"⚠️ テンプレートに未知のプレースホルダーがあります（置換されません）: {unknown}")
+        logger.info("生成開始")
+        
+        check_required_columns(inventory)
+        
+        # キーファイルの確認のみ
+        if args.check_keys:
+            report_keys(inventory, KeyIndex(paths.keys_dir), logger)
+            return
+        
+        # 台帳全体を一括で検証（行ごとのエラー・生成対象・件数）
+        with profiler.phase("validate"):
+            validation = validate_inventory(inventory, paths)
+        
+        # 行番号・絞り込み条件が指定されている場合
+        if selecting:
+            positions = select_positions(args, records, validation, logger, inventory.shard_ids)
+            if not positions:
+                logger.error("❌ 指定された条件に一致する行は見つかりませんでした")
+                return
+            logger.info(f"📝 指定された {len(positions)} 行のサーバーを処理します")
+        else:
+            positions = target_positions(validation)
+            # 対象行数を事前に表示（generate=yes の行数）
+            generate_count = validation.generate_count
+            logger.info(f"generate=yes の行: {generate_count} 件（全 {len(records)} 行中）")
+            if generate_count == 0:
+                logger.warning("⚠️ 対象行が0件です。Excelの generate 列に yes を指定した行がありますか？")
+        
+        # 疎通確認のみ（マクロは生成しない）
+        if args.probe:
+            logger.info("[3/4] 接続先を確認しています...", extra=STEP)
+            with profiler.phase("probe"):
+                run_probe(args, paths, logger, inventory, validation, positions)
+            logger.info("[4/4] 完了", extra=STEP)
+            return
+        
+        logger.info("[3/4] 行を処理しています...", extra=STEP)
+        with profiler.phase("process"):
+            counts = process_positions(args, paths, logger, template, inventory, validation, positions, selecting)
         
         # 処理結果サマリー
-        print("[4/4] 完了", file=sys.stderr, flush=True)
-        logger.info(f"📊 処理完了 - 成功: {success_count}件, エラー: {error_count}件")
+        logger.info("[4/4] 完了", extra=STEP)
+        log_summary(logger, counts)
+        if profiler.enabled:
+            profiler.phases["total"] = time.perf_counter() - STARTED_AT
+            profiler.write_report(args, paths, logger)
+            profiler.enabled = False  # 監視モードの再生成は計測しない
+        
+        # 監視モード（初回の生成後、変更のあった行だけ再生成し続ける）
+        if args.watch:
+            watch_inventory(args, paths, logger, template, inventory, validation, shards)
         
     except Exception as e:
         err_msg = f"致命的エラー: {str(e)}"
         tb_lines = traceback.format_exc()
-        # 必ず stderr にトレースバックを出す（ログ未初期化でも確実に表示）
-        print("", file=sys.stderr)
-        print("=== エラー内容（トレースバック） ===", file=sys.stderr)
-        print(tb_lines, file=sys.stderr)
-        print("====================================", file=sys.stderr)
+        logged = False
         try:
             logger.error(f"❌ {err_msg}")
             # ログファイルにもトレースバックを残す（コンソールに出ない場合のため）
             logger.error("トレースバック:\n%s", tb_lines)
+            logged = True
         except NameError:
+            pass
+        # キューに残ったログを書き出してから stderr に直接書く（行が混ざらないようにする）
+        stop_logging()
+        # 必ず stderr にトレースバックを出す（ログ未初期化でも確実に表示）
+        print("", file=sys.stderr)
+        print("=== エラー内容（トレースバック） ===", file=sys.stderr)
+        print(tb_lines, file=sys.stderr)
+        print("====================================", file=sys.stderr)
+        if not logged:
             print(f"エラー: {err_msg}", file=sys.stderr)
         sys.stderr.flush()
         sys.exit(1)
@@ -426,7 +2970,19 @@ def generate_ttl_macros(args):
 if __name__ == "__main__":
     try:
         args = parse_args()
-        generate_ttl_macros(args)
+        if args.pstats:
+            import cProfile
+            cprofile = cProfile.Profile()
+            try:
+                cprofile.runcall(generate_ttl_macros, args)
+            finally:
+                cprofile.dump_stats(args.pstats)
+                stop_logging()
+                print(f"cProfile の統計を保存しました: {args.pstats}", file=sys.stderr, flush=True)
+        else:
+            generate_ttl_macros(args)
+        # キューに残ったログ（サマリーなど）を書き出してから終了を表示する
+        stop_logging()
         print("TTLマクロ生成を終了しました。", file=sys.stderr, flush=True)
         sys.exit(0)
     except SystemExit:
@@ -434,6 +2990,7 @@ if __name__ == "__main__":
     except Exception:
         # どこで落ちてもトレースバックを必ず stderr に出す
         tb_lines = traceback.format_exc()
+        stop_logging()
         print("", file=sys.stderr)
         print("=== 予期しないエラー（トレースバック） ===", file=sys.stderr)
         print(tb_lines, file=sys.stderr)
@@ -0,0 +1,441 @@
+"""セッションログの索引（logs/ 以下の Tera Term のログを SQLite に登録して高速に検索する）
+
+テンプレートは接続ごとに logs/ へ「マクロ名_ユーザー_ホスト_YYYYmmdd_HHMMSS.log」を書き出す。
+ファイルごとに索引済みの位置（バイトオフセット）を記録し、2回目以降は追記された部分と新しいファイルだけを読む。
+本文は SQLite の FTS5（trigram トークナイザ。使えない環境では通常のテーブルと LIKE）に1行ずつ登録し、
+ファイル名から取り出したマクロ名・ホスト・ユーザー・接続日時で絞り込める。
+gzip 圧縮したログ（.log.gz）も検索でき、圧縮前のログを最後まで索引済みなら読み直さない
+（途中までの場合は、展開しながら索引済みの位置より後の行だけを登録する）。
+
+索引は .cache/log_index.sqlite3 に保存する（消しても次回の更新で作り直す）。
+
+使い方:
+  python bin/log_index.py                                  # 索引を更新
+  python bin/log_index.py error timeout                    # 索引を更新して検索（空白区切りは AND）
+  python bin/log_index.py --host 10.0.0.5 --since 2025-01-01 kernel
+  python bin/log_index.py --latest web01_root_10.0.0.5     # マクロの最新のログのパス
+  python bin/log_index.py --rebuild
+"""
+from __future__ import annotations
+
+import sys
+import argparse
+import gzip
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+LOGS_DIR = BASE_DIR / "logs"
+INDEX_PATH = BASE_DIR / ".cache" / "log_index.sqlite3"
+INDEX_VERSION = "1"
+
+# テンプレートが書き出すログのファイル名（ttl_name はテンプレートの変数 ttl_name と同じ「マクロ名_ユーザー_ホスト」）
+LOG_NAME_PATTERN = re.compile(r"^(?P<ttl_name>.+)_(?P<stamp>\d{8}_\d{6})\.log(?P<gz>\.gz)?$")
+READ_CHUNK_BYTES = 1 << 20   # 1回に読み込む量（ログが大きくてもメモリ使用量はこの程度に収まる）
+INSERT_BATCH_LINES = 5000    # まとめて登録する行数
+LOG_IDLE_SECONDS = 60        # 最終更新からこの秒数が経ったログは、改行で終わっていない最後の行も登録する
+# 行の rowid は「ファイルID << 32 | 行番号」とし、ファイル単位の削除を rowid の範囲指定で行う
+LINE_ID_BITS = 32
+DEFAULT_SEARCH_LIMIT = 200
+
+
+def parse_log_name(file_name: str) -> Optional[Dict[str, str]]:
+    """ログのファイル名からマクロ名・ホスト・ユーザー・接続日時を取り出す（セッションログでなければ None）
+
+    ホストは '_' を含まないため末尾の区切りで確実に分かれるが、マクロ名とユーザーはどちらも '_' を含みうるため
+    境界はファイル名から決まらない。name・user は最後の '_' で分けた目安で、ユーザーでの絞り込みには使わない
+    （search() は ttl_name の末尾「_ユーザー_ホスト」と比べる）。
+    """
+    m = LOG_NAME_PATTERN.match(file_name)
+    if not m:
+        return None
+    ttl_name = m.group("ttl_name")
+    parts = ttl_name.rsplit("_", 2)
+    name, user, host = parts if len(parts) == 3 else (ttl_name, "", "")
+    started_at = datetime.strptime(m.group("stamp"), "%Y%m%d_%H%M%S").isoformat()
+    return {"ttl_name": ttl_name, "name": name, "host": host, "user": user, "started_at": started_at}
+
+
+def decode_line(raw: bytes) -> str:
+    """ログの1行を文字列にする（UTF-8 でなければ Shift_JIS として読む）"""
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        text = raw.decode("cp932", errors="replace")
+    return text.rstrip("\r\n")
+
+
+def gzip_uncompressed_size(path: Path) -> int:
+    """gzip の末尾に記録された展開後のサイズ（2^32 で割った余り）を返す"""
+    with open(path, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        return int.from_bytes(f.read(4), "little")
+
+
+def iter_new_lines(path: Path, offset: int, include_tail: bool) -> Iterator[Tuple[int, bytes]]:
+    """offset 以降の行を (行末までのバイト位置, 行) で返す
+
+    gzip は先頭から展開しながら読み、offset（展開後の位置）までの行は返さない。
+
+    include_tail=False の場合、改行で終わっていない最後の行は書き込み途中とみなして返さない。
+    """
+    compressed = path.name.endswith(".gz")
+    with (gzip.open(path, "rb") if compressed else open(path, "rb")) as f:
+        if not compressed:
+            f.seek(offset)
+        position = 0 if compressed else offset
+        rest = b""
+        while True:
+            chunk = f.read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            lines = (rest + chunk).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                position += len(line) + 1
+                if position > offset:
+                    yield position, line
+        if rest and (include_tail or compressed) and position + len(rest) > offset:
+            yield position + len(rest), rest
+
+
+class LogIndex:
+    """セッションログの索引（SQLite のファイル1つ。スレッドごとに作成して使う）"""
+
+    def __init__(self, index_path: Path = INDEX_PATH, logs_dir: Path = LOGS_DIR):
+        self.index_path = index_path
+        self.logs_dir = logs_dir
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(index_path), timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.fts = self._create_schema()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "LogIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _create_schema(self) -> bool:
+        """テーブルを作成し、本文の索引に FTS5 を使うかどうかを返す"""
+        conn = self.conn
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is not None and row[0] != INDEX_VERSION:
+            conn.execute("DROP TABLE IF EXISTS files")
+            conn.execute("DROP TABLE IF EXISTS lines")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+            " offset INTEGER NOT NULL DEFAULT 0, line_count INTEGER NOT NULL DEFAULT 0,"
+            " ttl_name TEXT, name TEXT, host TEXT, user TEXT, started_at TEXT, group_dir TEXT,"
+            " resume_at INTEGER NOT NULL DEFAULT 0)"
+        )
+        # resume_at: 途中まで索引したログが圧縮された場合の、展開後の索引済みの位置（この列のない索引には追加する）
+        if "resume_at" not in {row[1] for row in conn.execute("PRAGMA table_info(files)")}:
+            conn.execute("ALTER TABLE files ADD COLUMN resume_at INTEGER NOT NULL DEFAULT 0")
+        for column in ("ttl_name", "host", "user", "started_at"):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS files_{column} ON files ({column}, started_at)")
+        fts = True
+        try:
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS lines USING fts5(text, tokenize='trigram')")
+        except sqlite3.OperationalError:
+            # FTS5・trigram のない SQLite（3.34 より前など）では通常のテーブルに保存し、LIKE で検索する
+            fts = False
+            conn.execute("CREATE TABLE IF NOT EXISTS lines (id INTEGER PRIMARY KEY, text TEXT)")
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (INDEX_VERSION,))
+        conn.commit()
+        return fts
+
+    # --- 索引の更新 ---
+    def _scan_logs(self) -> Dict[str, Tuple[int, int]]:
+        """logs/ 以下のセッションログ（logs/ からの相対パス → (サイズ, 更新日時)）"""
+        found = {}
+        if not self.logs_dir.is_dir():
+            return found
+        stack = [self.logs_dir]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(Path(entry.path))
+                        elif LOG_NAME_PATTERN.match(entry.name):
+                            st = entry.stat()
+                            rel = Path(entry.path).relative_to(self.logs_dir).as_posix()
+                            found[rel] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue
+        return found
+
+    def _delete_lines(self, file_id: int) -> None:
+        start = file_id << LINE_ID_BITS
+        key = "rowid" if self.fts else "id"
+        self.conn.execute(f"DELETE FROM lines WHERE {key} >= ? AND {key} < ?", (start, start + (1 << LINE_ID_BITS)))
+
+    def sync_files(self) -> Dict[str, int]:
+        """ファイルの一覧だけを最新にする（本文は読まない。追加・削除・圧縮・切り詰めを反映する）"""
+        conn = self.conn
+        on_disk = self._scan_logs()
+        indexed = {path: (file_id, size, offset) for file_id, path, size, offset
+                   in conn.execute("SELECT id, path, size, offset FROM files")}
+        stats = {"added": 0, "removed": 0, "compressed": 0, "reset": 0}
+        indexed_offset = {file_id: offset for file_id, _, offset in indexed.values()}
+        for path in [p for p in indexed if p not in on_disk]:
+            file_id = indexed.pop(path)[0]
+            gz_path = path + ".gz"
+            if gz_path in on_disk and gz_path not in indexed:
+                size, mtime_ns = on_disk[gz_path]
+                offset = indexed_offset[file_id]
+                try:
+                    fully_indexed = gzip_uncompressed_size(self.logs_dir / gz_path) == offset % (1 << 32)
+                except OSError:
+                    fully_indexed = False
+                if fully_indexed:
+                    # 最後まで索引済みのログが圧縮された: 本文は同じなのでパスだけ付け替える
+                    conn.execute("UPDATE files SET path = ?, size = ?, mtime_ns = ?, offset = ? WHERE id = ?",
+                                 (gz_path, size, mtime_ns, size, file_id))
+                    indexed[gz_path] = (file_id, size, size)
+                else:
+                    # 前回の更新の後に追記されてから圧縮された: 索引済みの位置より後の行を次の update で登録する
+                    conn.execute(
+                        "UPDATE files SET path = ?, size = ?, mtime_ns = ?, offset = 0, resume_at = ? WHERE id = ?",
+                        (gz_path, size, mtime_ns, offset, file_id)
+                    )
+                    indexed[gz_path] = (file_id, size, 0)
+                stats["compressed"] += 1
+            else:
+                self._delete_lines(file_id)
+                conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+                stats["removed"] += 1
+        for path, (size, mtime_ns) in on_disk.items():
+            known = indexed.get(path)
+            if known is None:
+                meta = parse_log_name(path.rsplit("/", 1)[-1])
+                group_dir = path.rsplit("/", 1)[0] if "/" in path else ""
+                conn.execute(
+                    "INSERT INTO files (path, size, mtime_ns, ttl_name, name, host, user, started_at, group_dir)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, size, mtime_ns, meta["ttl_name"], meta["name"], meta["host"], meta["user"],
+                     meta["started_at"], group_dir)
+                )
+                stats["added"] += 1
+                continue
+            file_id, old_size, offset = known
+            if size < offset or (path.endswith(".gz") and size != old_size):
+                # 切り詰められた・圧縮し直されたログは最初から読み直す
+                self._delete_lines(file_id)
+                conn.execute("UPDATE files SET offset = 0, line_count = 0, resume_at = 0 WHERE id = ?", (file_id,))
+                stats["reset"] += 1
+            if size != old_size:
+                conn.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE id = ?", (size, mtime_ns, file_id))
+        conn.commit()
+        return stats
+
+    def _index_file(self, file_id: int, path: str, offset: int, line_count: int, mtime_ns: int,
+                    resume_at: int = 0) -> int:
+        """ログの未登録の部分を読んで登録し、登録した行数を返す（圧縮したログは展開後の resume_at より後を読む）"""
+        include_tail = time.time() - mtime_ns / 1e9 >= LOG_IDLE_SECONDS
+        insert = ("INSERT INTO lines (rowid, text) VALUES (?, ?)" if self.fts
+                  else "INSERT INTO lines (id, text) VALUES (?, ?)")
+        base = file_id << LINE_ID_BITS
+        batch = []
+        added = 0
+        compressed = path.endswith(".gz")
+        for position, raw in iter_new_lines(self.logs_dir / path, resume_at if compressed else offset, include_tail):
+            line_count += 1
+            offset = position
+            text = decode_line(raw)
+            if text.strip():
+                batch.append((base + line_count, text))
+            if len(batch) >= INSERT_BATCH_LINES:
+                self.conn.executemany(insert, batch)
+                added += len(batch)
+                batch = []
+        if batch:
+            self.conn.executemany(insert, batch)
+            added += len(batch)
+        if compressed:
+            offset = (self.logs_dir / path).stat().st_size
+        self.conn.execute("UPDATE files SET offset = ?, line_count = ? WHERE id = ?", (offset, line_count, file_id))
+        self.conn.commit()
+        return added
+
+    def update(self, progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, int]:
+        """索引を最新にする（新しいログと、前回から追記された部分だけを読む）"""
+        stats = self.sync_files()
+        pending = self.conn.execute(
+            "SELECT id, path, offset, line_count, mtime_ns, resume_at FROM files WHERE offset < size ORDER BY id"
+        ).fetchall()
+        stats.update(files=0, lines=0)
+        for done, (file_id, path, offset, line_count, mtime_ns, resume_at) in enumerate(pending):
+            if progress is not None:
+                progress(done, len(pending))
+            try:
+                stats["lines"] += self._index_file(file_id, path, offset, line_count, mtime_ns, resume_at)
+                stats["files"] += 1
+            except (OSError, EOFError, gzip.BadGzipFile) as e:
+                self.conn.rollback()
+                print(f"[ログの読み込み失敗] {path}: {e}", file=sys.stderr)
+        return stats
+
+    def rebuild(self) -> None:
+        """索引を空にする（次の update ですべてのログを読み直す）"""
+        self.conn.execute("DELETE FROM lines")
+        self.conn.execute("DELETE FROM files")
+        self.conn.commit()
+
+    # --- 検索 ---
+    def search(self, query: str, host: Optional[str] = None, user: Optional[str] = None,
+               ttl_name: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+               limit: int = DEFAULT_SEARCH_LIMIT) -> List[Dict]:
+        """本文に空白区切りのすべての語を含む行を、接続日時の新しいログから順に返す
+
+        3文字以上の語は trigram 索引で検索し、1〜2文字の語は LIKE で確認する（大文字・小文字は区別しない）。
+        since・until は接続日時（ファイル名の日時）の範囲で、'2025-01-01' や '2025-01-01T09:00' の形式。
+        ホスト・ユーザー・マクロを指定した場合は、該当するログを新しい順に1件ずつ検索する（短い語でも全体を走査しない）。
+        ユーザーは ttl_name の末尾で判定するため、user='admin' はマクロ名が '_svc' で終わるユーザー admin のログと
+        ユーザー svc_admin のログの両方に一致する（ファイル名からは区別できない）。
+        """
+        terms = query.split()
+        if not terms:
+            return []
+        key = "l.rowid" if self.fts else "l.id"
+        text_conditions, text_params = self._text_conditions(terms)
+        file_conditions, file_params = [], []
+        for column, value in (("host", host), ("ttl_name", ttl_name)):
+            if value:
+                file_conditions.append(f"f.{column} = ?")
+                file_params.append(value)
+        if user:
+            # ユーザーは '_' を含みうるため、分割した user 列ではなく ttl_name の末尾（_ユーザー_ホスト）で判定する
+            file_conditions.append("substr(f.ttl_name, -(length(?) + length(f.host) + 2)) = '_' || ? || '_' || f.host")
+            file_params.extend([user, user])
+        narrowed = bool(file_conditions)
+        if since:
+            file_conditions.append("f.started_at >= ?")
+            file_params.append(since)
+        if until:
+            file_conditions.append("f.started_at < ?")
+            file_params.append(until)
+        columns = "f.path, f.started_at, f.ttl_name, f.host, f.user"
+        results = []
+        if narrowed:
+            files = self.conn.execute(
+                f"SELECT f.id, {columns} FROM files f WHERE {' AND '.join(file_conditions)} ORDER BY f.started_at DESC",
+                file_params
+            ).fetchall()
+            for file_id, *file_row in files:
+                start = file_id << LINE_ID_BITS
+                rows = self.conn.execute(
+                    f"SELECT {key} & {(1 << LINE_ID_BITS) - 1}, l.text FROM lines l"
+                    f" WHERE {key} >= ? AND {key} < ? AND {' AND '.join(text_conditions)} ORDER BY {key} LIMIT ?",
+                    [start, start + (1 << LINE_ID_BITS), *text_params, limit - len(results)]
+                ).fetchall()
+                results.extend((*file_row, line_no, text) for line_no, text in rows)
+                if len(results) >= limit:
+                    break
+        else:
+            results = self.conn.execute(
+                f"SELECT {columns}, {key} & {(1 << LINE_ID_BITS) - 1}, l.text"
+                f" FROM lines l JOIN files f ON f.id = ({key} >> {LINE_ID_BITS})"
+                f" WHERE {' AND '.join(text_conditions + file_conditions)}"
+                f" ORDER BY f.started_at DESC, {key} LIMIT ?",
+                [*text_params, *file_params, limit]
+            ).fetchall()
+        return [
+            {"path": self.logs_dir / path, "line": line_no, "text": text, "started_at": started_at,
+             "ttl_name": name, "host": host_, "user": user_}
+            for path, started_at, name, host_, user_, line_no, text in results
+        ]
+
+    def _text_conditions(self, terms: List[str]) -> Tuple[List[str], List[str]]:
+        """本文の検索条件（3文字以上の語は MATCH、それ以外は LIKE）"""
+        conditions, params = [], []
+        long_terms = [term for term in terms if len(term) >= 3] if self.fts else []
+        if long_terms:
+            conditions.append("lines MATCH ?")
+            params.append(" AND ".join('"' + term.replace('"', '""') + '"' for term in long_terms))
+        for term in terms:
+            if term not in long_terms:
+                escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                conditions.append("l.text LIKE ? ESCAPE '\\'")
+                params.append(f"%{escaped}%")
+        return conditions, params
+
+    def latest_log(self, ttl_name: str) -> Optional[Path]:
+        """マクロ（ttl_name）の最新のログのパス（索引のファイル一覧から探す。本文の登録は不要）"""
+        row = self.conn.execute(
+            "SELECT path FROM files WHERE ttl_name = ? ORDER BY started_at DESC LIMIT 1", (ttl_name,)
+        ).fetchone()
+        return self.logs_dir / row[0] if row else None
+
+    def counts(self) -> Tuple[int, int]:
+        """索引済みのログの件数と合計サイズ"""
+        files, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files").fetchone()
+        return files, size
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="logs/ のセッションログを索引付けして検索します（索引は .cache/log_index.sqlite3）。"
+    )
+    parser.add_argument("query", nargs="*", help="検索する語（空白区切りはすべてを含む行）。省略すると索引の更新のみ")
+    parser.add_argument("--host", help="接続ホストで絞り込む（完全一致）")
+    parser.add_argument("--user", help="接続ユーザーで絞り込む（完全一致）")
+    parser.add_argument("--macro", metavar="TTL_NAME", help="マクロ名_ユーザー_ホスト で絞り込む（完全一致）")
+    parser.add_argument("--since", help="この日時以降に接続したログ（例: 2025-01-01）")
+    parser.add_argument("--until", help="この日時より前に接続したログ（例: 2025-02-01）")
+    parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help=f"表示する件数（既定: {DEFAULT_SEARCH_LIMIT}）")
+    parser.add_argument("--latest", metavar="TTL_NAME", help="マクロ名_ユーザー_ホスト の最新のログのパスを表示する")
+    parser.add_argument("--rebuild", action="store_true", help="索引を作り直す")
+    parser.add_argument("--no-update", action="store_true", help="索引を更新せずに検索する")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    with LogIndex() as index:
+        if args.rebuild:
+            index.rebuild()
+        if args.latest:
+            index.sync_files()
+            path = index.latest_log(args.latest)
+            if path is None:
+                print(f"ログが見つかりません: {args.latest}", file=sys.stderr)
+                return 1
+            print(path)
+            return 0
+        if not args.no_update:
+            started = time.perf_counter()
+            stats = index.update()
+            files, size = index.counts()
+            print(
+                f"索引を更新しました: 読み込み {stats['files']} 件（{stats['lines']} 行）, 追加 {stats['added']} 件, "
+                f"削除 {stats['removed']} 件, 圧縮 {stats['compressed']} 件 / 全 {files} 件 {size / 1024 / 1024:.1f} MiB"
+                f"（{time.perf_counter() - started:.2f}秒）",
+                file=sys.stderr
+            )
+        if not args.query:
+            return 0
+        started = time.perf_counter()
+        results = index.search(" ".join(args.query), host=args.host, user=args.user, ttl_name=args.macro,
+                               since=args.since, until=args.until, limit=args.limit)
+        for result in results:
+            print(f"{result['path']}:{result['line']}: {result['text']}")
+        print(f"{len(results)} 件（{(time.perf_counter() - started) * 1000:.1f} ms）", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
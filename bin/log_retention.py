@@ -0,0 +1,294 @@
+"""セッションログの圧縮と保持期間の管理（logs/ 以下）
+
+セッションログをマクロのグループ（macros/ からの相対フォルダ。例: LocA/prod）ごとに処理する。
+テンプレートはログを logs/ 直下に書き出すため、ファイル名の ttl_name（マクロ名_ユーザー_ホスト）から
+マニフェスト（macros/.manifest）に記録されたマクロを探してグループを求める（見つからないログは "" とする）。
+logs/ のサブフォルダに置かれたログは、そのフォルダをグループとする。
+  1. 保持期間（max_age_days）を過ぎたセッションログを削除する
+  2. compress_after_days より古いセッションログを gzip 圧縮する（.log → .log.gz。更新日時は元のまま）
+  3. グループのログの合計サイズが上限（max_group_mb）を超えていれば、古いものから削除する
+圧縮は一定サイズずつ読み書きするため、ログが大きくてもメモリ使用量は増えない。
+圧縮したログも log_index.py の索引で検索できる（索引済みのログは読み直さない）。
+対象はテンプレートが書き出すセッションログ（マクロ名_ユーザー_ホスト_日時.log）だけで、generate.log などには触れない。
+
+設定は bin/log_retention.json（なければ既定値）。groups にはグループごとの設定を書け、
+配下のグループにも適用される（例: "LocA" は LocA/prod/web にも適用され、"LocA/prod" の設定があればそちらで上書きする）。
+  {
+      "compress_after_days": 7,
+      "max_age_days": 365,
+      "max_group_mb": 2048,
+      "groups": {"LocA/prod": {"max_age_days": 730}}
+  }
+
+使い方:
+  python bin/log_retention.py --dry-run                 # 実行内容の確認のみ
+  python bin/log_retention.py
+  python bin/log_retention.py --compress-after 3 --max-age 180 --max-group-mb 1024
+"""
+from __future__ import annotations
+
+import sys
+import argparse
+import gzip
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+BIN_DIR = Path(__file__).resolve().parent
+BASE_DIR = BIN_DIR.parent
+LOGS_DIR = BASE_DIR / "logs"
+MANIFEST_PATH = BASE_DIR / "macros" / ".manifest"
+POLICY_FILE = BIN_DIR / "log_retention.json"
+
+sys.path.insert(0, str(BIN_DIR))
+from log_index import LOG_NAME_PATTERN
+
+# 既定の設定（0 はその処理を行わない）
+DEFAULT_POLICY = {
+    "compress_after_days": 7,  # これより古いセッションログを gzip 圧縮する
+    "max_age_days": 0,         # これより古いセッションログを削除する
+    "max_group_mb": 0,         # グループごとのセッションログの合計サイズの上限（MB）
+    "groups": {},              # グループ（macros/ からの相対フォルダ）ごとの設定
+}
+POLICY_KEYS = ("compress_after_days", "max_age_days", "max_group_mb")
+COPY_CHUNK_BYTES = 1 << 20  # 圧縮時に1回に読み込む量
+COMPRESS_LEVEL = 6
+DAY_SECONDS = 24 * 60 * 60
+
+
+def load_policy(path: Path = POLICY_FILE) -> Dict:
+    """設定ファイルを読み込み、既定値を補った設定を返す（ファイルがなければ既定値）"""
+    policy = {key: value for key, value in DEFAULT_POLICY.items() if key != "groups"}
+    policy["groups"] = {}
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            loaded = json.load(f)
+        for key in POLICY_KEYS:
+            if key in loaded:
+                policy[key] = loaded[key]
+        for group, rules in loaded.get("groups", {}).items():
+            unknown = set(rules) - set(POLICY_KEYS)
+            if unknown:
+                raise ValueError(f"{path.name} のグループ '{group}' に不明な設定があります: {', '.join(sorted(unknown))}")
+            policy["groups"][group.strip("/\\").replace("\\", "/")] = rules
+    return policy
+
+
+def rules_for(policy: Dict, rel_dir: str) -> Dict[str, float]:
+    """グループに適用する設定（既定値を、一致する groups の設定で上位のグループから順に上書きする）"""
+    rules = {key: policy[key] for key in POLICY_KEYS}
+    matched = [group for group in policy["groups"]
+               if group == "" or rel_dir == group or rel_dir.startswith(group + "/")]
+    for group in sorted(matched, key=len):
+        rules.update(policy["groups"][group])
+    return rules
+
+
+def iter_log_dirs(logs_dir: Path) -> Iterator[Tuple[str, List[Tuple[str, int, int]]]]:
+    """logs/ 以下のフォルダごとに (相対フォルダ, [(ファイル名, サイズ, 更新日時)]) を返す（セッションログのみ）"""
+    stack = [logs_dir]
+    while stack:
+        directory = stack.pop()
+        files = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+                    elif LOG_NAME_PATTERN.match(entry.name):
+                        st = entry.stat()
+                        files.append((entry.name, st.st_size, st.st_mtime_ns))
+        except OSError as e:
+            print(f"[フォルダの読み込み失敗] {directory}: {e}", file=sys.stderr)
+            continue
+        rel_dir = directory.relative_to(logs_dir).as_posix()
+        yield ("" if rel_dir == "." else rel_dir), files
+
+
+def load_macro_groups(manifest_path: Path = MANIFEST_PATH) -> Dict[str, str]:
+    """マニフェストのマクロから、ログの ttl_name（マクロ名_ユーザー_ホスト）→ グループ の対応を作る（なければ空）
+
+    マクロのファイル名は「マクロ名_ホスト_ユーザー.ttl」で、マクロ名とユーザーは '_' を含みうるため、
+    ホスト（'_' を含まない）の位置の候補ごとにログの ttl_name を登録する。
+    同じマクロ名・ホスト・ユーザーのマクロが複数のグループにある場合、ログはファイル名で区別できないため先のグループとする。
+    """
+    try:
+        entries = json.loads(manifest_path.read_text(encoding="utf-8"))["entries"]
+        keys = list(entries)
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+    groups: Dict[str, str] = {}
+    for key in sorted(keys):
+        group, _, file_name = key.rpartition("/")
+        parts = file_name[:-len(".ttl")].split("_")
+        for pos in range(1, len(parts) - 1):
+            groups.setdefault("_".join(parts[:pos] + parts[pos + 1:] + [parts[pos]]), group)
+    return groups
+
+
+def iter_log_groups(logs_dir: Path, macro_groups: Dict[str, str]) -> Iterator[Tuple[str, List[Tuple[str, int, int]]]]:
+    """グループごとに (グループ, [(logs/ からの相対パス, サイズ, 更新日時)]) を返す（セッションログのみ）"""
+    groups: Dict[str, List[Tuple[str, int, int]]] = {}
+    for rel_dir, files in iter_log_dirs(logs_dir):
+        for name, size, mtime_ns in files:
+            if rel_dir:
+                group, rel_path = rel_dir, f"{rel_dir}/{name}"
+            else:
+                group, rel_path = macro_groups.get(LOG_NAME_PATTERN.match(name).group("ttl_name"), ""), name
+            groups.setdefault(group, []).append((rel_path, size, mtime_ns))
+    yield from groups.items()
+
+
+def compress_log(path: Path) -> Optional[int]:
+    """ログを gzip 圧縮して .log.gz に置き換え、圧縮後のサイズを返す（圧縮中に書き込まれた場合は None）
+
+    元のログを削除できなかった場合（Tera Term が開いたままなど）は .log.gz を消して OSError を送出する
+    （同じ内容が .log と .log.gz の両方に残り、次回に圧縮し直したりサイズを二重に数えたりしないようにする）。
+    """
+    st = path.stat()
+    gz_path = path.with_name(path.name + ".gz")
+    tmp_path = path.with_name(path.name + ".gz.tmp")
+    try:
+        with open(path, "rb") as src, open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(filename=path.name, mode="wb", compresslevel=COMPRESS_LEVEL,
+                               fileobj=raw, mtime=int(st.st_mtime)) as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK_BYTES)
+        after = path.stat()
+        if (after.st_size, after.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+            # 接続中のセッションが書き込んでいる: 今回は圧縮しない
+            tmp_path.unlink()
+            return None
+        os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp_path, gz_path)
+        try:
+            path.unlink()
+        except OSError:
+            gz_path.unlink()
+            raise
+        return gz_path.stat().st_size
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def apply_retention(policy: Dict, logs_dir: Path = LOGS_DIR, dry_run: bool = False,
+                    log: Callable[[str], None] = print, manifest_path: Path = MANIFEST_PATH) -> Dict[str, int]:
+    """保持期間・圧縮・サイズ上限を適用し、件数とバイト数を返す（dry_run=True の場合は何も変更しない）
+
+    ログのグループは manifest_path のマニフェストに記録されたマクロから求める。
+    """
+    stats = {"compressed": 0, "compressed_before": 0, "compressed_after": 0,
+             "expired": 0, "over_budget": 0, "deleted_bytes": 0, "errors": 0}
+    if not logs_dir.is_dir():
+        return stats
+    now = time.time()
+    for group, files in iter_log_groups(logs_dir, load_macro_groups(manifest_path)):
+        rules = rules_for(policy, group)
+        kept = []
+        # 1. 保持期間を過ぎたログを削除
+        for name, size, mtime_ns in files:
+            age_days = (now - mtime_ns / 1e9) / DAY_SECONDS
+            if rules["max_age_days"] and age_days > rules["max_age_days"]:
+                log(f"🗑️ 保持期間切れ: {name}（{age_days:.0f}日前）")
+                if not dry_run and not _delete(logs_dir / name, stats):
+                    kept.append((name, size, mtime_ns))
+                    continue
+                stats["expired"] += 1
+                stats["deleted_bytes"] += size
+                continue
+            kept.append((name, size, mtime_ns))
+        # 2. 古いログを圧縮
+        files, kept = kept, []
+        for name, size, mtime_ns in files:
+            age_days = (now - mtime_ns / 1e9) / DAY_SECONDS
+            if name.endswith(".log") and rules["compress_after_days"] and age_days > rules["compress_after_days"]:
+                compressed_size = size
+                if not dry_run:
+                    try:
+                        compressed_size = compress_log(logs_dir / name)
+                    except OSError as e:
+                        log(f"⚠️ 圧縮に失敗しました: {name} - {e}")
+                        stats["errors"] += 1
+                        compressed_size = None
+                    if compressed_size is None:
+                        kept.append((name, size, mtime_ns))
+                        continue
+                    name += ".gz"
+                stats["compressed"] += 1
+                stats["compressed_before"] += size
+                stats["compressed_after"] += compressed_size
+                size = compressed_size
+            kept.append((name, size, mtime_ns))
+        # 3. 合計サイズの上限を超えた分を古い順に削除
+        budget = rules["max_group_mb"] * 1024 * 1024
+        total = sum(size for _, size, _ in kept)
+        if budget and total > budget:
+            for name, size, mtime_ns in sorted(kept, key=lambda item: item[2]):
+                if total <= budget:
+                    break
+                log(f"🗑️ サイズ上限超過: {name}（グループ {group or '(なし)'} の合計 {total / 1024 / 1024:.1f} MB）")
+                if not dry_run and not _delete(logs_dir / name, stats):
+                    continue
+                total -= size
+                stats["over_budget"] += 1
+                stats["deleted_bytes"] += size
+    return stats
+
+
+def _delete(path: Path, stats: Dict[str, int]) -> bool:
+    try:
+        path.unlink()
+        return True
+    except FileNotFoundError:
+        return True
+    except OSError as e:
+        print(f"[ログの削除失敗] {path}: {e}", file=sys.stderr)
+        stats["errors"] += 1
+        return False
+
+
+def format_stats(stats: Dict[str, int]) -> str:
+    mib = 1024 * 1024
+    return (
+        f"圧縮 {stats['compressed']} 件（{stats['compressed_before'] / mib:.1f} MB → "
+        f"{stats['compressed_after'] / mib:.1f} MB）, 保持期間切れ {stats['expired']} 件, "
+        f"サイズ上限超過 {stats['over_budget']} 件（削除 {stats['deleted_bytes'] / mib:.1f} MB）, "
+        f"エラー {stats['errors']} 件"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="logs/ 以下のセッションログを圧縮し、保持期間・グループごとのサイズ上限を超えたものを削除します。"
+    )
+    parser.add_argument("--policy", type=Path, default=POLICY_FILE, help=f"設定ファイル（既定: {POLICY_FILE.name}）")
+    parser.add_argument("--compress-after", type=float, metavar="DAYS", help="この日数より古いログを圧縮する（0 で圧縮しない）")
+    parser.add_argument("--max-age", type=float, metavar="DAYS", help="この日数より古いログを削除する（0 で削除しない）")
+    parser.add_argument("--max-group-mb", type=float, metavar="MB", help="グループごとの合計サイズの上限（0 で無制限）")
+    parser.add_argument("--dry-run", action="store_true", help="実行内容を表示するだけで、ファイルは変更しない")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    try:
+        policy = load_policy(args.policy)
+    except (OSError, ValueError) as e:
+        print(f"設定ファイルを読み込めませんでした: {args.policy} - {e}", file=sys.stderr)
+        return 1
+    for key, value in (("compress_after_days", args.compress_after), ("max_age_days", args.max_age),
+                       ("max_group_mb", args.max_group_mb)):
+        if value is not None:
+            policy[key] = value
+    started = time.perf_counter()
+    stats = apply_retention(policy, dry_run=args.dry_run)
+    prefix = "（確認のみ）" if args.dry_run else ""
+    print(f"📊 {prefix}{format_stats(stats)}（{time.perf_counter() - started:.2f}秒）", file=sys.stderr)
+    return 1 if stats["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
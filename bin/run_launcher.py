@@ -1,22 +1,77 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from pathlib import Path
+from collections import deque
+from bisect import bisect_left
 import subprocess
+import threading
 import shutil
+import queue
 import json
+import os
+import re
+import time
+import tarfile
+import zipfile
+import gzip
+
+from log_index import LogIndex
+from log_retention import apply_retention, format_stats, load_policy
 
 # --- 設定ファイルとエディタの定義 ---
 CONFIG_FILE = Path(__file__).resolve().parent / "launcher_config.json"
 BASE_DIR = Path(__file__).resolve().parent.parent
 PREFERRED_EDITOR = shutil.which("notepad")
 
-# --- GUI初期化 ---
-root = tk.Tk()
-root.title("Tera Term マクロランチャー")
+# --- マクロフォルダ走査の設定 ---
+COMMON_LIBRARY_NAME = "ttmacro_common.ttl"  # --include-common で生成する共通ライブラリ
+EXCLUDED_TTL_NAMES = {"template.ttl", COMMON_LIBRARY_NAME}  # ツリーに表示しないTTL
+SCAN_POLL_MS = 50       # 走査結果をUIに反映する間隔（ミリ秒）
+SCAN_BATCH_SIZE = 200   # 1回の反映で処理するフォルダ数の上限
+UNGROUPED_NODE = "ungrouped"
+
+# --- マクロ索引（起動時にツリーを即座に表示するためのキャッシュ） ---
+INDEX_FILE = Path(__file__).resolve().parent / "macro_index.json"
+INDEX_VERSION = 1
+HEADER_LINES = 8  # ヘッダーを探す先頭行数
+HEADER_PATTERN = re.compile(r"^;\s*(接続ユーザー|接続ホスト|メモ)\s*:\s?(.*)$")
+HEADER_KEYS = {"接続ユーザー": "user", "接続ホスト": "host", "メモ": "memo"}
+
+# --- バンドル（generate_ttl_macros.py --bundle で作成したアーカイブ） ---
+BUNDLE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+BUNDLE_INDEX_NAME = "index.json"
+# 起動するTTLの展開先。macros/ と同じ深さに置き、TTL内の {rel_path} がプロジェクトルート（keys/・logs/）を指すようにする
+BUNDLE_EXTRACT_DIR = BASE_DIR / ".bundle"
+
+# --- 疎通確認の結果（generate_ttl_macros.py --probe が保存する） ---
+PROBE_REPORT_FILE = BASE_DIR / "logs" / "probe_report.json"
+PROBE_LABELS = {"open": "✅ 接続可", "refused": "❌ 接続拒否", "timeout": "⏱ タイムアウト", "error": "⚠ エラー"}
+
+# --- セッションログ（log_index.py の索引で検索する） ---
+LOG_VIEW_DIR = BASE_DIR / ".cache" / "log_view"  # 圧縮されたログを開くときの展開先
+LOG_SEARCH_LIMIT = 500  # ログ検索で表示する行数の上限
+# ログの圧縮・保持期間の管理（log_retention.py）をバックグラウンドで実行する間隔（分、0 で実行しない）
+DEFAULT_LOG_RETENTION_INTERVAL_MIN = 0
+LOG_RETENTION_FIRST_DELAY_MS = 30000  # 起動直後のフォルダ走査と重ならないよう、初回は少し待つ
+
+# --- マクロの再生成 ---
+REGENERATE_POLL_MS = 100  # 再生成の進捗を表示する間隔（ミリ秒）
+REGENERATE_MAX_ERRORS = 10  # 再生成のエラーを一覧表示する件数の上限
 
-# --- 設定値の初期化 ---
-MACROS_DIR = tk.StringVar(master=root, value="")
-TTERM_PATH = tk.StringVar(master=root, value="")
+# --- 検索の設定 ---
+SEARCH_DELAY_MS = 150       # 入力が止まってから検索するまでの待ち時間（ミリ秒）
+SEARCH_MAX_RESULTS = 2000   # ツリーに表示する検索結果の上限
+TOKEN_SPLIT_PATTERN = re.compile(r"[^0-9a-z\u3040-\u30ff\u4e00-\u9fff]+")
+
+# --- 一括接続の既定値（launcher_config.json で変更できる） ---
+DEFAULT_SESSION_CONFIG = {
+    "max_concurrent_starts": 4,   # 同時に起動処理中にできるセッション数
+    "start_interval_ms": 1500,    # セッションを起動する最小間隔（ミリ秒）
+    "start_window_sec": 10,       # 起動後、起動処理中とみなす時間（秒）
+}
+SESSION_POLL_MS = 200       # 起動待ちがあるときの監視間隔（ミリ秒）
+SESSION_IDLE_POLL_MS = 1000 # 実行中のセッションだけのときの監視間隔（ミリ秒）
+BULK_CONFIRM_COUNT = 2      # この件数以上をまとめて起動するときは確認する
 
 # --- 設定読み書き関数 ---
 def load_launcher_config():
@@ -29,10 +84,15 @@ def load_launcher_config():
     return {}
 
 def save_launcher_config(teraterm_path: str, macros_root: str):
-    data = {
+    # 画面で編集しない設定（一括接続の設定など）は既存の値を残す
+    data = load_launcher_config()
+    data.update({
         "teraterm_path": teraterm_path,
         "macros_root": macros_root
-    }
+    })
+    for key, value in DEFAULT_SESSION_CONFIG.items():
+        data.setdefault(key, value)
+    data.setdefault("log_retention_interval_min", DEFAULT_LOG_RETENTION_INTERVAL_MIN)
     try:
         with open(CONFIG_FILE, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=4)
@@ -43,15 +103,139 @@ def save_config():
     save_launcher_config(TTERM_PATH.get(), MACROS_DIR.get())
     messagebox.showinfo("保存完了", "設定を保存しました。")
 
+# --- セッション管理（起動数の制限・起動間隔・プロセスの監視） ---
+class SessionManager:
+    """Tera Term の起動をまとめて管理する
+
+    起動処理中（起動から start_window_sec 秒以内）のセッションが max_concurrent_starts 件に
+    達している間は次を起動せず、起動と起動の間は start_interval_ms 以上あける。
+    起動したプロセスは after() で定期的に poll() し、PID・状態・終了コードをパネルに表示する。
+    """
+
+    def __init__(self, panel, max_concurrent_starts, start_interval_ms, start_window_sec):
+        self.panel = panel
+        self.max_concurrent_starts = max(1, int(max_concurrent_starts))
+        self.start_interval = max(0, int(start_interval_ms)) / 1000
+        self.start_window = max(0, float(start_window_sec))
+        self.pending = deque()  # (パネルの行ID, TTLのパス, Tera Termのパス)
+        self.sessions = {}      # パネルの行ID → {"proc", "started"}
+        self.last_start = None
+        self.after_id = None
+
+    def launch(self, ttl_items, tterm_path):
+        """TTLを起動待ちに追加する（ttl_items: (表示名, TTLのパス) の一覧）"""
+        for label, ttl_path in ttl_items:
+            row = self.panel.insert("", "end", text=label, values=("", "起動待ち", ""))
+            self.pending.append((row, ttl_path, tterm_path))
+        self.schedule(0)
+
+    def schedule(self, delay_ms):
+        if self.after_id is not None:
+            root.after_cancel(self.after_id)
+        self.after_id = root.after(delay_ms, self.tick)
+
+    def set_row(self, row, pid="", status="", code=""):
+        if self.panel.exists(row):
+            self.panel.item(row, values=(pid, status, code))
+
+    def start(self, row, ttl_path, tterm_path):
+        try:
+            proc = subprocess.Popen([str(tterm_path), f'/M={str(ttl_path)}'])
+        except Exception as e:
+            print(f"[起動失敗] {ttl_path}: {e}")
+            self.set_row(row, status=f"起動失敗: {e}")
+            return
+        self.sessions[row] = {"proc": proc, "started": time.monotonic()}
+        self.set_row(row, pid=proc.pid, status="起動中")
+
+    def tick(self):
+        self.after_id = None
+        now = time.monotonic()
+        starting = 0
+        for row, session in list(self.sessions.items()):
+            proc = session["proc"]
+            code = proc.poll()
+            if code is not None:
+                del self.sessions[row]
+                self.set_row(row, pid=proc.pid, status="終了", code=code)
+            elif now - session["started"] < self.start_window:
+                starting += 1
+            else:
+                self.set_row(row, pid=proc.pid, status="実行中")
+
+        while self.pending and starting < self.max_concurrent_starts:
+            if self.last_start is not None and now - self.last_start < self.start_interval:
+                break
+            self.start(*self.pending.popleft())
+            self.last_start = now
+            starting += 1
+
+        SESSION_TEXT.set(f"セッション: 起動待ち {len(self.pending)} 件 / 実行中 {len(self.sessions)} 件")
+        if self.pending:
+            self.schedule(SESSION_POLL_MS)
+        elif self.sessions:
+            self.schedule(SESSION_IDLE_POLL_MS)
+
+    def clear_finished(self):
+        """終了・起動失敗したセッションの行を消す"""
+        waiting = {row for row, _, _ in self.pending}
+        for row in self.panel.get_children():
+            if row not in self.sessions and row not in waiting:
+                self.panel.delete(row)
+
 # --- TTLファイル起動・編集関係 ---
-def run_ttl(ttl_path, tterm_path):
+def check_tterm_path(tterm_path):
     if not tterm_path or not Path(tterm_path).exists():
         messagebox.showerror("エラー", f"Tera Term 実行ファイルが見つかりません:\n{tterm_path}")
+        return False
+    return True
+
+def run_ttl(ttl_path, tterm_path):
+    if not check_tterm_path(tterm_path):
+        return
+    label = tree.item(tree.selection()[0], "values")[0] if tree.selection() else ttl_path.name
+    session_manager.launch([(label, ttl_path.resolve())], tterm_path)
+
+def collect_macros(node):
+    """ノード以下のすべてのTTL（フォルダを選択した場合は配下を再帰的に集める）"""
+    values = tree.item(node, "values")
+    if values:
+        return [values[0]]
+    if node == UNGROUPED_NODE:
+        rel_dirs = [""]
+    else:
+        prefix = node + "/"
+        rel_dirs = sorted(d for d in macro_dirs if d == node or d.startswith(prefix))
+    return [str(Path(rel_dir) / name) for rel_dir in rel_dirs for name in macro_dirs[rel_dir][1]]
+
+def launch_selected():
+    """選択したTTL・フォルダ配下のTTLをまとめて起動する"""
+    tterm_path = TTERM_PATH.get()
+    if not check_tterm_path(tterm_path):
+        return
+    labels = []
+    for node in tree.selection():
+        labels.extend(label for label in collect_macros(node) if label not in labels)
+    if not labels:
+        messagebox.showinfo("一括接続", "接続するTTLまたはフォルダを選択してください。")
+        return
+    if len(labels) >= BULK_CONFIRM_COUNT and not messagebox.askyesno(
+            "一括接続", f"{len(labels)} 件のセッションを起動します。よろしいですか？"):
         return
     try:
-        subprocess.Popen([str(tterm_path), f'/M={str(ttl_path.resolve())}'])
+        ttl_paths = resolve_macro_paths(labels)
     except Exception as e:
-        messagebox.showerror("起動失敗", str(e))
+        print(f"[パス取得エラー] {e}")
+        messagebox.showerror("エラー", f"TTLを開けませんでした:\n{e}")
+        return
+    session_manager.launch(list(zip(labels, ttl_paths)), tterm_path)
+
+def resolve_macro_paths(labels):
+    """ツリーの相対パスから起動するTTLのパスを求める（バンドルの場合は展開先のパス）"""
+    macro_root = Path(MACROS_DIR.get())
+    if is_bundle(macro_root):
+        return extract_bundle_macros(macro_root, labels)
+    return [(macro_root / label).resolve() for label in labels]
 
 def get_selected_ttl_path():
     selected = tree.selection()
@@ -63,11 +247,10 @@ def get_selected_ttl_path():
         return None
 
     try:
-        relative_path = Path(values[0])
-        ttl_path = Path(MACROS_DIR.get()) / relative_path
-        return ttl_path.resolve()
+        return resolve_macro_paths([values[0]])[0]
     except Exception as e:
         print(f"[パス取得エラー] {e}")
+        messagebox.showerror("エラー", f"TTLを開けませんでした:\n{e}")
         return None
 
 def on_double_click(event=None):
@@ -94,95 +277,971 @@ def edit_selected_ttl():
         except Exception as e:
             messagebox.showerror("エディタ起動に失敗しました:\n{e}")
 
-# --- ツリー構築 ---
-def build_tree(tree):
+# --- セッションログ（検索・最新ログを開く） ---
+def run_in_background(func, on_done):
+    """func をワーカースレッドで実行し、結果を on_done(結果, 例外) としてUIスレッドで受け取る"""
+    out_queue = queue.Queue()
+
+    def worker():
+        try:
+            out_queue.put((func(), None))
+        except Exception as e:
+            out_queue.put((None, e))
+
+    def poll():
+        try:
+            result, error = out_queue.get_nowait()
+        except queue.Empty:
+            root.after(SCAN_POLL_MS, poll)
+            return
+        on_done(result, error)
+
+    threading.Thread(target=worker, daemon=True).start()
+    root.after(SCAN_POLL_MS, poll)
+
+def open_log_file(log_path: Path):
+    """ログをエディタで開く（圧縮されたログは .cache/log_view/ に展開してから開く）"""
+    if log_path.name.endswith(".gz"):
+        LOG_VIEW_DIR.mkdir(parents=True, exist_ok=True)
+        target = LOG_VIEW_DIR / log_path.name[:-3]
+        with gzip.open(log_path, "rb") as src, open(target, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        log_path = target
+    subprocess.Popen([PREFERRED_EDITOR or "notepad", str(log_path)])
+
+def selected_macro_meta():
+    """選択したTTLの (TTL名, ヘッダーの情報)。TTL以外を選択している場合は None"""
+    selected = tree.selection()
+    if not selected or not tree.item(selected[0], "values"):
+        return None
+    rel_dir, _, name = selected[0].rpartition("/")
+    contents = macro_dirs.get(node_dir(rel_dir))
+    return name, (contents[1].get(name, {}) if contents else {})
+
+def log_ttl_name(name, meta):
+    """TTLファイル名（マクロ名_ホスト_ユーザー.ttl）から、ログのファイル名に使われる ttl_name を求める
+
+    テンプレートはログのファイル名を「マクロ名_ユーザー_ホスト」とするため、ヘッダーのホスト・ユーザーで並べ替える。
+    """
+    stem = Path(name).stem
+    host, user = meta.get("host", ""), meta.get("user", "")
+    suffix = f"_{host}_{user}"
+    if host and user and stem.endswith(suffix):
+        return f"{stem[:-len(suffix)]}_{user}_{host}"
+    return stem
+
+def open_latest_log():
+    """選択したTTLの最新のセッションログを開く（索引のファイル一覧だけを更新して探す）"""
+    selected = selected_macro_meta()
+    if selected is None:
+        messagebox.showinfo("最新のログ", "ログを開くTTLを選択してください。")
+        return
+    ttl_name = log_ttl_name(*selected)
+
+    def find():
+        with LogIndex() as index:
+            index.sync_files()
+            return index.latest_log(ttl_name)
+
+    def on_found(log_path, error):
+        if error is not None:
+            messagebox.showerror("エラー", f"ログの索引を読めませんでした:\n{error}")
+        elif log_path is None:
+            messagebox.showinfo("最新のログ", f"{ttl_name} のログが見つかりません。")
+        else:
+            try:
+                open_log_file(log_path)
+            except Exception as e:
+                messagebox.showerror("エラー", f"ログを開けませんでした:\n{e}")
+
+    run_in_background(find, on_found)
+
+def open_log_search():
+    """セッションログの検索ウィンドウを開く（索引の更新と検索はワーカースレッドで行う）"""
+    window = tk.Toplevel(root)
+    window.title("セッションログの検索")
+    query_text = tk.StringVar(master=window, value="")
+    host_text = tk.StringVar(master=window, value="")
+    status_text = tk.StringVar(master=window, value="")
+    selected = selected_macro_meta()
+    if selected is not None:
+        host_text.set(selected[1].get("host", ""))
+
+    frame_query = tk.Frame(window)
+    frame_query.pack(fill=tk.X, padx=10, pady=5)
+    tk.Label(frame_query, text="検索語:").pack(side=tk.LEFT)
+    query_entry = tk.Entry(frame_query, textvariable=query_text, width=40)
+    query_entry.pack(side=tk.LEFT, padx=5)
+    tk.Label(frame_query, text="ホスト:").pack(side=tk.LEFT)
+    tk.Entry(frame_query, textvariable=host_text, width=20).pack(side=tk.LEFT, padx=5)
+
+    results = ttk.Treeview(window, columns=("started", "macro", "line", "text"), show="headings", height=20)
+    for column, heading, width in (("started", "接続日時", 150), ("macro", "マクロ", 260),
+                                   ("line", "行", 60), ("text", "内容", 600)):
+        results.heading(column, text=heading)
+        results.column(column, anchor="e" if column == "line" else "w", width=width)
+    results.pack(fill=tk.BOTH, expand=True, padx=10)
+    tk.Label(window, textvariable=status_text, anchor="w", relief=tk.SUNKEN, bd=1).pack(side=tk.BOTTOM, fill=tk.X)
+    found_paths = {}  # 結果の行 → ログのパス
+    state = {"busy": False}
+
+    def update_index():
+        with LogIndex() as index:
+            stats = index.update()
+            return stats, index.counts()
+
+    def on_updated(result, error):
+        state["busy"] = False
+        if error is not None:
+            status_text.set(f"索引の更新に失敗しました: {error}")
+            return
+        stats, (files, size) = result
+        status_text.set(f"索引を更新しました（ログ {files} 件 {size / 1024 / 1024:.1f} MiB、今回読み込み {stats['files']} 件）")
+
+    def refresh_index():
+        if state["busy"]:
+            return
+        state["busy"] = True
+        status_text.set("ログの索引を更新中…（初回は時間がかかります）")
+        run_in_background(update_index, on_updated)
+
+    def search():
+        query = query_text.get().strip()
+        if state["busy"] or not query:
+            return
+        state["busy"] = True
+        host = host_text.get().strip() or None
+
+        def run():
+            with LogIndex() as index:
+                started = time.perf_counter()
+                return index.search(query, host=host, limit=LOG_SEARCH_LIMIT), time.perf_counter() - started
+
+        def on_results(result, error):
+            state["busy"] = False
+            results.delete(*results.get_children())
+            found_paths.clear()
+            if error is not None:
+                status_text.set(f"検索に失敗しました: {error}")
+                return
+            rows, elapsed = result
+            for row in rows:
+                item = results.insert("", "end", values=(
+                    row["started_at"].replace("T", " "), row["ttl_name"], row["line"], row["text"]))
+                found_paths[item] = row["path"]
+            limited = "（上限に達しました）" if len(rows) >= LOG_SEARCH_LIMIT else ""
+            status_text.set(f"{len(rows)} 件{limited}（{elapsed * 1000:.1f} ms）")
+
+        status_text.set("検索中…")
+        run_in_background(run, on_results)
+
+    def open_result(event=None):
+        selection = results.selection()
+        if selection and selection[0] in found_paths:
+            try:
+                open_log_file(found_paths[selection[0]])
+            except Exception as e:
+                messagebox.showerror("エラー", f"ログを開けませんでした:\n{e}")
+
+    tk.Button(frame_query, text="検索", command=search).pack(side=tk.LEFT, padx=5)
+    tk.Button(frame_query, text="索引を更新", command=refresh_index).pack(side=tk.LEFT)
+    query_entry.bind("<Return>", lambda e: search())
+    results.bind("<Double-1>", open_result)
+    refresh_index()
+
+def schedule_log_retention(interval_min):
+    """ログの圧縮・保持期間の管理（bin/log_retention.json の設定）を interval_min 分ごとにワーカースレッドで実行する"""
+    if interval_min <= 0:
+        return
+
+    def run():
+        return apply_retention(load_policy(), log=lambda message: None)
+
+    def on_done(stats, error):
+        if error is not None:
+            print(f"[ログの整理失敗] {error}")
+        elif stats["compressed"] or stats["expired"] or stats["over_budget"] or stats["errors"]:
+            print(f"[ログの整理] {format_stats(stats)}")
+        root.after(int(interval_min * 60 * 1000), run_in_background, run, on_done)
+
+    root.after(LOG_RETENTION_FIRST_DELAY_MS, run_in_background, run, on_done)
+
+# --- マクロ索引（前回の走査結果のキャッシュ） ---
+def read_macro_header(ttl_path: Path):
+    """生成されたTTLのヘッダー（接続ユーザー・接続ホスト・メモ）を読む"""
+    meta = {}
+    try:
+        with open(ttl_path, "r", encoding="utf-8", errors="replace") as f:
+            for _, line in zip(range(HEADER_LINES), f):
+                m = HEADER_PATTERN.match(line.rstrip("\r\n"))
+                if m:
+                    meta[HEADER_KEYS[m.group(1)]] = m.group(2).strip()
+    except OSError:
+        pass
+    return meta
+
+def load_macro_index(macro_root: Path):
+    """マクロ索引を読み込む（マクロルートが異なる・壊れている場合は空）"""
+    if not INDEX_FILE.exists():
+        return {}
+    try:
+        with open(INDEX_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"[索引読み込み失敗] {e}")
+        return {}
+    if data.get("version") != INDEX_VERSION or data.get("macros_root") != str(macro_root):
+        return {}
+    return data.get("dirs", {})
+
+def save_macro_index(macro_root: Path, dirs):
+    """マクロ索引を保存する（走査スレッドから呼ばれる）"""
+    data = {"version": INDEX_VERSION, "macros_root": str(macro_root), "dirs": dirs}
+    tmp_file = INDEX_FILE.with_name(INDEX_FILE.name + ".tmp")
+    try:
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_file, INDEX_FILE)
+    except Exception as e:
+        print(f"[索引保存失敗] {e}")
+
+# --- バンドル（アーカイブ）からの読み込み ---
+def is_bundle(path: Path):
+    return path.is_file() and path.name.lower().endswith(BUNDLE_SUFFIXES)
+
+def open_bundle(bundle_path: Path):
+    if bundle_path.name.lower().endswith(".zip"):
+        return zipfile.ZipFile(bundle_path)
+    return tarfile.open(bundle_path)
+
+def read_bundle_member(archive, member):
+    if isinstance(archive, zipfile.ZipFile):
+        return archive.read(member)
+    f = archive.extractfile(member)
+    if f is None:
+        raise KeyError(f"ファイルではありません: {member}")
+    return f.read()
+
+def bundle_member_names(archive):
+    if isinstance(archive, zipfile.ZipFile):
+        return archive.namelist()
+    return [member.name for member in archive.getmembers() if member.isfile()]
+
+def read_bundle_dirs(bundle_path: Path):
+    """バンドルの索引（index.json）から、走査結果と同じ形のフォルダ一覧を作る
+
+    索引にある接続ホスト・ユーザー・メモを使うため、TTLを1件ずつ読まずに表示・検索できる。
+    索引がないアーカイブはメンバー名だけから作る。
+    """
+    with open_bundle(bundle_path) as archive:
+        try:
+            entries = json.loads(read_bundle_member(archive, BUNDLE_INDEX_NAME))["entries"]
+        except KeyError:
+            entries = {name: {} for name in bundle_member_names(archive) if name.lower().endswith(".ttl")}
+    dirs = {"": {"mtime": None, "subdirs": [], "files": {}}}
+    for member in sorted(entries):
+        rel_dir, _, name = member.rpartition("/")
+        if name in EXCLUDED_TTL_NAMES:
+            continue
+        parent = ""
+        for part in rel_dir.split("/") if rel_dir else []:
+            child = f"{parent}/{part}" if parent else part
+            if child not in dirs:
+                dirs[child] = {"mtime": None, "subdirs": [], "files": {}}
+                dirs[parent]["subdirs"].append(part)
+            parent = child
+        meta = entries[member]
+        dirs[rel_dir]["files"][name] = {key: meta[key] for key in ("host", "user", "memo") if key in meta}
+    for entry in dirs.values():
+        entry["subdirs"].sort()
+        entry["files"] = {name: entry["files"][name] for name in sorted(entry["files"])}
+    return dirs
+
+def scan_bundle(bundle_path: Path, out_queue: queue.Queue, cancel: threading.Event):
+    """バンドルの索引を読み、フォルダの走査と同じメッセージをキューに送る（ワーカースレッド）"""
+    try:
+        dirs = read_bundle_dirs(bundle_path)
+    except Exception as e:
+        out_queue.put(("error", "", str(e)))
+        out_queue.put(("done",))
+        return
+    if cancel.is_set():
+        return
+    out_queue.put(("index", MacroSearchIndex(dirs)))
+    pending = deque([""])
+    while pending:
+        rel_dir = pending.popleft()
+        entry = dirs[rel_dir]
+        out_queue.put(("dir", rel_dir, entry["subdirs"], entry["files"], True))
+        pending.extend(f"{rel_dir}/{name}" if rel_dir else name for name in entry["subdirs"])
+    out_queue.put(("done",))
+
+def extract_bundle_macros(bundle_path: Path, labels):
+    """起動するTTLだけをバンドルから展開し、展開先のパスを返す（起動のたびに展開し直す）"""
+    paths = []
+    with open_bundle(bundle_path) as archive:
+        for label in labels:
+            member = Path(label).as_posix()
+            parts = member.split("/")
+            if Path(member).is_absolute() or ".." in parts:
+                raise ValueError(f"不正なパスです: {member}")
+            target = BUNDLE_EXTRACT_DIR.joinpath(*parts)
+            data = read_bundle_member(archive, member)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(data)
+            paths.append(target.resolve())
+        # --include-common で作成したバンドルは、マクロから include される共通ライブラリも展開する
+        try:
+            data = read_bundle_member(archive, COMMON_LIBRARY_NAME)
+        except KeyError:
+            pass
+        else:
+            BUNDLE_EXTRACT_DIR.mkdir(parents=True, exist_ok=True)
+            (BUNDLE_EXTRACT_DIR / COMMON_LIBRARY_NAME).write_bytes(data)
+    return paths
+
+# --- マクロフォルダの走査（ワーカースレッド） ---
+def scan_directory(directory: Path):
+    """フォルダ直下のサブフォルダ名と、TTLファイル名 → 更新日時を返す（隠しファイル・テンプレートは除外）"""
+    subdirs, files = [], {}
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            elif entry.name.lower().endswith(".ttl") and entry.name not in EXCLUDED_TTL_NAMES:
+                files[entry.name] = entry.stat().st_mtime_ns
+    subdirs.sort()
+    return subdirs, {name: files[name] for name in sorted(files)}
+
+def read_directory(directory: Path, old_files):
+    """フォルダを読み、TTL名 → 情報を返す（ヘッダーは更新日時が変わったTTLだけ読み直す）"""
+    subdirs, file_mtimes = scan_directory(directory)
+    files = {}
+    for name, mtime in file_mtimes.items():
+        meta = old_files.get(name)
+        if not meta or meta.get("mtime") != mtime:
+            meta = {"mtime": mtime, **read_macro_header(directory / name)}
+        files[name] = meta
+    return subdirs, files
+
+def scan_macro_tree(macro_root: Path, out_queue: queue.Queue, cancel: threading.Event,
+                    cached_dirs=None, force=False):
+    """マクロフォルダを幅優先で走査し、フォルダごとの結果をキューに送る
+
+    cached_dirs（前回の索引）があれば、更新日時が変わっていないフォルダは読み直さずに使う。
+    force=True の場合はすべてのフォルダを読み直す（TTLのヘッダーは更新日時が同じなら再利用）。
+    送るメッセージ: ("dir", 相対フォルダ, サブフォルダ名, TTL名 → 情報, 変更の有無) /
+    ("error", 相対フォルダ, 内容) / ("done",)
+    相対フォルダはツリーのノードIDと同じく '/' 区切り（ルートは ''）。
+    """
+    cached_dirs = cached_dirs or {}
+    if cached_dirs:
+        # キャッシュから表示したツリーをすぐ検索できるよう、先に索引を作る
+        out_queue.put(("index", MacroSearchIndex(cached_dirs)))
+    dirs = {}
+    any_changed = not cached_dirs
+    pending = deque([""])
+    while pending:
+        if cancel.is_set():
+            return
+        rel_dir = pending.popleft()
+        directory = macro_root / rel_dir if rel_dir else macro_root
+        cached = cached_dirs.get(rel_dir)
+        try:
+            dir_mtime = os.stat(directory).st_mtime_ns
+            if cached and not force and cached.get("mtime") == dir_mtime:
+                subdirs, files, changed = cached["subdirs"], cached["files"], False
+            else:
+                subdirs, files = read_directory(directory, cached["files"] if cached else {})
+                changed = not cached or cached.get("subdirs") != subdirs or cached.get("files") != files
+        except OSError as e:
+            out_queue.put(("error", rel_dir, str(e)))
+            continue
+        dirs[rel_dir] = {"mtime": dir_mtime, "subdirs": subdirs, "files": files}
+        any_changed = any_changed or changed
+        out_queue.put(("dir", rel_dir, subdirs, files, changed))
+        pending.extend(f"{rel_dir}/{name}" if rel_dir else name for name in subdirs)
+    if cancel.is_set():
+        return
+    save_macro_index(macro_root, dirs)
+    if any_changed or len(dirs) != len(cached_dirs):
+        out_queue.put(("index", MacroSearchIndex(dirs)))
+    out_queue.put(("done",))
+
+# --- 検索索引 ---
+def leaf_node(rel_dir, name):
+    """TTLのツリー上のノードID（ルート直下のTTLは未分類ノードの下）"""
+    return f"{rel_dir or UNGROUPED_NODE}/{name}"
+
+def node_chain(rel_dir):
+    """TTLを表示するために開く必要のあるフォルダノード（ルートから順に）"""
+    if not rel_dir:
+        return ["", UNGROUPED_NODE]
+    parts = rel_dir.split("/")
+    return [""] + ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+class MacroSearchIndex:
+    """マクロ名・接続ホスト・ユーザー・メモの検索索引（走査スレッドで作成する）
+
+    3文字以上の語はトライグラム（3文字の部分文字列）で候補を絞ってから部分一致を確認し、
+    1〜2文字の語はソート済みの語の一覧から前方一致で探す。
+    空白区切りの複数語はすべてを含むものに絞り込む（AND検索）。
+    """
+
+    def __init__(self, dirs):
+        self.entries = []  # (相対フォルダ, TTL名)
+        self.texts = []    # 検索対象の文字列（小文字）
+        self.trigrams = {}
+        tokens = set()
+        for rel_dir, entry in dirs.items():
+            for name, meta in entry["files"].items():
+                entry_id = len(self.entries)
+                text = " ".join(
+                    [name[:-4]] + [meta.get(key, "") for key in ("host", "user", "memo")]
+                ).lower()
+                self.entries.append((rel_dir, name))
+                self.texts.append(text)
+                for gram in {text[i:i + 3] for i in range(len(text) - 2)}:
+                    self.trigrams.setdefault(gram, []).append(entry_id)
+                tokens.update((token, entry_id) for token in TOKEN_SPLIT_PATTERN.split(text) if token)
+        self.tokens = sorted(tokens)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _match_term(self, term):
+        if len(term) >= 3:
+            postings = [self.trigrams.get(term[i:i + 3], ()) for i in range(len(term) - 2)]
+            candidates = min(postings, key=len)
+            return {i for i in candidates if term in self.texts[i]}
+        matched = set()
+        for pos in range(bisect_left(self.tokens, (term,)), len(self.tokens)):
+            token, entry_id = self.tokens[pos]
+            if not token.startswith(term):
+                break
+            matched.add(entry_id)
+        return matched
+
+    def search(self, query):
+        """一致したエントリ番号を昇順で返す"""
+        result = None
+        for term in sorted(set(query.lower().split()), key=len, reverse=True):
+            matched = self._match_term(term)
+            result = matched if result is None else result & matched
+            if not result:
+                return []
+        return sorted(result or ())
+
+# --- 疎通確認の結果 ---
+probe_state = {"signature": None, "entries": {}}
+
+def load_probe_report():
+    """疎通確認の結果を読み込む（ファイルが変わっていなければ前回の内容を使う）"""
+    try:
+        st = PROBE_REPORT_FILE.stat()
+    except OSError:
+        probe_state.update(signature=None, entries={})
+        return
+    signature = (st.st_mtime_ns, st.st_size)
+    if signature == probe_state["signature"]:
+        return
+    try:
+        entries = json.loads(PROBE_REPORT_FILE.read_text(encoding="utf-8")).get("entries", {})
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"[疎通確認の結果の読み込み失敗] {e}")
+        entries = {}
+    probe_state.update(signature=signature, entries=entries)
+
+def probe_status(rel_dir, name):
+    """TTLの疎通確認の結果を表示用の文字列で返す（未確認なら空）"""
+    entry = probe_state["entries"].get(f"{rel_dir}/{name}" if rel_dir else name)
+    if not entry:
+        return ""
+    label = PROBE_LABELS.get(entry.get("status"), entry.get("status", ""))
+    if entry.get("latency_ms") is not None:
+        label += f" {entry['latency_ms']}ms"
+    return f"{label}（{entry.get('checked_at', '').replace('T', ' ')}）"
+
+# --- ツリー構築（走査結果を受け取り、フォルダを開いたときに中身を挿入する） ---
+macro_dirs = {}          # 相対フォルダ → (サブフォルダ名, TTL名 → 情報)
+populated_nodes = set()  # 中身を挿入済みのノード
+placeholders = {}        # ノード → 「読み込み中…」の仮ノード
+scan_state = {"queue": None, "cancel": None, "visited": set()}
+search_state = {"index": None, "after_id": None, "active": False, "opened": set()}
+
+def node_dir(node):
+    """ノードIDに対応する相対フォルダ（未分類ノードはルート直下のTTL）"""
+    return "" if node == UNGROUPED_NODE else node
+
+def add_placeholder(node):
+    if node not in placeholders:
+        placeholders[node] = tree.insert(node, "end", text="読み込み中…")
+
+def remove_placeholder(node):
+    placeholder = placeholders.pop(node, None)
+    if placeholder and tree.exists(placeholder):
+        tree.delete(placeholder)
+
+def update_placeholder(node):
+    """走査済みで空のフォルダには仮ノードを付けない（開けないようにする）"""
+    contents = macro_dirs.get(node_dir(node))
+    if contents is None or contents[0] or contents[1]:
+        add_placeholder(node)
+    else:
+        remove_placeholder(node)
+
+def child_specs(node):
+    """ノードの子を表示順に返す（ノードID, 表示名, 値。フォルダの値は None）"""
+    rel_dir = node_dir(node)
+    subdirs, files = macro_dirs[rel_dir]
+    if node == "":
+        specs = [(name, name, None) for name in subdirs]
+        if files:
+            specs.append((UNGROUPED_NODE, "未分類", None))
+        return specs
+    specs = []
+    if node != UNGROUPED_NODE:
+        specs.extend((f"{node}/{name}", name, None) for name in subdirs)
+    specs.extend(
+        (f"{node}/{name}", name, [str(Path(rel_dir) / name), probe_status(rel_dir, name)]) for name in files
+    )
+    return specs
+
+def forget_subtree(node):
+    """削除するノード以下の挿入済み・仮ノードの記録を消す"""
+    prefix = node + "/"
+    for known in [n for n in populated_nodes if n == node or n.startswith(prefix)]:
+        populated_nodes.discard(known)
+    for known in [n for n in placeholders if n == node or n.startswith(prefix)]:
+        placeholders.pop(known)
+
+def sync_children(node):
+    """挿入済みのノードの子を最新の走査結果に合わせる（既存の子や開閉状態はそのまま残す）"""
+    specs = child_specs(node)
+    wanted = {iid for iid, _, _ in specs}
+    for iid in tree.get_children(node):
+        if iid not in wanted:
+            forget_subtree(iid)
+            tree.delete(iid)
+    for index, (iid, label, values) in enumerate(specs):
+        if tree.exists(iid):
+            continue
+        if values is None:
+            tree.insert(node, index, iid=iid, text=f"📁 {label}")
+            update_placeholder(iid)
+        else:
+            tree.insert(node, index, iid=iid, text=label, values=values)
+
+def populate_node(node):
+    """フォルダノードの中身（サブフォルダ・TTL）をツリーに挿入する"""
+    if node in populated_nodes or node_dir(node) not in macro_dirs:
+        return
+    populated_nodes.add(node)
+    remove_placeholder(node)
+    sync_children(node)
+
+def refresh_node(node):
+    """走査結果が変わったノードの表示を更新する"""
+    if not tree.exists(node):
+        return
+    if node in populated_nodes:
+        sync_children(node)
+    elif node == "" or tree.item(node, "open"):
+        populate_node(node)
+    else:
+        update_placeholder(node)
+
+def on_dir_scanned(rel_dir, subdirs, files, changed):
+    """走査結果を反映する（キャッシュから表示済みで変更がなければ何もしない）"""
+    scan_state["visited"].add(rel_dir)
+    if not changed and rel_dir in macro_dirs:
+        return
+    macro_dirs[rel_dir] = (subdirs, files)
+    refresh_node(rel_dir)
+    if rel_dir == "":
+        refresh_node(UNGROUPED_NODE)
+
+def on_tree_open(event=None):
+    node = tree.focus()
+    if node:
+        populate_node(node)
+
+def count_macros():
+    return sum(len(files) for _, files in macro_dirs.values())
+
+def poll_scan_queue(out_queue):
+    """走査結果をまとめてUIに反映する（after() で定期的に呼ばれる）"""
+    if out_queue is not scan_state["queue"]:
+        return  # 再読込で破棄された走査
+    for _ in range(SCAN_BATCH_SIZE):
+        try:
+            message = out_queue.get_nowait()
+        except queue.Empty:
+            break
+        if message[0] == "dir":
+            on_dir_scanned(*message[1:])
+        elif message[0] == "index":
+            search_state["index"] = message[1]
+            if search_state["active"]:
+                apply_search()
+        elif message[0] == "error":
+            print(f"[フォルダ読み込み失敗] {message[1]}: {message[2]}")
+        elif message[0] == "done":
+            # 今回の走査で見つからなかったフォルダ（削除済み）を索引から外す
+            for rel_dir in [d for d in macro_dirs if d not in scan_state["visited"]]:
+                del macro_dirs[rel_dir]
+            scan_state["queue"] = None
+            if SEARCH_TEXT.get().strip():
+                apply_search()  # 走査中に追加されたノードにも絞り込みを反映する
+            else:
+                STATUS_TEXT.set(f"マクロ {count_macros()} 件（フォルダ {len(macro_dirs)} 件）")
+            return
+    STATUS_TEXT.set(f"マクロを確認中… フォルダ {len(scan_state['visited'])} 件 / 表示中のマクロ {count_macros()} 件")
+    root.after(SCAN_POLL_MS, poll_scan_queue, out_queue)
+
+def build_tree(tree, force=False):
+    """前回の索引からツリーを即座に表示し、マクロフォルダとの差分確認をバックグラウンドで開始する
+
+    force=True（再読込ボタン）の場合は、更新日時に関係なくすべてのフォルダを読み直す。
+    マクロルートにバンドル（zip / tar）を指定した場合は、その索引からツリーを作る。
+    """
+    if scan_state["cancel"] is not None:
+        scan_state["cancel"].set()
     tree.delete(*tree.get_children())
+    macro_dirs.clear()
+    populated_nodes.clear()
+    placeholders.clear()
+    scan_state["visited"] = set()
+    search_state.update(index=None, active=False, opened=set())
+    load_probe_report()
+
     macro_root = Path(MACROS_DIR.get())
-    grouped_nodes = {}
-    ungrouped_ttls = []
+    if is_bundle(macro_root):
+        # バンドルは索引（index.json）だけを読んで表示し、TTLは起動時に展開する
+        STATUS_TEXT.set(f"バンドルを読み込み中… {macro_root.name}")
+        out_queue, cancel = queue.Queue(), threading.Event()
+        scan_state.update(queue=out_queue, cancel=cancel)
+        threading.Thread(target=scan_bundle, args=(macro_root, out_queue, cancel), daemon=True).start()
+        root.after(SCAN_POLL_MS, poll_scan_queue, out_queue)
+        return
+    if not macro_root.is_dir():
+        scan_state.update(queue=None, cancel=None)
+        STATUS_TEXT.set(f"マクロルートが見つかりません: {macro_root}")
+        return
+    cached_dirs = load_macro_index(macro_root)
+    for rel_dir, entry in cached_dirs.items():
+        macro_dirs[rel_dir] = (entry["subdirs"], entry["files"])
+    if "" in macro_dirs:
+        populate_node("")
+        STATUS_TEXT.set(f"前回の索引からマクロ {count_macros()} 件を表示しました（更新を確認中…）")
+    else:
+        STATUS_TEXT.set("マクロを読み込み中…")
 
-    for ttl_path in macro_root.rglob("*.ttl"):
-        if ttl_path.name == "template.ttl":
-            continue
-        rel_parts = ttl_path.relative_to(macro_root).parts
-        if len(rel_parts) == 1:
-            ungrouped_ttls.append(ttl_path)
+    out_queue, cancel = queue.Queue(), threading.Event()
+    scan_state.update(queue=out_queue, cancel=cancel)
+    threading.Thread(
+        target=scan_macro_tree, args=(macro_root, out_queue, cancel, cached_dirs, force), daemon=True
+    ).start()
+    root.after(SCAN_POLL_MS, poll_scan_queue, out_queue)
+
+# --- マクロの再生成（generate_ttl_macros の MacroGenerator をこのプロセス内で実行する） ---
+generator_state = {"generator": None, "running": False, "progress": (0, 0)}
+
+def dirs_to_rescan(rel_dirs, known):
+    """TTLを書き出したフォルダと、新しく作られたフォルダを子に持つ親フォルダ（読み直すフォルダ）"""
+    result = set()
+    for rel_dir in rel_dirs:
+        result.add(rel_dir)
+        while rel_dir:
+            parent, _, name = rel_dir.rpartition("/")
+            if parent in known and name in known[parent][0]:
+                break
+            result.add(parent)
+            rel_dir = parent
+    return result
+
+def rescan_dirs(macro_root: Path, rel_dirs, known):
+    """指定したフォルダだけを読み直す（ワーカースレッドから呼ばれる）。前回の索引があればその分も更新する"""
+    index = load_macro_index(macro_root)
+    scanned = {}
+    for rel_dir in sorted(rel_dirs):
+        directory = macro_root / rel_dir if rel_dir else macro_root
+        try:
+            dir_mtime = os.stat(directory).st_mtime_ns
+            subdirs, files = read_directory(directory, known[rel_dir][1] if rel_dir in known else {})
+        except OSError as e:
+            print(f"[フォルダ読み込み失敗] {rel_dir}: {e}")
             continue
+        scanned[rel_dir] = (subdirs, files)
+        index[rel_dir] = {"mtime": dir_mtime, "subdirs": subdirs, "files": files}
+    if index and scanned:
+        save_macro_index(macro_root, index)
+    return scanned
+
+def poll_regenerate_progress():
+    if not generator_state["running"]:
+        return
+    done, total = generator_state["progress"]
+    STATUS_TEXT.set(f"マクロを再生成中… {done}/{total} 行" if total else "マクロを再生成中…（台帳を読み込み中）")
+    root.after(REGENERATE_POLL_MS, poll_regenerate_progress)
+
+def regenerate_macros():
+    """台帳から入力の変わったマクロだけを再生成し、TTLを書き出したフォルダのノードだけを更新する
+
+    生成はワーカースレッドで行い、テンプレート・台帳は MacroGenerator に保持して2回目以降は変更時だけ読み直す。
+    """
+    if generator_state["running"]:
+        return
+    macro_root = Path(MACROS_DIR.get())
+    if is_bundle(macro_root) or not macro_root.is_dir():
+        messagebox.showwarning("再生成", "マクロルートにはフォルダを指定してください（バンドルは再生成できません）。")
+        return
+    macro_root = macro_root.resolve()
+    known = dict(macro_dirs)  # ワーカースレッドで参照する走査結果
+
+    def run():
+        generator = generator_state["generator"]
+        if generator is None or generator.output_dir != macro_root:
+            # 生成モジュールは初回の再生成時に読み込む（ランチャーの起動を遅くしない）
+            from generate_ttl_macros import MacroGenerator
+            generator = MacroGenerator(output_dir=macro_root)
+            generator_state["generator"] = generator
+        result = generator.generate(progress=lambda done, total: generator_state.update(progress=(done, total)))
+        written_dirs = {path.parent.relative_to(macro_root).as_posix() for path in result.written}
+        written_dirs = {"" if rel_dir == "." else rel_dir for rel_dir in written_dirs}
+        return result, rescan_dirs(macro_root, dirs_to_rescan(written_dirs, known), known)
+
+    def on_done(outcome, error):
+        generator_state["running"] = False
+        regenerate_button.configure(state=tk.NORMAL)
+        if error is not None:
+            STATUS_TEXT.set("マクロの再生成に失敗しました")
+            messagebox.showerror("再生成", f"マクロの再生成に失敗しました:\n{error}")
+            return
+        result, scanned = outcome
+        # 親フォルダから順に反映する（新しいフォルダのノードを親に挿入してから中身を更新する）
+        for rel_dir, (subdirs, files) in scanned.items():
+            macro_dirs[rel_dir] = (subdirs, files)
+            refresh_node(rel_dir)
+            if rel_dir == "":
+                refresh_node(UNGROUPED_NODE)
+        if scanned:
+            dirs = {rel_dir: {"subdirs": subdirs, "files": files} for rel_dir, (subdirs, files) in macro_dirs.items()}
+            run_in_background(lambda: MacroSearchIndex(dirs), on_index_built)
+        counts = result.counts
+        STATUS_TEXT.set(
+            f"再生成: 生成 {counts['success']} 件, 変更なし {counts['skip']} 件, エラー {counts['error']} 件"
+            f"（{result.timings['total']:.2f}秒）"
+        )
+        errors = result.errors
+        if errors:
+            lines = [f"No.{row.label}: {row.message}" for row in errors[:REGENERATE_MAX_ERRORS]]
+            if len(errors) > REGENERATE_MAX_ERRORS:
+                lines.append(f"ほか {len(errors) - REGENERATE_MAX_ERRORS} 件（詳細は logs/generate_inprocess.log）")
+            messagebox.showwarning("再生成", f"{len(errors)} 件の行でエラーがありました。\n\n" + "\n".join(lines))
+
+    def on_index_built(index, error):
+        if error is not None:
+            print(f"[検索索引の作成失敗] {error}")
+            return
+        search_state["index"] = index
+        if search_state["active"]:
+            apply_search()
+
+    generator_state.update(running=True, progress=(0, 0))
+    regenerate_button.configure(state=tk.DISABLED)
+    run_in_background(run, on_done)
+    poll_regenerate_progress()
+
+# --- 検索（入力に合わせてツリーを絞り込む） ---
+def canonical_children(node):
+    """ノードの本来の子（表示順）。検索で切り離した子も含む"""
+    return [iid for iid, _, _ in child_specs(node) if tree.exists(iid)]
+
+def restore_tree():
+    """検索で切り離したノードを元の順序で戻し、検索のために開いたフォルダを閉じる"""
+    for node in list(populated_nodes):
+        if tree.exists(node):
+            tree.set_children(node, *canonical_children(node))
+    for node in search_state["opened"]:
+        if tree.exists(node):
+            tree.item(node, open=False)
+    search_state.update(active=False, opened=set())
+
+def apply_search():
+    """検索語に一致するTTLとその親フォルダだけを残し、それ以外をツリーから切り離す"""
+    search_state["after_id"] = None
+    query = SEARCH_TEXT.get().strip()
+    if not query:
+        if search_state["active"]:
+            restore_tree()
+        if scan_state["queue"] is None:
+            STATUS_TEXT.set(f"マクロ {count_macros()} 件（フォルダ {len(macro_dirs)} 件）")
+        return
+    index = search_state["index"]
+    if index is None:
+        STATUS_TEXT.set("検索索引を作成中です。完了後に検索結果を表示します…")
+        search_state["active"] = True
+        return
+
+    started = time.perf_counter()
+    matches = index.search(query)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    visible = {}  # ノード → 表示する子
+    for entry_id in matches[:SEARCH_MAX_RESULTS]:
+        rel_dir, name = index.entries[entry_id]
+        chain = node_chain(rel_dir) + [leaf_node(rel_dir, name)]
+        for parent, child in zip(chain, chain[1:]):
+            populate_node(parent)
+            if not tree.exists(child):
+                break  # 索引作成後に削除されたフォルダ・TTL
+        else:
+            for parent, child in zip(chain, chain[1:]):
+                visible.setdefault(parent, set()).add(child)
+
+    for node in list(populated_nodes):
+        if tree.exists(node):
+            shown = visible.get(node, ())
+            tree.set_children(node, *[iid for iid in canonical_children(node) if iid in shown])
+    for node in visible:
+        if node and not tree.item(node, "open"):
+            tree.item(node, open=True)
+            search_state["opened"].add(node)
+    search_state["active"] = True
+
+    if len(matches) > SEARCH_MAX_RESULTS:
+        STATUS_TEXT.set(f"検索: {len(matches)} 件一致（先頭 {SEARCH_MAX_RESULTS} 件を表示, {elapsed_ms:.1f} ms）")
+    else:
+        STATUS_TEXT.set(f"検索: {len(matches)} 件一致（{elapsed_ms:.1f} ms）")
+
+def on_search_changed(*args):
+    """入力のたびに検索せず、入力が止まってから検索する"""
+    if search_state["after_id"] is not None:
+        root.after_cancel(search_state["after_id"])
+    search_state["after_id"] = root.after(SEARCH_DELAY_MS, apply_search)
+
+# GUI は直接実行したときだけ作成する（走査・検索索引の関数はベンチマークなどから import できる）
+if __name__ == "__main__":
+    # --- GUI初期化 ---
+    root = tk.Tk()
+    root.title("Tera Term マクロランチャー")
+
+    # --- 設定値の初期化 ---
+    MACROS_DIR = tk.StringVar(master=root, value="")
+    TTERM_PATH = tk.StringVar(master=root, value="")
+    STATUS_TEXT = tk.StringVar(master=root, value="")
+    SEARCH_TEXT = tk.StringVar(master=root, value="")
+    SESSION_TEXT = tk.StringVar(master=root, value="")
+
+    # --- GUIレイアウト構築 ---
+    config = load_launcher_config()
+    TTERM_PATH.set(config.get("teraterm_path", ""))
+    MACROS_DIR.set(config.get("macros_root", ""))
+
+    frame_config = tk.Frame(root)
+    frame_config.pack(fill=tk.X, padx=10, pady=5)
+
+    # パス入力欄
+    labels = ["Tera Termのパス:", "TTLマクロルート:"]
+    entries = [TTERM_PATH, MACROS_DIR]
+    buttons = [
+        lambda: TTERM_PATH.set(filedialog.askopenfilename(filetypes=[("実行ファイル", "*.exe")])),
+        lambda: MACROS_DIR.set(filedialog.askdirectory())
+    ]
+
+    for i in range(2):
+        tk.Label(frame_config, text=labels[i]).grid(row=i, column=0, sticky="w")
+        tk.Entry(frame_config, textvariable=entries[i], width=60).grid(row=i, column=1, padx=5)
+        tk.Button(frame_config, text="参照", command=buttons[i]).grid(row=i, column=2, padx=5)
+
+    tk.Button(frame_config, text="保存", command=save_config).grid(row=0, column=3, padx=5)
+    tk.Button(
+        frame_config, text="バンドル",
+        command=lambda: MACROS_DIR.set(filedialog.askopenfilename(
+            filetypes=[("マクロのバンドル", "*.zip *.tar *.tar.gz *.tgz")]) or MACROS_DIR.get())
+    ).grid(row=1, column=4, padx=5)
+    tk.Button(frame_config, text="再読込", command=lambda: build_tree(tree, force=True)).grid(row=1, column=3, padx=5)
+    regenerate_button = tk.Button(frame_config, text="再生成", command=regenerate_macros)
+    regenerate_button.grid(row=0, column=4, padx=5)
+
+    # 検索欄（マクロ名・接続ホスト・ユーザー・メモ）
+    frame_search = tk.Frame(root)
+    frame_search.pack(fill=tk.X, padx=10)
+    tk.Label(frame_search, text="検索:").pack(side=tk.LEFT)
+    search_entry = tk.Entry(frame_search, textvariable=SEARCH_TEXT, width=60)
+    search_entry.pack(side=tk.LEFT, padx=5)
+    search_entry.bind("<Escape>", lambda e: SEARCH_TEXT.set(""))
+    tk.Button(frame_search, text="クリア", command=lambda: SEARCH_TEXT.set("")).pack(side=tk.LEFT)
+    tk.Button(frame_search, text="ログ検索", command=open_log_search).pack(side=tk.LEFT, padx=5)
+    SEARCH_TEXT.trace_add("write", on_search_changed)
+
+    frame_tree = tk.Frame(root)
+    frame_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+
+    # ツリー構造表示
+    tree = ttk.Treeview(frame_tree, columns=("path", "probe"), show="tree headings", selectmode="extended")
+    tree.heading("#0", text="マクロ構成")
+    tree.heading("path", text="TTLマクロ格納パス（相対）")
+    tree.heading("probe", text="疎通確認")
+    tree.column("#0", anchor="w", width=300)
+    tree.column("path", anchor="w", width=500)
+    tree.column("probe", anchor="w", width=260)
+
+    tree.bind("<Double-1>", on_double_click)
+    tree.bind("<Return>", on_enter_key)
+    tree.bind("<Button-3>", on_right_click)
+    tree.bind("<<TreeviewOpen>>", on_tree_open)
+
+    tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    scrollbar = tk.Scrollbar(frame_tree, orient="vertical", command=tree.yview)
+    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    tree.configure(yscrollcommand=scrollbar.set)
+
+    # 実行・編集・終了ボタン
+    frame_bottom = tk.Frame(root)
+    frame_bottom.pack(pady=10)
+
+    buttons = [
+        ("接続実行", lambda: on_double_click(None)),
+        ("選択を一括接続", launch_selected),
+        ("編集", edit_selected_ttl),
+        ("最新のログ", open_latest_log),
+        ("閉じる", root.quit)
+    ]
+
+    for i, (label, cmd) in enumerate(buttons):
+        tk.Button(frame_bottom, text=label, command=cmd).grid(row=0, column=i, padx=20)
+
+    # ステータスバー
+    tk.Label(root, textvariable=STATUS_TEXT, anchor="w", relief=tk.SUNKEN, bd=1).pack(side=tk.BOTTOM, fill=tk.X)
+
+    # 起動したセッションの一覧（PID・状態・終了コード）
+    frame_sessions = tk.Frame(root)
+    frame_sessions.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=5)
+    frame_sessions_header = tk.Frame(frame_sessions)
+    frame_sessions_header.pack(fill=tk.X)
+    tk.Label(frame_sessions_header, textvariable=SESSION_TEXT, anchor="w").pack(side=tk.LEFT)
+    session_panel = ttk.Treeview(frame_sessions, columns=("pid", "status", "code"), show="tree headings", height=6)
+    session_panel.heading("#0", text="TTLマクロ")
+    session_panel.heading("pid", text="PID")
+    session_panel.heading("status", text="状態")
+    session_panel.heading("code", text="終了コード")
+    session_panel.column("#0", anchor="w", width=400)
+    session_panel.column("pid", anchor="e", width=80)
+    session_panel.column("status", anchor="w", width=200)
+    session_panel.column("code", anchor="e", width=80)
+    session_panel.pack(fill=tk.X)
+
+    session_manager = SessionManager(
+        session_panel,
+        config.get("max_concurrent_starts", DEFAULT_SESSION_CONFIG["max_concurrent_starts"]),
+        config.get("start_interval_ms", DEFAULT_SESSION_CONFIG["start_interval_ms"]),
+        config.get("start_window_sec", DEFAULT_SESSION_CONFIG["start_window_sec"]),
+    )
+    tk.Button(frame_sessions_header, text="終了済みを消去", command=session_manager.clear_finished).pack(side=tk.RIGHT)
 
-        parent = ''
-        for i, part in enumerate(rel_parts):
-            node_id = '/'.join(rel_parts[:i+1])
-            if not tree.exists(node_id):
-                if i == len(rel_parts) - 1:
-                    rel_path = str(ttl_path.relative_to(macro_root))
-                    tree.insert(parent, "end", iid=node_id, text=part, values=[rel_path])
-                else:
-                    tree.insert(parent, "end", iid=node_id, text=f"📁 {part}")
-            parent = node_id
-
-    if ungrouped_ttls:
-        if not tree.exists('ungrouped'):
-            tree.insert('', 'end', iid='ungrouped', text='📁 未分類')
-        for ttl_path in ungrouped_ttls:
-            leaf_id = f"ungrouped/{ttl_path.name}"
-            rel_path = str(ttl_path.relative_to(macro_root))
-            tree.insert('ungrouped', "end", iid=leaf_id, text=ttl_path.name, values=[rel_path])
-
-# --- GUIレイアウト構築 ---
-config = load_launcher_config()
-TTERM_PATH.set(config.get("teraterm_path", ""))
-MACROS_DIR.set(config.get("macros_root", ""))
-
-frame_config = tk.Frame(root)
-frame_config.pack(fill=tk.X, padx=10, pady=5)
-
-# パス入力欄
-labels = ["Tera Termのパス:", "TTLマクロルート:"]
-entries = [TTERM_PATH, MACROS_DIR]
-buttons = [
-    lambda: TTERM_PATH.set(filedialog.askopenfilename(filetypes=[("実行ファイル", "*.exe")])),
-    lambda: MACROS_DIR.set(filedialog.askdirectory())
-]
-
-for i in range(2):
-    tk.Label(frame_config, text=labels[i]).grid(row=i, column=0, sticky="w")
-    tk.Entry(frame_config, textvariable=entries[i], width=60).grid(row=i, column=1, padx=5)
-    tk.Button(frame_config, text="参照", command=buttons[i]).grid(row=i, column=2, padx=5)
-
-tk.Button(frame_config, text="保存", command=save_config).grid(row=0, column=3, padx=5)
-tk.Button(frame_config, text="再読込", command=lambda: build_tree(tree)).grid(row=1, column=3, padx=5)
-
-frame_tree = tk.Frame(root)
-frame_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
-
-# ツリー構造表示
-tree = ttk.Treeview(frame_tree, columns=("path",), show="tree headings")
-tree.heading("#0", text="マクロ構成")
-tree.heading("path", text="TTLマクロ格納パス（相対）")
-tree.column("#0", anchor="w", width=300)
-tree.column("path", anchor="w", width=500)
-
-tree.bind("<Double-1>", on_double_click)
-tree.bind("<Return>", on_enter_key)
-tree.bind("<Button-3>", on_right_click)
-
-tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-scrollbar = tk.Scrollbar(frame_tree, orient="vertical", command=tree.yview)
-scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-tree.configure(yscrollcommand=scrollbar.set)
-
-# 実行・編集・終了ボタン
-frame_bottom = tk.Frame(root)
-frame_bottom.pack(pady=10)
-
-buttons = [
-    ("接続実行", lambda: on_double_click(None)),
-    ("編集", edit_selected_ttl),
-    ("閉じる", root.quit)
-]
-
-for i, (label, cmd) in enumerate(buttons):
-    tk.Button(frame_bottom, text=label, command=cmd).grid(row=0, column=i, padx=20)
-
-build_tree(tree)
-root.mainloop()
+    build_tree(tree)
+    schedule_log_retention(config.get("log_retention_interval_min", DEFAULT_LOG_RETENTION_INTERVAL_MIN))
+    root.mainloop()